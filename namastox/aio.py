@@ -0,0 +1,297 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX asyncio interface to the action functions
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+import asyncio
+import importlib
+import functools
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from namastox.logger import get_logger
+from namastox.utils import read_config, use_paths, repository_root, RepositoryPaths, CURRENT_PATHS
+
+LOG = get_logger(__name__)
+
+# kinds of action: reads are coalesced and share the lock of the RA, writes hold it alone
+READ = 'read'
+WRITE = 'write'
+
+# pools running the actions: CPU bound work (parsing YAML, RDKit...) is sent to worker processes and 
+# file system operations to threads. Reports are rendered in their own pool of processes, so slow reports
+# do not delay other requests
+PROCESS = 'process'
+REPORT = 'report'
+THREAD = 'thread'
+
+# pools created the first time are needed (see getPool). The sizes can be defined in the configuration
+# file with the keys "async_threads", "async_processes" and "async_reports". With a size of 0, the
+# actions of this kind run in the thread pool
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+POOL_SIZES = {THREAD: ('async_threads', 8),
+              PROCESS: ('async_processes', 2),
+              REPORT: ('async_reports', 2)}
+
+# reads in progress, indexed by (action, arguments, repository root), awaited by identical reads (see run).
+# Every entry is a list with the future and the number of reads waiting for it
+INFLIGHT = {}
+
+# locks of the RAs in use, indexed by (raname, repository root) (see lockRa)
+RA_LOCKS = {}
+
+class RaLock:
+    ''' Lock of an RA, shared by the reads and held alone by the writes, so reads never see an RA
+        being written by another coroutine. Waiting writes go before new reads. Only the actions run
+        through this module are ordered: commands run at the same time by other processes (e.g.
+        the CLI) are not
+    '''
+    def __init__(self):
+        self.condition = asyncio.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        self.users = 0
+
+    @contextlib.asynccontextmanager
+    async def shared (self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writer and self.waiting_writers == 0)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def exclusive (self):
+        async with self.condition:
+            self.waiting_writers += 1
+            try:
+                await self.condition.wait_for(lambda: not self.writer and self.readers == 0)
+            finally:
+                self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+@contextlib.asynccontextmanager
+async def lockRa (raname, mode):
+    ''' holds the lock of the RA given as argument, shared for READ and alone for WRITE, while the
+        block runs. Actions which do not refer to a single RA (e.g. batch reports) are not locked
+    '''
+    if type(raname) != str:
+        yield
+        return
+
+    key = (raname, repository_root())
+    entry = RA_LOCKS.get(key)
+    if entry is None:
+        entry = RA_LOCKS[key] = RaLock()
+    entry.users += 1
+    try:
+        async with (entry.shared() if mode == READ else entry.exclusive()):
+            yield
+    finally:
+        entry.users -= 1
+        if entry.users == 0:
+            del RA_LOCKS[key]
+
+def getPool (kind):
+    ''' returns the pool of the kind given as argument, creating it if needed '''
+    with POOLS_LOCK:
+        if kind in POOLS:
+            return POOLS[kind]
+
+        success, config = read_config()
+        if not success:
+            config = {}
+
+        config_key, size = POOL_SIZES[kind]
+        size = int(config.get(config_key, size))
+        if size <= 0:
+            POOLS[kind] = None
+        elif kind == THREAD:
+            POOLS[kind] = ThreadPoolExecutor(max_workers=size, thread_name_prefix='namastox-aio')
+        else:
+            POOLS[kind] = ProcessPoolExecutor(max_workers=size)
+        return POOLS[kind]
+
+def discardPool (kind, pool):
+    ''' forgets the pool given as argument, broken because a worker died (e.g. killed when out of memory),
+        so a new one is created for the next actions. Does nothing if it was already replaced
+    '''
+    with POOLS_LOCK:
+        if POOLS.get(kind) is not pool:
+            return
+        del POOLS[kind]
+
+    LOG.error(f'a worker of the {kind} pool died unexpectedly, the pool will be recreated')
+    pool.shutdown(wait=False)
+
+def shutdown (wait=True):
+    ''' stops the pools, which will be created again if another action is run '''
+    with POOLS_LOCK:
+        pools = list(POOLS.values())
+        POOLS.clear()
+    for ipool in pools:
+        if ipool is not None:
+            ipool.shutdown(wait=wait)
+
+def callAction (module, function, config, args, kwargs):
+    ''' imports and calls the action function. Run in the pools, using the repository of the
+        caller when it was injected with use_paths
+    '''
+    func = getattr(importlib.import_module(f'namastox.{module}'), function)
+    if config is None:
+        return func(*args, **kwargs)
+    with use_paths(RepositoryPaths(config)):
+        return func(*args, **kwargs)
+
+async def runInPool (kind, module, function, args, kwargs):
+    ''' runs the action in the pool of the given kind. Broken pools are replaced: the actions
+        submitted to a broken pool are retried in the new one, but those already running fail
+        with BrokenProcessPool, since they might have been partially completed
+    '''
+    paths = CURRENT_PATHS.get()
+    config = None
+    if paths is not None:
+        success, config = paths.getConfig()
+
+    call = functools.partial(callAction, module, function, config, args, kwargs)
+    loop = asyncio.get_running_loop()
+    while True:
+        pool_kind = kind
+        pool = getPool(kind)
+        if pool is None:
+            pool_kind = THREAD
+            pool = getPool(THREAD)
+
+        try:
+            future = loop.run_in_executor(pool, call)
+        except BrokenProcessPool:
+            discardPool(pool_kind, pool)
+            continue
+
+        try:
+            return await future
+        except BrokenProcessPool:
+            discardPool(pool_kind, pool)
+            raise
+
+async def run (module, function, mode, kind, *args, **kwargs):
+    ''' runs the action function of the module given as argument in the pool of the given kind (PROCESS,
+        REPORT or THREAD) and returns its results. Identical reads (READ mode) running at the same time are coalesced
+        into a single call, and every caller receives its own copy of the result, as in utils.single_flight. Writes
+        (WRITE mode) on the same RA, identified by the first argument, are run one after the other and never at the
+        same time as reads of the RA, without blocking the actions on other RAs (see RaLock)
+    '''
+    raname = args[0] if len(args) > 0 else kwargs.get('raname')
+
+    if mode == READ:
+        key = (module, function, args, tuple(sorted(kwargs.items())), repository_root())
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+
+        if key is not None:
+            entry = INFLIGHT.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return copy.deepcopy(await asyncio.shield(entry[0]))
+
+            entry = INFLIGHT[key] = [asyncio.ensure_future(runLocked(raname, mode, kind, module, function, args, kwargs)), 0]
+            try:
+                result = await asyncio.shield(entry[0])
+            finally:
+                if INFLIGHT.get(key) is entry:
+                    del INFLIGHT[key]
+
+            # the result kept in the future is only read by the waiters, which receive copies
+            if entry[1] > 0:
+                return copy.deepcopy(result)
+            return result
+
+    return await runLocked(raname, mode, kind, module, function, args, kwargs)
+
+async def runLocked (raname, mode, kind, module, function, args, kwargs):
+    async with lockRa(raname, mode):
+        return await runInPool(kind, module, function, args, kwargs)
+
+def asyncAction (module, function, mode, kind):
+    ''' returns a coroutine function with the signature of the action function given as argument '''
+    sync_func = getattr(importlib.import_module(f'namastox.{module}'), function)
+
+    @functools.wraps(sync_func)
+    async def wrapper(*args, **kwargs):
+        return await run(module, function, mode, kind, *args, **kwargs)
+
+    return wrapper
+
+# manage
+action_new = asyncAction('manage', 'action_new', WRITE, THREAD)
+action_clone = asyncAction('manage', 'action_clone', WRITE, THREAD)
+action_rename = asyncAction('manage', 'action_rename', WRITE, THREAD)
+action_kill = asyncAction('manage', 'action_kill', WRITE, THREAD)
+action_list = asyncAction('manage', 'action_list', READ, THREAD)
+action_setusers = asyncAction('manage', 'action_setusers', WRITE, THREAD)
+action_getusers = asyncAction('manage', 'action_getusers', READ, THREAD)
+action_privileges = asyncAction('manage', 'action_privileges', READ, THREAD)
+action_steps = asyncAction('manage', 'action_steps', READ, PROCESS)
+action_info = asyncAction('manage', 'action_info', READ, PROCESS)
+action_similar = asyncAction('manage', 'action_similar', READ, PROCESS)
+getWorkflow = asyncAction('manage', 'getWorkflow', READ, PROCESS)
+getCatalogue = asyncAction('manage', 'getCatalogue', READ, PROCESS)
+
+# update
+action_update = asyncAction('update', 'action_update', WRITE, PROCESS)
+action_update_general_info = asyncAction('update', 'action_update_general_info', WRITE, PROCESS)
+action_update_result = asyncAction('update', 'action_update_result', WRITE, PROCESS)
+action_update_table = asyncAction('update', 'action_update_table', WRITE, PROCESS)
+
+# status and results
+action_status = asyncAction('status', 'action_status', READ, PROCESS)
+action_results = asyncAction('results', 'action_results', READ, PROCESS)
+action_result = asyncAction('results', 'action_result', READ, PROCESS)
+action_task = asyncAction('results', 'action_task', READ, THREAD)
+action_pendingTasks = asyncAction('results', 'action_pendingTasks', READ, PROCESS)
+action_pendingTask = asyncAction('results', 'action_pendingTask', READ, PROCESS)
+action_upstreamTasks = asyncAction('results', 'action_upstreamTasks', READ, PROCESS)
+
+# notes
+action_notes = asyncAction('notes', 'action_notes', READ, PROCESS)
+action_note = asyncAction('notes', 'action_note', READ, PROCESS)
+action_note_add = asyncAction('notes', 'action_note_add', WRITE, PROCESS)
+action_note_delete = asyncAction('notes', 'action_note_delete', WRITE, PROCESS)
+
+# reports only read the RA (and write their own files), so they share the lock with the other reads and
+# slow reports do not block them. Batch reports use their own pool of processes
+action_report = asyncAction('report', 'action_report', READ, REPORT)
+action_report_batch = asyncAction('report', 'action_report_batch', READ, THREAD)
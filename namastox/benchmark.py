@@ -0,0 +1,539 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX benchmarks
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import platform
+import tracemalloc
+from namastox.logger import get_logger
+from namastox.ra import Ra
+from namastox.manage import action_new, action_kill, getWorkflow
+from namastox.update import action_update_general_info, action_update_result
+from namastox.report import action_report
+
+LOG = get_logger(__name__)
+
+# prefix used for the names of the RAs synthesized by the benchmarks
+BENCH_PREFIX = 'bench_'
+
+# renderers timed by the report benchmark
+REPORT_FORMATS = ['yaml', 'excel', 'word', 'html']
+
+# CLI commands timed by the startup benchmark, with their arguments ({raname} is replaced by the RA name). The
+# commands are run with --local, so a daemon running does not change what is measured
+STARTUP_COMMANDS = {'info': ['-c', 'info', '-r', '{raname}'],
+                    'steps': ['-c', 'steps', '-r', '{raname}'],
+                    'status': ['-c', 'status', '-r', '{raname}'],
+                    'results': ['-c', 'results', '-r', '{raname}'],
+                    'report': ['-c', 'report', '-r', '{raname}', '-f', 'yaml']}
+
+# workflows bundled with NAMASTOX, used by the lifecycle benchmark
+LIFECYCLE_WORKFLOWS = ['workflow19.tsv', 'workflow21.tsv', 'workflow30.tsv']
+
+# fraction of positive decisions made in the lifecycle benchmark. Negative decisions often end the workflow
+LIFECYCLE_POSITIVE = 0.8
+
+SUBSTANCES_SMILES = ['c1ccccc1O', 'CC(=O)Oc1ccccc1C(=O)O', 'CN1CCC[C@H]1c1cccnc1', 'CCO',
+                     'Clc1ccc(Cl)c(Cl)c1', 'O=C(O)CCCCC(=O)O', 'CC(C)Cc1ccc(C(C)C(=O)O)cc1']
+
+def synthesizeGeneral (nsubstances, workflow):
+    ''' returns a General Info dictionary with the number of substances given as argument
+    '''
+    substances = []
+    for i in range(nsubstances):
+        substances.append({'name': f'substance{i}',
+                           'id': f'ID{i:05d}',
+                           'casrn': f'{1000+i}-00-0',
+                           'smiles': SUBSTANCES_SMILES[i % len(SUBSTANCES_SMILES)]})
+
+    return {'general': {'title': 'benchmark risk assessment',
+                        'general_description': 'synthetic risk assessment generated for benchmarking',
+                        'background': 'none',
+                        'endpoint': 'benchmark endpoint',
+                        'administration_route': 'oral',
+                        'species': 'human',
+                        'regulatory_framework': 'none',
+                        'uncertainty': 'none',
+                        'workflow_custom': workflow,
+                        'substances': substances}}
+
+def synthesizeResult (node, nsubstances, nmethods, nlinks):
+    ''' returns a result for the workflow node given as argument, with a number of values,
+        methods and links proportional to the arguments
+    '''
+    itask = node.getTask()
+    iid = node.getVal('id')
+
+    result = {'id': iid,
+              'label': itask.getLabel(),
+              'summary': f'summary of results obtained for {iid}',
+              'date': time.strftime("%d/%b/%Y %H:%M", time.localtime()),
+              'links': [{'label': f'document_{i}', 'File': f'document_{iid}_{i}.pdf'} for i in range(nlinks)]}
+
+    if node.getVal('category') == 'LOGICAL':
+        result['decision'] = True
+        result['justification'] = f'justification of the decision made in {iid}'
+        return result
+
+    result['result_type'] = 'value'
+    result['values'] = [{'substance': f'substance{i}', 'parameter': 'IC50', 'value': 0.1*(i+1),
+                         'unit': 'uM', 'method': 'method0'} for i in range(nsubstances)]
+    result['uncertainties'] = [{'uncertainty': f'+/- {0.01*(i+1):.2f}', 'term': 'Likely (0.66-0.90)'} for i in range(nsubstances)]
+    result['methods'] = [{'name': f'method{i}', 'description': f'description of method {i}',
+                          'link': f'http://methods.org/method{i}', 'sensitivity': 0.9,
+                          'specificity': 0.8, 'sd': 0.1} for i in range(nmethods)]
+    return result
+
+def synthesizeRa (raname, nresults, nsubstances, nmethods, nlinks, workflow='workflow30.tsv'):
+    ''' creates in the repository a new RA using the default workflow given as argument,
+        containing the number of results, substances, methods and links given as argument
+    '''
+    success, results = action_new(raname)
+    if not success:
+        return False, results
+
+    ra = Ra(raname)
+    success, results = ra.load()
+    if not success:
+        return False, results
+
+    success, results = ra.updateGeneralInfo(synthesizeGeneral(nsubstances, workflow))
+    if not success:
+        return False, results
+
+    # results are assigned to the workflow nodes in order, cycling if required
+    nodes = [inode for inode in ra.workflow.nodes.values() if inode.getVal('category') != 'END']
+    for i in range(nresults):
+        ra.results.append(synthesizeResult(nodes[i % len(nodes)], nsubstances, nmethods, nlinks))
+
+    ra.ra['step'] = nresults+1
+    ra.ra['tasks_completed'] = nresults
+    ra.save()
+
+    return True, ra
+
+def timeCall (func, repeat):
+    ''' calls func the number of times given as argument and returns a dictionary with
+        the timings (in seconds) and the peak memory (in KB) allocated by a single call
+    '''
+    timings = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        success, results = func()
+        timings.append(time.perf_counter()-t0)
+        if not success:
+            return False, results
+
+    # memory is measured in a separate call, since tracemalloc slows down the execution
+    tracemalloc.start()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return True, {'min': min(timings),
+                  'mean': sum(timings)/len(timings),
+                  'max': max(timings),
+                  'peak_kb': peak/1024.0}
+
+def benchmarkReports (cases, formats=REPORT_FORMATS, repeat=3, workflow='workflow30.tsv'):
+    ''' synthesizes an RA for every case (dictionary with the number of results, substances,
+        methods and links), times Ra.load and every renderer in formats and removes the RA
+    '''
+    output = {}
+    for icase in cases:
+        case_name = f"r{icase['results']}_s{icase['substances']}_m{icase['methods']}_l{icase['links']}"
+        raname = f'{BENCH_PREFIX}{case_name}'
+
+        # remove leftovers of interrupted runs
+        action_kill(raname)
+
+        success, results = synthesizeRa(raname, icase['results'], icase['substances'],
+                                        icase['methods'], icase['links'], workflow)
+        if not success:
+            LOG.error(f'unable to synthesize RA for case {case_name}: {results}')
+            continue
+
+        output[case_name] = {}
+
+        def load ():
+            return Ra(raname).load()
+
+        timers = [('Ra.load', load)]
+        for iformat in formats:
+            timers.append((iformat, lambda iformat=iformat: action_report(raname, iformat)))
+
+        for itimer, ifunc in timers:
+            success, results = timeCall(ifunc, repeat)
+            if not success:
+                LOG.error(f'{case_name} {itimer} failed: {results}')
+                continue
+            output[case_name][itimer] = results
+            LOG.info(f"{case_name} {itimer}: {results['min']*1000.0:.1f} ms, peak {results['peak_kb']:.0f} KB")
+
+        action_kill(raname)
+
+    return output
+
+def parseImportTime (stderr):
+    ''' parses the output of python -X importtime and returns the total import time (in seconds) and 
+        a list of tuples (module, seconds) with the modules imported at the top level, slowest first
+    '''
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+
+        # nested imports are indented two spaces per level
+        name = fields[2]
+        depth = (len(name) - len(name.lstrip()) - 1)//2
+        if depth == 0:
+            modules.append((name.strip(), int(fields[1])/1e6))
+
+    modules.sort(key=lambda x: x[1], reverse=True)
+    return sum([i[1] for i in modules]), modules
+
+def benchmarkStartup (commands=list(STARTUP_COMMANDS.keys()), repeat=3, workflow='workflow30.tsv'):
+    ''' runs every CLI command given as argument in a new interpreter with python -X importtime, on a small
+        synthesized RA, and returns for every command the wall time of the process and the total import time,
+        with the slowest modules imported. Commands whose process fails are returned with the key "error" 
+        instead of timings
+    '''
+    raname = f'{BENCH_PREFIX}startup'
+
+    # remove leftovers of interrupted runs
+    action_kill(raname)
+
+    success, results = synthesizeRa(raname, 10, 1, 2, 2, workflow)
+    if not success:
+        LOG.error(f'unable to synthesize RA for startup benchmark: {results}')
+        return {}
+
+    output = {}
+    for icommand in commands:
+        arguments = [iarg.format(raname=raname) for iarg in STARTUP_COMMANDS[icommand]] + ['--local']
+        walls = []
+        imports = []
+        error = None
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            process = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'namastox.namastox_scr'] + arguments, 
+                                     capture_output=True, text=True)
+            walls.append(time.perf_counter()-t0)
+            if process.returncode != 0:
+                lines = [iline for iline in process.stderr.splitlines() if not iline.startswith('import time:')]
+                error = f'exit code {process.returncode}: ' + ' '.join(lines[-3:])
+                break
+            total, modules = parseImportTime(process.stderr)
+            imports.append(total)
+
+        if error is not None:
+            output[icommand] = {'error': error}
+            LOG.error(f'{icommand} failed with {error}')
+            continue
+
+        output[icommand] = {'wall': {'min': min(walls), 'mean': sum(walls)/len(walls), 'max': max(walls)},
+                            'imports': {'min': min(imports), 'mean': sum(imports)/len(imports), 'max': max(imports),
+                                        'slowest': modules[:10]}}
+
+        LOG.info(f"{icommand}: {min(walls)*1000.0:.1f} ms, imports {min(imports)*1000.0:.1f} ms")
+
+    action_kill(raname)
+
+    return output
+
+def percentiles (timings):
+    ''' returns a dictionary with the number of timings, their min, mean, max and 50, 90, 95 and 99 
+        percentiles (nearest rank)
+    '''
+    timings = sorted(timings)
+    n = len(timings)
+    output = {'count': n, 'min': timings[0], 'mean': sum(timings)/n, 'max': timings[-1]}
+    for ip in (50, 90, 95, 99):
+        output[f'p{ip}'] = timings[min(n-1, max(0, -(-ip*n//100)-1))]
+    return output
+
+def folderSize (path):
+    ''' returns a tuple with the number of files and the size (in bytes) of the folder '''
+    nfiles = 0
+    nbytes = 0
+    for ientry in os.scandir(path):
+        if ientry.is_file():
+            nfiles += 1
+            nbytes += ientry.stat().st_size
+    return nfiles, nbytes
+
+def runLifecycle (raname, workflow, nsteps, nsubstances, nmethods, nlinks, formats, seed, keep=False):
+    ''' runs the lifecycle of a new RA: creation, general info, nsteps results for the active nodes of the 
+        workflow (each followed by the workflow graph) and the reports in the formats given as argument. 
+        Returns a tuple (success, results) with the timings of every action, as a dictionary of lists, 
+        and the growth of the history folder after every step
+    '''
+    rng = random.Random(seed)
+    timings = {}
+    hist_growth = []
+
+    def timed (action, func, *args):
+        t0 = time.perf_counter()
+        success, results = func(*args)
+        timings.setdefault(action, []).append(time.perf_counter()-t0)
+        if not success:
+            raise RuntimeError(f'{action} failed for {raname}: {results}')
+        return results
+
+    # remove leftovers of interrupted runs
+    action_kill(raname)
+
+    try:
+        timed('new', action_new, raname)
+        timed('general_info', action_update_general_info, raname, synthesizeGeneral(nsubstances, workflow))
+        hist_path = os.path.join(Ra(raname).rapath, 'hist')
+
+        for istep in range(nsteps):
+            ra = Ra(raname)
+            timed('load', ra.load)
+            active_nodes = ra.ra['active_nodes_id']
+            if not active_nodes:
+                break
+
+            # results are entered for one of the active nodes, making random decisions
+            node = ra.getNode(active_nodes[rng.randrange(len(active_nodes))])
+            result = synthesizeResult(node, nsubstances, nmethods, nlinks)
+            if 'decision' in result:
+                result['decision'] = rng.random() < LIFECYCLE_POSITIVE
+
+            timed('update', action_update_result, raname, None, {'result': [result]})
+            timed('graph', getWorkflow, raname)
+            hist_growth.append(folderSize(hist_path))
+
+        for iformat in formats:
+            timed(f'report_{iformat}', action_report, raname, iformat)
+
+    except Exception as e:
+        return False, str(e)
+
+    finally:
+        if not keep:
+            action_kill(raname)
+
+    return True, {'timings': timings, 'hist': hist_growth}
+
+def runLifecycleBatch (cases):
+    ''' runs the lifecycles described in the list of cases (dictionaries with the arguments of runLifecycle), 
+        returning a list of tuples (case, success, results). Used by the worker processes
+    '''
+    output = []
+    for icase in cases:
+        success, results = runLifecycle(**icase)
+        output.append((icase, success, results))
+    return output
+
+def benchmarkLifecycle (nras, nsteps, workflows=LIFECYCLE_WORKFLOWS, nsubstances=2, nmethods=2, nlinks=2, 
+                        formats=['yaml', 'html'], workers=1, seed=0, keep=False):
+    ''' creates nras RAs, assigned in turn to the workflows given as argument, and drives each one through 
+        nsteps updates (see runLifecycle). With more than one worker, the RAs are distributed among a pool of 
+        processes running concurrently. Returns a tuple with the latency percentiles of every action, by workflow 
+        and for all of them, and a summary with the throughput and the growth of the history folders
+    '''
+    cases = [{'raname': f'{BENCH_PREFIX}life_{i:04d}', 'workflow': workflows[i % len(workflows)], 'nsteps': nsteps,
+              'nsubstances': nsubstances, 'nmethods': nmethods, 'nlinks': nlinks, 'formats': formats,
+              'seed': seed+i, 'keep': keep} for i in range(nras)]
+
+    t0 = time.perf_counter()
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        batches = [cases[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            finished = []
+            for ibatch in executor.map(runLifecycleBatch, batches):
+                finished += ibatch
+    else:
+        finished = runLifecycleBatch(cases)
+    wall = time.perf_counter()-t0
+
+    timings = {}
+    hist_files = []
+    hist_bytes = []
+    nupdates = 0
+    failed = []
+    for icase, success, results in finished:
+        if not success:
+            LOG.error(results)
+            failed.append(icase['raname'])
+            continue
+        for iaction, itimings in results['timings'].items():
+            timings.setdefault(icase['workflow'], {}).setdefault(iaction, []).extend(itimings)
+            timings.setdefault('all', {}).setdefault(iaction, []).extend(itimings)
+        nupdates += len(results['timings'].get('update', []))
+        if len(results['hist']) > 0:
+            hist_files.append(results['hist'][-1][0])
+            hist_bytes.append(results['hist'][-1][1])
+
+    output = {iworkflow: {iaction: percentiles(itimings) for iaction, itimings in iactions.items()}
+              for iworkflow, iactions in timings.items()}
+
+    summary = {'ras': nras, 'failed': failed, 'workers': workers, 'wall': wall,
+               'updates': nupdates, 
+               'updates_per_second': nupdates/wall,
+               'ras_per_second': (nras-len(failed))/wall,
+               'hist_files_per_ra': sum(hist_files)/max(len(hist_files), 1),
+               'hist_bytes_per_ra': sum(hist_bytes)/max(len(hist_bytes), 1),
+               'hist_bytes_per_update': sum(hist_bytes)/max(nupdates, 1)}
+
+    for iaction, istats in output.get('all', {}).items():
+        LOG.info(f"{iaction}: {istats['count']} calls, p50 {istats['p50']*1000.0:.1f} ms, "
+                 f"p95 {istats['p95']*1000.0:.1f} ms, max {istats['max']*1000.0:.1f} ms")
+    LOG.info(f"{nupdates} updates in {wall:.1f} s ({summary['updates_per_second']:.1f} updates/s), "
+             f"history of {summary['hist_bytes_per_ra']/1024.0:.0f} KB per RA")
+
+    return output, summary
+
+def compareBaseline (current, baseline, tolerance=0.25, memory_tolerance=0.25):
+    ''' compares the timings of current against a baseline produced by a previous run. Timings
+        slower than the baseline by more than tolerance (as fraction), or with a memory peak larger
+        by more than memory_tolerance, are flagged as regressions
+    '''
+    comparison = {}
+    regressions = []
+    for icase in current:
+        if not icase in baseline:
+            continue
+        comparison[icase] = {}
+        for itimer in current[icase]:
+            # failed runs (e.g. startup commands) have no timings
+            if not itimer in baseline[icase] or type(current[icase][itimer]) != dict or type(baseline[icase][itimer]) != dict:
+                continue
+            ratio = current[icase][itimer]['min'] / max(baseline[icase][itimer]['min'], 1e-9)
+            mem_ratio = None
+            if 'peak_kb' in current[icase][itimer] and 'peak_kb' in baseline[icase][itimer]:
+                mem_ratio = current[icase][itimer]['peak_kb'] / max(baseline[icase][itimer]['peak_kb'], 1e-9)
+            time_regression = ratio > 1.0+tolerance
+            memory_regression = mem_ratio is not None and mem_ratio > 1.0+memory_tolerance
+            regression = time_regression or memory_regression
+            comparison[icase][itimer] = {'time_ratio': ratio, 'memory_ratio': mem_ratio, 
+                                         'time_regression': time_regression, 'memory_regression': memory_regression,
+                                         'regression': regression}
+            if regression:
+                regressions.append(f'{icase}/{itimer}')
+
+    return comparison, regressions
+
+def parseCases (nresults, nsubstances, nmethods, nlinks):
+    ''' returns the list of cases obtained combining every size given as argument
+        each argument is a comma-separated list of integers
+    '''
+    sizes = [[int(i) for i in str(ilist).split(',')] for ilist in (nresults, nsubstances, nmethods, nlinks)]
+    cases = []
+    for ir in sizes[0]:
+        for isub in sizes[1]:
+            for im in sizes[2]:
+                for il in sizes[3]:
+                    cases.append({'results': ir, 'substances': isub, 'methods': im, 'links': il})
+    return cases
+
+def main():
+
+    parser = argparse.ArgumentParser(description='NAMASTOX benchmarks')
+
+    parser.add_argument('-c', '--command',
+                        action='store',
+                        choices=['report', 'startup', 'lifecycle'],
+                        help='Benchmark suite: \'report\', \'startup\' or \'lifecycle\'',
+                        default='report')
+
+    parser.add_argument('--results', help='comma-separated number of results', default='10,100')
+    parser.add_argument('--substances', help='comma-separated number of substances', default='1,10')
+    parser.add_argument('--methods', help='comma-separated number of methods', default='2')
+    parser.add_argument('--links', help='comma-separated number of links', default='2')
+    parser.add_argument('--formats', help='comma-separated report formats', default=','.join(REPORT_FORMATS))
+    parser.add_argument('--commands', help='comma-separated CLI commands (startup)', default=','.join(STARTUP_COMMANDS.keys()))
+    parser.add_argument('--repeat', help='repetitions of every timing', type=int, default=3)
+    parser.add_argument('--ras', help='number of RAs created (lifecycle)', type=int, default=10)
+    parser.add_argument('--steps', help='number of updates of every RA (lifecycle)', type=int, default=20)
+    parser.add_argument('--workflows', help='comma-separated bundled workflows: 19, 21 and/or 30 (lifecycle)', default='19,21,30')
+    parser.add_argument('--workers', help='number of processes running RAs concurrently (lifecycle)', type=int, default=1)
+    parser.add_argument('--seed', help='seed of the random decisions (lifecycle)', type=int, default=0)
+    parser.add_argument('--keep', help='do not remove the RAs created (lifecycle)', action='store_true')
+    parser.add_argument('--log-level', help='minimum level of the messages written to the log file (e.g. WARNING)', required=False)
+    parser.add_argument('-o', '--outfile', help='output JSON file (stdout if not provided)', required=False)
+    parser.add_argument('-b', '--baseline', help='baseline JSON file produced by a previous run', required=False)
+    parser.add_argument('--tolerance', help='accepted slowdown versus the baseline, as fraction', type=float, default=0.25)
+    parser.add_argument('--memory-tolerance', help='accepted increase of the memory peak versus the baseline, as fraction', type=float, default=0.25)
+
+    args = parser.parse_args()
+
+    if args.log_level is not None:
+        from namastox.logger import configure_logging
+        configure_logging(level=args.log_level)
+
+    output = {'benchmark': args.command,
+              'date': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+              'python': platform.python_version(),
+              'platform': platform.platform()}
+
+    if args.command == 'report':
+        cases = parseCases(args.results, args.substances, args.methods, args.links)
+        output['results'] = benchmarkReports(cases, args.formats.split(','), args.repeat)
+
+    elif args.command == 'startup':
+        output['results'] = benchmarkStartup(args.commands.split(','), args.repeat)
+
+    elif args.command == 'lifecycle':
+        workflows = [f'workflow{i.strip()}.tsv' for i in args.workflows.split(',')]
+        output['results'], output['summary'] = benchmarkLifecycle(args.ras, args.steps, workflows,
+                                                                  int(args.substances.split(',')[0]),
+                                                                  int(args.methods.split(',')[0]),
+                                                                  int(args.links.split(',')[0]),
+                                                                  args.formats.split(','), args.workers,
+                                                                  args.seed, args.keep)
+
+    regressions = []
+    failures = [icase for icase, iresults in output['results'].items() if 'error' in iresults]
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        output['comparison'], regressions = compareBaseline(output['results'], baseline['results'], 
+                                                                   args.tolerance, args.memory_tolerance)
+        output['regressions'] = regressions
+
+    if args.outfile is not None:
+        with open(args.outfile, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if len(failures) > 0:
+        LOG.error(f'benchmark runs failed: {failures}')
+    if len(regressions) > 0:
+        LOG.error(f'performance regressions detected: {regressions}')
+    if len(failures) > 0 or len(regressions) > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX persistent caches
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import pickle
+import sqlite3
+from namastox.logger import get_logger
+from namastox.utils import cache_repository_path
+
+LOG = get_logger(__name__)
+
+# maximum number of parameters used in a single SQL query
+SQL_CHUNK = 500
+
+def connectCache (name):
+    ''' returns a connection to the SQLite database with the name given as argument,
+        stored in the cache folder. WAL mode allows concurrent readers and writers
+        from different processes
+    '''
+    connection = sqlite3.connect(os.path.join(cache_repository_path(), name), timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+def toJSON (value):
+    ''' serializes values returned by Flame, which can be NumPy scalars '''
+    if hasattr(value, 'item'):
+        value = value.item()
+    return json.dumps(value)
+
+class PredictionCache:
+    ''' Class storing the predictions of individual molecules, obtained with local models. The
+        predictions are indexed by molecule key (InChIKey or canonical SMILES), model name
+        and version. The timestamp of the model is stored with every prediction and predictions
+        obtained with a different timestamp are ignored
+    '''
+    def __init__(self, dbname='predictions.db'):
+        ''' constructor '''
+        self.dbname = dbname
+        with connectCache(self.dbname) as connection:
+            connection.execute('''CREATE TABLE IF NOT EXISTS predictions (
+                                    molkey TEXT, model TEXT, version INTEGER, timestamp REAL,
+                                    quantitative INTEGER, value TEXT, lower TEXT, upper TEXT, created REAL,
+                                    PRIMARY KEY (molkey, model, version))''')
+        connection.close()
+
+    def get (self, model, version, timestamp, keys):
+        ''' returns a dictionary with the predictions found for the molecule keys given as argument
+            each prediction is a dictionary with keys value, lower, upper and quantitative
+        '''
+        if timestamp is None:
+            return {}
+
+        keys = list(set(keys))
+        hits = {}
+        connection = connectCache(self.dbname)
+        try:
+            for i in range(0, len(keys), SQL_CHUNK):
+                ikeys = keys[i:i+SQL_CHUNK]
+                query = ('SELECT molkey, quantitative, value, lower, upper FROM predictions '
+                         f'WHERE model=? AND version=? AND timestamp=? AND molkey IN ({",".join(["?"]*len(ikeys))})')
+                for row in connection.execute(query, [model, int(version), timestamp]+ikeys):
+                    hits[row[0]] = {'quantitative': bool(row[1]),
+                                    'value': json.loads(row[2]),
+                                    'lower': json.loads(row[3]),
+                                    'upper': json.loads(row[4])}
+        finally:
+            connection.close()
+
+        return hits
+
+    def put (self, model, version, timestamp, quantitative, predictions):
+        ''' stores the predictions, given as a dictionary indexed by molecule key, containing
+            dictionaries with keys value, lower and upper
+        '''
+        if timestamp is None:
+            return
+
+        now = time.time()
+        rows = [(ikey, model, int(version), timestamp, int(bool(quantitative)),
+                 toJSON(ipred['value']), toJSON(ipred['lower']), toJSON(ipred['upper']), now)
+                for ikey, ipred in predictions.items()]
+
+        connection = connectCache(self.dbname)
+        try:
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO predictions VALUES (?,?,?,?,?,?,?,?,?)', rows)
+        finally:
+            connection.close()
+
+        LOG.debug(f'{len(rows)} predictions of model {model} version {version} cached')
+
+    def clear (self, model=None):
+        ''' removes all the predictions, or only those of the model given as argument '''
+        connection = connectCache(self.dbname)
+        try:
+            with connection:
+                if model is None:
+                    connection.execute('DELETE FROM predictions')
+                else:
+                    connection.execute('DELETE FROM predictions WHERE model=?', [model])
+        finally:
+            connection.close()
+
+def savePlan (label, plan):
+    ''' stores the plan of the prediction identified by label, describing which molecules and
+        models were submitted to Flame and which ones must be obtained from the cache
+    '''
+    with open(os.path.join(cache_repository_path('plans'), f'{label}.pkl'), 'wb') as f:
+        pickle.dump(plan, f)
+
+def loadPlan (label):
+    ''' returns the plan of the prediction identified by label, or None if not found '''
+    plan_file = os.path.join(cache_repository_path('plans'), f'{label}.pkl')
+    if not os.path.isfile(plan_file):
+        return None
+    with open(plan_file, 'rb') as f:
+        return pickle.load(f)
+
+def removePlan (label):
+    plan_file = os.path.join(cache_repository_path('plans'), f'{label}.pkl')
+    if os.path.isfile(plan_file):
+        os.remove(plan_file)
@@ -0,0 +1,185 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX client for the CompTox dashboard
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import json
+import time
+import threading
+import urllib3
+from urllib3.util.ssl_ import create_urllib3_context
+from namastox.logger import get_logger
+from namastox.utils import read_config
+from namastox.cache import connectCache
+
+LOG = get_logger(__name__)
+
+COMPTOX_URL = "https://comptox.epa.gov/dashboard-api/batchsearch/chemicals"
+
+# responses are kept in the cache for this number of seconds (default one week)
+COMPTOX_TTL = 7*24*3600
+
+# maximum number of identifiers sent in a single request
+COMPTOX_BATCH = 100
+
+# identifier types used in the payload for every kind of search
+IDENTIFIER_TYPES = {'casrn': 'CASRN', 'name': 'chemical_name'}
+
+# pool of connections shared by all the requests of the process (see getPool)
+COMPTOX_POOL = None
+COMPTOX_LOCK = threading.Lock()
+
+def getEndpoint ():
+    ''' returns the CompTox endpoint, which can be defined with the environment variable NAMASTOX_COMPTOX_URL
+        or the key "comptox_url" of the configuration file. The endpoint can be the URL of a server 
+        compatible with the CompTox batch search or a local directory (or file:// URL) containing 
+        fixture files
+    '''
+    endpoint = os.environ.get('NAMASTOX_COMPTOX_URL')
+    if endpoint is None:
+        success, config = read_config()
+        if success and config.get('comptox_url'):
+            endpoint = config['comptox_url']
+    if endpoint is None:
+        endpoint = COMPTOX_URL
+    return endpoint
+
+def getTTL ():
+    ''' returns the time, in seconds, during which cached responses are considered valid '''
+    success, config = read_config()
+    if success and 'comptox_ttl' in config:
+        return float(config['comptox_ttl'])
+    return COMPTOX_TTL
+
+def getPool ():
+    ''' returns the pool of connections, created the first time it is needed '''
+    global COMPTOX_POOL
+
+    with COMPTOX_LOCK:
+        if COMPTOX_POOL is None:
+            ctx = create_urllib3_context()
+            ctx.load_default_certs()
+            ctx.options |= 0x4  # ssl.OP_LEGACY_SERVER_CONNECT
+            COMPTOX_POOL = urllib3.PoolManager(ssl_context=ctx, retries=urllib3.Retry(total=3, backoff_factor=0.5))
+        return COMPTOX_POOL
+
+def fixtureName (identifier):
+    ''' returns the name of the fixture file for the identifier given as argument '''
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', identifier.strip().lower()) + '.json'
+
+def searchFixtures (directory, identifiers):
+    ''' returns the records stored in the fixture directory for every identifier. The records of every 
+        identifier are stored as a JSON list in a file named as the identifier (lowercase, with the characters
+        not allowed in file names replaced by "_") with extension .json
+    '''
+    results = {}
+    for identifier in identifiers:
+        fixture = os.path.join(directory, fixtureName(identifier))
+        if os.path.isfile(fixture):
+            with open(fixture, 'r') as f:
+                results[identifier] = json.load(f)
+        else:
+            results[identifier] = []
+    return True, results
+
+def searchRemote (url, identifiers, kind):
+    ''' sends the identifiers to the CompTox batch search in groups of COMPTOX_BATCH and returns the records 
+        obtained for every identifier
+    '''
+    http = getPool()
+    results = {identifier: [] for identifier in identifiers}
+    for i in range(0, len(identifiers), COMPTOX_BATCH):
+        batch = identifiers[i:i+COMPTOX_BATCH]
+        payload = {"identifierTypes":[IDENTIFIER_TYPES[kind]],"massError":0,"downloadItems":[],
+                   "searchItems":"\n".join(batch),"inputType":"IDENTIFIER"}
+        try:
+            resp = http.request('POST', url, json=payload)
+        except Exception as ins:
+            return False, ins
+
+        if resp.status!=200:
+            return False, resp.status
+
+        # records are assigned to the identifier using the search value returned by the server
+        lookup = {identifier.lower(): identifier for identifier in batch}
+        for record in json.loads(resp.data):
+            identifier = batch[0]
+            if len(batch) > 1:
+                identifier = lookup.get(str(record.get('searchValue', '')).lower())
+                if identifier is None:
+                    continue
+            results[identifier].append(record)
+
+    return True, results
+
+def searchIdentifiers (identifiers, kind='casrn'):
+    ''' returns a dictionary with the list of CompTox records found for every identifier (CASRN or chemical
+        name, as defined by kind). Responses are stored in a persistent cache and only the identifiers 
+        missing in the cache, or expired, are searched, in batches
+    '''
+    if kind not in IDENTIFIER_TYPES:
+        return False, f'unknown identifier type {kind}'
+
+    identifiers = list(dict.fromkeys([str(i).strip() for i in identifiers if i is not None and str(i).strip() != '']))
+    if len(identifiers) == 0:
+        return False, 'no identifier provided'
+
+    connection = connectCache('comptox.db')
+    try:
+        with connection:
+            connection.execute('''CREATE TABLE IF NOT EXISTS comptox (
+                                    kind TEXT, identifier TEXT, response TEXT, created REAL,
+                                    PRIMARY KEY (kind, identifier))''')
+
+        results = {}
+        oldest = time.time()-getTTL()
+        for identifier in identifiers:
+            row = connection.execute('SELECT response FROM comptox WHERE kind=? AND identifier=? AND created>?', 
+                                     [kind, identifier, oldest]).fetchone()
+            if row is not None:
+                results[identifier] = json.loads(row[0])
+
+        missing = [identifier for identifier in identifiers if identifier not in results]
+        if len(missing) > 0:
+            endpoint = getEndpoint()
+            if endpoint.startswith('file://'):
+                endpoint = endpoint[7:]
+
+            if os.path.isdir(endpoint):
+                success, found = searchFixtures(endpoint, missing)
+            else:
+                success, found = searchRemote(endpoint, missing, kind)
+
+            if not success:
+                return False, found
+
+            now = time.time()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO comptox VALUES (?,?,?,?)', 
+                                       [(kind, identifier, json.dumps(records), now) for identifier, records in found.items()])
+            results.update(found)
+
+            LOG.debug(f'{len(missing)} of {len(identifiers)} identifiers searched in {endpoint}')
+    finally:
+        connection.close()
+
+    return True, results
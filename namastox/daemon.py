@@ -0,0 +1,244 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX daemon serving commands from a warm process
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import logging
+import argparse
+import threading
+import contextlib
+from multiprocessing.connection import Listener, Client, AuthenticationError
+from namastox.logger import get_logger
+from namastox.utils import read_config, cache_repository_path, apply_log_config, reload_config_if_changed
+
+LOG = get_logger(__name__)
+
+# commands are run one at a time, as they would be run from the command line
+DISPATCH_LOCK = threading.Lock()
+
+# set when a stop request is received
+STOP_EVENT = threading.Event()
+
+def getSocketPath ():
+    ''' returns the path of the Unix socket used by the daemon, which can be defined with the environment 
+        variable NAMASTOX_SOCKET or the key "daemon_socket" of the configuration file. By default, the socket
+        is placed in the cache folder of the repository. The folder is not created here, since this is called by 
+        every command to check whether a daemon is running
+    '''
+    socket_path = os.environ.get('NAMASTOX_SOCKET')
+    if socket_path is None:
+        success, config = read_config()
+        if not success:
+            return None
+        socket_path = config.get('daemon_socket')
+        if socket_path is None:
+            socket_path = os.path.join(config['root_repository'], 'cache', 'namastox.sock')
+    return socket_path
+
+def getAuthKey ():
+    ''' returns the key used to authenticate the clients, stored in the cache folder and readable only
+        by the owner. The key is generated the first time it is needed
+    '''
+    key_file = os.path.join(cache_repository_path(), 'daemon.key')
+    if not os.path.isfile(key_file):
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(32))
+    with open(key_file, 'rb') as f:
+        return f.read()
+
+def connect ():
+    ''' returns a connection to the daemon, or None if no daemon is running '''
+    socket_path = getSocketPath()
+    if socket_path is None or not os.path.exists(socket_path):
+        return None
+    try:
+        return Client(socket_path, family='AF_UNIX', authkey=getAuthKey())
+    except (OSError, EOFError, AuthenticationError) as e:
+        LOG.debug(f'unable to connect to daemon at {socket_path}: {e}')
+        return None
+
+def forward (args):
+    ''' sends the command defined in the arguments to the daemon and returns its results, as a tuple 
+        (success, results), or None if no daemon is running. The messages logged and the text printed 
+        by the daemon while running the command are reproduced here
+    '''
+    connection = connect()
+    if connection is None:
+        return None
+
+    try:
+        connection.send({'request': 'dispatch', 'args': vars(args)})
+        success, results, messages, output = connection.recv()
+    except (OSError, EOFError) as e:
+        # the command might have been executed, so it is not run again in this process
+        return False, f'connection with the daemon lost: {e}'
+    finally:
+        connection.close()
+
+    if output != '':
+        print (output, end='')
+    for level, message in messages:
+        LOG.log(level, message)
+
+    return success, results
+
+class CaptureHandler(logging.Handler):
+    ''' handler collecting the messages logged while a command is run, so they can be shown by the client '''
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelno, record.getMessage()))
+
+def run (args):
+    ''' runs the command and returns a tuple (success, results, messages, output) with the messages
+        logged and the text printed while running it
+    '''
+    from namastox.namastox_scr import runCommand
+    from namastox import ra, workflow
+
+    # the configuration may have been changed by "namastox -c config", which is always run locally
+    if reload_config_if_changed():
+        LOG.info('configuration file changed, the repository paths and the cached RAs are reloaded')
+        ra.enableCache()
+        workflow.enableCache()
+
+    capture = CaptureHandler()
+    output = io.StringIO()
+    logger = logging.getLogger('namastox')
+    logger.addHandler(capture)
+    try:
+        with contextlib.redirect_stdout(output):
+            success, results = runCommand(args)
+    except Exception as e:
+        LOG.error(f'command {args.command} failed with error: {e}')
+        success, results = False, f'command {args.command} failed with error: {e}'
+    finally:
+        logger.removeHandler(capture)
+
+    return success, results, capture.messages, output.getvalue()
+
+def handle (connection):
+    ''' serves the requests received in the connection '''
+    try:
+        message = connection.recv()
+        if message['request'] == 'ping':
+            connection.send((True, 'pong'))
+
+        elif message['request'] == 'stop':
+            STOP_EVENT.set()
+            connection.send((True, 'daemon stopped'))
+
+            # wake up the listener, waiting for a new connection
+            wakeup = connect()
+            if wakeup is not None:
+                wakeup.close()
+
+        elif message['request'] == 'dispatch':
+            args = argparse.Namespace(**message['args'])
+            with DISPATCH_LOCK:
+                results = run(args)
+            connection.send(results)
+
+    except (OSError, EOFError) as e:
+        LOG.debug(f'connection closed: {e}')
+    finally:
+        connection.close()
+
+def serve ():
+    ''' runs the daemon, listening on the Unix socket until stopped. The modules used by the commands
+        are imported once and the contents of the RAs and the compiled workflows are kept in memory
+    '''
+    from namastox import ra, workflow, manage, update, status, results, report
+
+    apply_log_config()
+
+    socket_path = getSocketPath()
+    if socket_path is None:
+        return False, 'unable to read the configuration'
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+
+    if os.path.exists(socket_path):
+        connection = connect()
+        if connection is not None:
+            connection.close()
+            return False, f'a daemon is already running at {socket_path}'
+
+        # socket left by a daemon which was not stopped properly
+        os.remove(socket_path)
+
+    ra.enableCache()
+    workflow.enableCache()
+
+    # the metrics of the daemon can be exposed at a local HTTP endpoint
+    success, config = read_config()
+    if success and config.get('metrics_port') is not None:
+        from namastox.metrics import serveMetrics
+        success, results = serveMetrics(int(config['metrics_port']))
+        if not success:
+            LOG.error(results)
+
+    listener = Listener(socket_path, family='AF_UNIX', authkey=getAuthKey())
+    os.chmod(socket_path, 0o600)
+    LOG.info(f'namastox daemon listening at {socket_path}')
+
+    STOP_EVENT.clear()
+    try:
+        while not STOP_EVENT.is_set():
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, OSError, EOFError) as e:
+                LOG.error(f'connection rejected: {e}')
+                continue
+
+            if STOP_EVENT.is_set():
+                connection.close()
+                break
+
+            threading.Thread(target=handle, args=(connection,), daemon=True).start()
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        from namastox.metrics import stopMetrics
+        stopMetrics()
+
+    return True, 'daemon stopped'
+
+def stop ():
+    ''' stops the daemon running, if any '''
+    connection = connect()
+    if connection is None:
+        return False, 'no daemon running'
+
+    try:
+        connection.send({'request': 'stop'})
+        return connection.recv()
+    except (OSError, EOFError):
+        return True, 'daemon stopped'
+    finally:
+        connection.close()
@@ -0,0 +1,229 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX local job queue
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from namastox.logger import get_logger
+from namastox.utils import id_generator
+from namastox.metrics import JOBS_TOTAL, JOB_SECONDS
+
+LOG = get_logger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_CANCELLING = 'cancelling'
+
+class JobQueue:
+    ''' Class running jobs in a bounded pool of worker processes. Submitting a job returns
+        immediately a job ID that can be used to check the status, cancel the job or retrieve
+        the results. Finished jobs not retrieved are removed after ttl seconds, calling the
+        cleanup function provided when the job was submitted. If a worker dies (e.g. killed when
+        out of memory) the jobs of the pool fail and a new pool is created for the next jobs
+    '''
+    def __init__(self, max_workers=2, ttl=3600):
+        ''' constructor '''
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def getExecutor (self):
+        ''' the pool of workers is created the first time a job is submitted, and again after
+            it was broken. Must be called holding self.lock
+        '''
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    def discardExecutor (self, executor):
+        ''' discards the broken pool of workers given as argument, unless it was already replaced '''
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self.executor = None
+
+        LOG.error('a worker of the job queue died unexpectedly, the pool of workers will be recreated')
+        executor.shutdown(wait=False)
+
+    def submit (self, func, *args, cleanup=None):
+        ''' submits func(*args) for execution and returns the job ID. The function must
+            return a tuple (success, results), as every action_* function in NAMASTOX
+        '''
+        self.purge()
+
+        job_id = id_generator(16)
+        while True:
+            with self.lock:
+                executor = self.getExecutor()
+                try:
+                    future = executor.submit(func, *args)
+                    break
+                except BrokenProcessPool:
+                    pass
+            self.discardExecutor(executor)
+
+        with self.lock:
+            self.jobs[job_id] = {'future': future,
+                                 'executor': executor,
+                                 'cancelled': False,
+                                 'cleanup': cleanup,
+                                 'submitted': time.time(),
+                                 'finished': None}
+
+        future.add_done_callback(lambda ifuture, job_id=job_id: self.onDone(job_id))
+
+        LOG.debug(f'job {job_id} submitted')
+        return job_id
+
+    def onDone (self, job_id):
+        ''' registers the time at which the job finished. Jobs cancelled while running are
+            cleaned up as soon as they finish, since nobody will retrieve the results
+        '''
+        with self.lock:
+            if not job_id in self.jobs:
+                return
+            job = self.jobs[job_id]
+            job['finished'] = time.time()
+            cancelled = job['cancelled']
+
+        future = job['future']
+        if cancelled or future.cancelled():
+            status = JOB_CANCELLED
+        elif future.exception() is None and future.result()[0]:
+            status = JOB_COMPLETED
+        else:
+            status = JOB_FAILED
+            if isinstance(future.exception(), BrokenProcessPool):
+                self.discardExecutor(job['executor'])
+        JOBS_TOTAL.inc(status=status)
+        JOB_SECONDS.observe(job['finished']-job['submitted'])
+
+        if cancelled:
+            self.remove(job_id)
+
+    def getStatus (self, job_id):
+        ''' returns a dictionary with the status of the job '''
+        self.purge()
+
+        with self.lock:
+            if not job_id in self.jobs:
+                return None
+            job = self.jobs[job_id]
+
+        future = job['future']
+        if job['cancelled'] and future.running():
+            status = JOB_CANCELLING
+        elif job['cancelled'] or future.cancelled():
+            status = JOB_CANCELLED
+        elif future.done():
+            status = JOB_FAILED
+            if future.exception() is None and future.result()[0]:
+                status = JOB_COMPLETED
+        elif future.running():
+            status = JOB_RUNNING
+        else:
+            status = JOB_QUEUED
+
+        return {'id': job_id,
+                'status': status,
+                'submitted': job['submitted'],
+                'finished': job['finished']}
+
+    def cancel (self, job_id):
+        ''' cancels the job and returns its new status, or None if the job was not found. Queued
+            jobs are never run and become "cancelled". Running jobs cannot be stopped: they are
+            "cancelling" until they finish, when their results are discarded
+        '''
+        with self.lock:
+            if not job_id in self.jobs:
+                return None
+            job = self.jobs[job_id]
+            job['cancelled'] = True
+
+        if job['future'].cancel() or job['future'].done():
+            self.remove(job_id)
+            status = JOB_CANCELLED
+        else:
+            status = JOB_CANCELLING
+
+        LOG.debug(f'job {job_id} {status}')
+        return status
+
+    def getResult (self, job_id):
+        ''' returns the results of a finished job, as a tuple (success, results), and removes
+            the job from the queue
+        '''
+        with self.lock:
+            if not job_id in self.jobs:
+                return False, f'job {job_id} not found'
+            job = self.jobs[job_id]
+
+        future = job['future']
+        if job['cancelled']:
+            return False, f'job {job_id} was cancelled'
+
+        if not future.done():
+            return False, f'job {job_id} is still running'
+
+        try:
+            success, results = future.result()
+        except Exception as e:
+            success, results = False, f'job {job_id} failed with error: {e}'
+
+        self.remove(job_id)
+        return success, results
+
+    def remove (self, job_id):
+        ''' removes the job from the queue, calling its cleanup function '''
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+
+        if job is not None and job['cleanup'] is not None:
+            try:
+                job['cleanup']()
+            except Exception as e:
+                LOG.error(f'cleanup of job {job_id} failed with error: {e}')
+
+    def purge (self):
+        ''' removes finished jobs older than self.ttl seconds '''
+        now = time.time()
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job['finished'] is not None and now-job['finished'] > self.ttl]
+
+        for job_id in expired:
+            LOG.debug(f'job {job_id} expired')
+            self.remove(job_id)
+
+    def shutdown (self, wait=True):
+        ''' cancels all pending jobs and stops the pool of workers '''
+        for job_id in list(self.jobs.keys()):
+            self.cancel(job_id)
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
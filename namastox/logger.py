@@ -21,12 +21,34 @@
 # You should have received a copy of the GNU General Public License
 # along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import sys
+import atexit
 import functools
 import logging
-import sys
-from logging.handlers import RotatingFileHandler
+import threading
+from queue import SimpleQueue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
 
+# all NAMASTOX loggers are children of this one, which holds the handlers
+ROOT_LOGGER = 'namastox'
+
+# log records are passed through this queue to a single file handler, running in a
+# background thread, so logging does not perform file I/O in the calling thread
+LOG_QUEUE = None
+LOG_LISTENER = None
+LOG_LOCK = threading.RLock()
+
+# directory and level of the log file. Can be set with the environment variables
+# NAMASTOX_LOG_DIR and NAMASTOX_LOG_LEVEL or calling configure_logging. The level only
+# applies to the file: the console always shows INFO messages
+LOG_DIR = os.environ.get('NAMASTOX_LOG_DIR', './')
+LOG_LEVEL = os.environ.get('NAMASTOX_LOG_LEVEL', 'DEBUG').upper()
+
+# level of the messages shown in the console
+CONSOLE_LEVEL = 'INFO'
+
 def supress_log(logger: logging.Logger):
     """Decorator for suprerss logs during objects workflow
 
@@ -51,72 +73,146 @@ def supress_log(logger: logging.Logger):
 def get_log_file() -> Path:
     """ Returns the log file path
 
-    The path of the log file is given by
-    appdirs.user_log_dir
+    The path of the log file is given by LOG_DIR. The file itself is
+    created by the file handler when the first record is written
     """
-    # log_filename_path = appdirs.user_log_dir(appname='namastox')
-    log_filename_path = './'
-    log_filename_path = Path(log_filename_path)
+    log_filename_path = Path(LOG_DIR)
     
     # creeate dir if it does not exist
     if not log_filename_path.exists():
         log_filename_path.mkdir(parents=True)
 
-    log_filename = log_filename_path / 'namastox.log'  # append file name
+    return log_filename_path / 'namastox.log'  # append file name
 
-    # check if exists to not erase current file
-    if not log_filename.exists():
-        log_filename.touch()
 
-    return log_filename
+def start_listener():
+    """ starts the background thread writing the records of the queue
+    to the rotating log file
+    """
+    global LOG_LISTENER
+
+    # Send DEBUG to a rotating log file
+    # Limit the size to 1000000Bytes ~ 1MB 
+    fh = RotatingFileHandler(get_log_file(), maxBytes=1000000, backupCount=3, delay=True)
+    fh.set_name('filehandler')
+    fh.setLevel(LOG_LEVEL)
+    fh.setFormatter(logging.Formatter(
+        '%(levelname)-8s [%(asctime)s] %(thread)d - %(name)s - %(message)s'
+    ))
 
+    LOG_LISTENER = QueueListener(LOG_QUEUE, fh, respect_handler_level=True)
+    LOG_LISTENER.start()
 
-def get_logger(name) -> logging.Logger:
-    """ inits a logger and adds the handlers.
 
-    If the logger is already created doesn't adds new handlers
-    since those are set at interpreter level and already exists.
-    """    
-    # create logger
-    logger = logging.getLogger(name)
+def stop_listener():
+    """ writes the pending records and stops the background thread """
+    global LOG_LISTENER
 
-    # set base logger level to DEBUG but fine tu the handlers
-    # for custom level
-    logger.setLevel(logging.DEBUG)
+    with LOG_LOCK:
+        if LOG_LISTENER is not None:
+            LOG_LISTENER.stop()
+            for handler in LOG_LISTENER.handlers:
+                handler.close()
+            LOG_LISTENER = None
 
-    # create formatter fdor file handler (more explicit)
-    file_formatter = logging.Formatter(
-        '%(levelname)-8s [%(asctime)s] %(thread)d - %(name)s - %(message)s'
-    )
-
-    # formater for stream handler (less info)
-    stdout_formatter = logging.Formatter(
-        '%(levelname)s - %(message)s'
-    )
-
-    log_file = get_log_file()  # Create the log file
-    # create console and file handler
-    # if not already created
-    if not logger.handlers:
-
-        # Send DEBUG to a rotating log file
-        # Limit the size to 1000000Bytes ~ 1MB 
-        fh = RotatingFileHandler(log_file, maxBytes=1000000, backupCount=3)
-        fh.set_name('filehandler')
-        fh.setLevel('DEBUG')
-        fh.setFormatter(file_formatter)
-        logger.addHandler(fh)
+
+def restart_in_child():
+    """ the thread of the listener is not inherited by forked processes, 
+    which must start their own
+    """
+    global LOG_LISTENER, LOG_LOCK
+
+    LOG_LOCK = threading.RLock()
+    if LOG_LISTENER is not None:
+        LOG_LISTENER = None
+        start_listener()
+
+        # worker processes exit without running atexit, but run the multiprocessing finalizers
+        if 'multiprocessing' in sys.modules:
+            from multiprocessing.util import Finalize
+            Finalize(None, stop_listener, exitpriority=0)
+
+
+def setup_logging():
+    """ sets up, only once per process, the handlers of the NAMASTOX root logger:
+    a queue handler feeding the log file and a stream handler writing INFO
+    messages to the console
+    """
+    global LOG_QUEUE
+
+    with LOG_LOCK:
+        if LOG_QUEUE is not None:
+            return
+
+        LOG_QUEUE = SimpleQueue()
+        start_listener()
+        atexit.register(stop_listener)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=restart_in_child)
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.propagate = False
+
+        qh = QueueHandler(LOG_QUEUE)
+        qh.set_name('queuehandler')
+        logger.addHandler(qh)
 
         # send INFO to the console (stdin)
         ch = logging.StreamHandler(sys.stdout)
         ch.set_name('streamhandler')
-        ch.setLevel('INFO')
-        ch.setFormatter(stdout_formatter)
+        ch.setLevel(CONSOLE_LEVEL)
+        ch.setFormatter(logging.Formatter('%(levelname)s - %(message)s'))
         logger.addHandler(ch)
 
-        return logger
-        
-    # if there already handlers just return the logger
-    # since its already configured
-    else:
-        return logger
+        set_levels()
+
+
+def set_levels():
+    """ sets the level of the queue handler to the level of the log file
+    and the level of the NAMASTOX root logger to the lowest level used by
+    any handler, so the messages of disabled levels are rejected by the
+    loggers before any record is created
+    """
+    logger = logging.getLogger(ROOT_LOGGER)
+    for handler in logger.handlers:
+        if handler.get_name() == 'queuehandler':
+            handler.setLevel(LOG_LEVEL)
+    logger.setLevel(min(logging.getLevelName(LOG_LEVEL), logging.getLevelName(CONSOLE_LEVEL)))
+
+
+def configure_logging(directory=None, level=None):
+    """ changes the directory and/or the level of the log file
+
+    The level is applied to the log file only, so the INFO messages are
+    still shown in the console. Messages below both levels are rejected
+    by the loggers, before any record is created
+    """
+    global LOG_DIR, LOG_LEVEL
+
+    with LOG_LOCK:
+        setup_logging()
+        if level is not None:
+            LOG_LEVEL = str(level).upper()
+        if directory is not None and directory != LOG_DIR:
+            LOG_DIR = directory
+            stop_listener()
+            start_listener()
+        elif level is not None:
+            LOG_LISTENER.handlers[0].setLevel(LOG_LEVEL)
+        set_levels()
+
+
+def get_logger(name) -> logging.Logger:
+    """ returns the logger of the module given as argument
+
+    The handlers are set only once, in the NAMASTOX root logger, and the
+    module loggers just propagate their records to it. Loggers with names
+    outside the namastox hierarchy (e.g. __main__) are renamed to fit in
+    """    
+    setup_logging()
+
+    if name != ROOT_LOGGER and not name.startswith(ROOT_LOGGER+'.'):
+        name = f'{ROOT_LOGGER}.{name}'
+
+    # the level is inherited from the root logger
+    return logging.getLogger(name)
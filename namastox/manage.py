@@ -21,26 +21,51 @@
 # along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import io
+import csv
+import gzip
 import yaml
-import json
 import shutil
-import urllib3
-import numpy as np
-import pandas as pd
-from urllib3.util.ssl_ import create_urllib3_context
+import pickle
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import tarfile
-from rdkit import Chem
 from namastox.logger import get_logger
 from namastox.ra import Ra
-from namastox.utils import ra_repository_path, ra_path, id_generator
-from flame.util.utils import profiles_repository_path, model_repository_path
+from namastox.utils import ra_repository_path, ra_path, id_generator, read_config, cache_repository_path, single_flight
+from namastox.jobs import JobQueue
+from namastox.cache import PredictionCache, savePlan, loadPlan, removePlan
+from namastox.trace import traced, span
+from namastox.metrics import PREDICTION_CACHE_TOTAL, FLAME_PROFILE_SECONDS
 
 
 LOG = get_logger(__name__)
 
+# queue used to run predictions asynchronously (see getPredictionQueue)
+PREDICTION_QUEUE = None
+
+# parsed model documentation, indexed by (model, version) (see getCachedModelDocumentation)
+DOCUMENTATION_CACHE = {}
+DOCUMENTATION_LOCK = threading.Lock()
+
+# number of SDFile records parsed together by every worker
+SDF_CHUNK_SIZE = 500
+
+# files smaller than this size (in bytes) are parsed in the calling process
+SDF_PARALLEL_SIZE = 2**20
+
+# number of rows of the tables imported together (see iterTableContents)
+TABLE_CHUNK_SIZE = 10000
+
+# size (in characters) of the sample used to guess the separator of the tables
+TABLE_SAMPLE_SIZE = 2**16
+
+@traced
 def action_privileges(raname, user_name):
     return Ra(raname).privileges(user_name)
 
+@traced
 def action_new(raname, outfile=None):
     '''
     Create a new risk assessment tree, using the given name.
@@ -108,6 +133,7 @@ def action_new(raname, outfile=None):
 
     return True, f'New risk assessment {raname} created'
 
+@traced
 def action_clone(source_raname):
     '''
     Clone an existing risk assessment tree, using the given name.
@@ -154,6 +180,7 @@ def action_clone(source_raname):
 
     return True, f'New risk assessment {raname} cloned from {source_raname}'
 
+@traced
 def action_rename(ra_name, ra_newname):
     '''
     Rename an existing risk assessment tree, using the given name.
@@ -178,6 +205,9 @@ def action_rename(ra_name, ra_newname):
     
     shutil.move(rapath, ranewpath)
 
+    from namastox.substance import unregisterRa
+    unregisterRa(ra_name, ra_newname)
+
     LOG.debug(f'renamed RA {rapath} to {ranewpath}')
 
     return True, f'RA {rapath} renamed to {ranewpath}'
@@ -208,6 +238,7 @@ def getRaHistoric (raname, step):
             
     return False, 'file not found'
 
+@traced
 def action_kill(raname, step=None):
     '''
     removes the last step from the ra tree or the whole tree if no step is specified
@@ -227,6 +258,9 @@ def action_kill(raname, step=None):
         except:
             return False, f'Failed to remove risk assessment {raname}'
 
+        from namastox.substance import unregisterRa
+        unregisterRa(raname)
+
         return True, f'Risk assessment {raname} removed'
 
     # Remove last step
@@ -262,6 +296,7 @@ def action_kill(raname, step=None):
 
     return True, 'OK'
 
+@traced
 def action_list(user_name,out='text'):
     '''
     if no argument is provided lists all ranames present at the repository 
@@ -303,14 +338,17 @@ def action_list(user_name,out='text'):
 
     return True, f'{num_ranames} risk assessment(s) found'
 
+@traced
 def action_setusers(raname, users_read, users_write):
     ra = Ra(raname)
     ra.setUsers(users_read, users_write)
 
+@traced
 def action_getusers(raname):
     ra = Ra(raname)
     return ra.getUsers()
 
+@traced
 def action_steps(raname, out='text'):
     '''
     provides a list with all steps for ranames present at the repository 
@@ -346,6 +384,8 @@ def action_steps(raname, out='text'):
 
     return True, f'{len(steps)} steps found'
 
+@traced
+@single_flight('raname', 'out')
 def action_info(raname, out='text'):
     '''
     provides a list with all steps for ranames present at the repository 
@@ -404,8 +444,10 @@ def getRepositoryPath(raname):
     return True, repo_path
 
 def getModelPath():
+    from flame.util.utils import model_repository_path
     return model_repository_path()
 
+@single_flight('raname', 'step')
 def getWorkflow(raname, step=None):
     '''
     returns a marmaid string describing the "visible workflow"
@@ -445,17 +487,43 @@ def setCustomWorkflow (raname, file):
     success, result = ra.updateWorkflow (file)
     return success, result
 
-def convertSubstances(file):
+def iterSDFChunks (file, chunksize=SDF_CHUNK_SIZE):
+    ''' generator reading the SDFile given as argument (plain or gzip compressed) and yielding 
+        chunks of raw records, as bytes, without parsing them
     '''
-    returns a dictionary with a list of substances names, SMILES and CASRN
+    with open(file, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+
+    opener = gzip.open if compressed else open
+    with opener(file, 'rb') as f:
+        chunk = []
+        nrecords = 0
+        for line in f:
+            chunk.append(line)
+            if line.strip() == b'$$$$':
+                nrecords += 1
+                if nrecords == chunksize:
+                    yield b''.join(chunk)
+                    chunk = []
+                    nrecords = 0
+
+        # last record might not be terminated
+        if len(b''.join(chunk).strip()) > 0:
+            yield b''.join(chunk)
+
+def parseSubstances (chunk):
+    ''' parses a chunk of SDFile records and returns a list with the number of records and the
+        substances found, as dictionaries with keys name, id, smiles and casrn. The name is None 
+        when the record does not define it
     '''
-    suppl = Chem.SDMolSupplier(file, sanitize=True)
-    count = 0
+    from rdkit import Chem
+    suppl = Chem.ForwardSDMolSupplier(io.BytesIO(chunk), sanitize=True)
+    nrecords = 0
     results = []
     for mol in suppl:
+        nrecords += 1
         if mol is None:
             continue
-        count=count+1
 
         # extract the molecule name
         if mol.HasProp('name'):  
@@ -465,7 +533,7 @@ def convertSubstances(file):
         elif mol.HasProp('NAME'):  
             iname = mol.GetProp('NAME')
         else:
-            iname = f'mol{count}'
+            iname = None
 
         # extract the CASRN 
         if mol.HasProp('CASRN'):  
@@ -492,7 +560,68 @@ def convertSubstances(file):
 
         results.append( {'name': iname, 'id': iid, 'smiles': ismiles, 'casrn': icasrn })
 
+    return nrecords, results
+
+def iterSubstances (file, limit=None, workers=None, progress=None, chunksize=SDF_CHUNK_SIZE):
+    '''
+    generator yielding the substances of the SDFile (plain or gzip compressed) given as argument, 
+    as dictionaries with keys name, id, smiles and casrn. The records are parsed in chunks, using 
+    a pool of workers for large files (workers=1 parses in the calling process). Parsing stops after 
+    limit substances and the function progress, if provided, is called after every chunk with the 
+    number of records read and the number of substances found
+    '''
+    if workers is None:
+        workers = os.cpu_count() if os.path.getsize(file) > SDF_PARALLEL_SIZE else 1
+
+    chunks = iterSDFChunks(file, chunksize)
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        pending = deque()
+
+        # keep a bounded number of chunks in flight, so memory does not grow with the file size
+        def parsed ():
+            for ichunk in chunks:
+                pending.append(executor.submit(parseSubstances, ichunk))
+                if len(pending) >= 2*workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    else:
+        executor = None
+        parsed = lambda: (parseSubstances(ichunk) for ichunk in chunks)
+
+    nrecords = 0
+    count = 0
+    try:
+        for irecords, isubstances in parsed():
+            nrecords += irecords
+            for isubstance in isubstances:
+                count+=1
+                if isubstance['name'] is None:
+                    isubstance['name'] = f'mol{count}'
+                yield isubstance
+
+                if limit is not None and count >= limit:
+                    return
+
+            if progress is not None:
+                progress(nrecords, count)
+    finally:
+        if executor is not None:
+            for ifuture in pending:
+                ifuture.cancel()
+            executor.shutdown(wait=False)
+
+def convertSubstances(file, limit=None, workers=None, progress=None):
+    '''
+    returns a dictionary with a list of substances names, SMILES and CASRN. The substances are added
+    to the substance registry and their registry key is returned in the field "inchikey"
+    '''
+    from namastox.substance import registerSubstances
+    results = list(iterSubstances(file, limit=limit, workers=workers, progress=progress))
+
     if len(results)> 0:
+        registerSubstances(results)
         return True, results
 
     return False, 'empty molecule'
@@ -537,11 +666,99 @@ def saveModelDocumentation (model_name, model_ver,  oformat='WORD'):
     # results will contains errors if success and the output filename otherwise
     return success, results
 
-def predictLocalModels (raname, models, versions):
-    ''' returns a prediction using the substance defined in the ra, using the list of local models and versions specified
+def getModelTimestamp (model_name, model_ver):
+    ''' returns the latest modification time of the model folder and the files it contains, which 
+        is used to invalidate the cached model documentation
     '''
-    from flame import context
+    from flame.util.utils import model_path
+    mpath = model_path(model_name, model_ver)
+    if not os.path.isdir(mpath):
+        return None
+
+    timestamp = os.path.getmtime(mpath)
+    with os.scandir(mpath) as entries:
+        for ientry in entries:
+            if ientry.is_file():
+                timestamp = max(timestamp, ientry.stat().st_mtime)
+    return timestamp
+
+def getCachedModelDocumentation (model_name, model_ver):
+    ''' returns the model documentation as a dictionary, like getModelDocumentation, but the documentation 
+        is only extracted from Flame when the model changes. The parsed documentation is kept in memory and 
+        in the cache folder, so it can be shared by several processes
+    '''
+    key = (model_name, model_ver)
+    timestamp = getModelTimestamp(model_name, model_ver)
+
+    with DOCUMENTATION_LOCK:
+        if key in DOCUMENTATION_CACHE and DOCUMENTATION_CACHE[key][0] == timestamp:
+            return True, DOCUMENTATION_CACHE[key][1]
+
+    cache_file = os.path.join(cache_repository_path('documentation'), f'documentation_{model_name}v{model_ver}.pkl')
+    documentation = None
+    if timestamp is not None and os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                cached_timestamp = pickle.load(f)
+                if cached_timestamp == timestamp:
+                    documentation = pickle.load(f)
+        except Exception as e:
+            LOG.debug(f'unable to read cached documentation {cache_file}: {e}')
+
+    if documentation is None:
+        success, documentation = getModelDocumentation(model_name, model_ver)
+        if not success:
+            return False, documentation
+
+        if timestamp is not None:
+            with open(cache_file, 'wb') as f:
+                pickle.dump(timestamp, f)
+                pickle.dump(documentation, f)
+
+        LOG.debug(f'documentation of model {model_name} version {model_ver} cached')
+
+    with DOCUMENTATION_LOCK:
+        DOCUMENTATION_CACHE[key] = (timestamp, documentation)
 
+    return True, documentation
+
+def getCachedDocumentationFile (model_name, model_ver):
+    ''' returns the path to the model documentation in Word format, stored in the cache folder.
+        The document is only generated by Flame when the model changes
+    '''
+    timestamp = getModelTimestamp(model_name, model_ver)
+    docname = f'documentation_{model_name}v{model_ver}.docx'
+    docpath = os.path.join(cache_repository_path('documentation'), docname)
+
+    if timestamp is not None and os.path.isfile(docpath) and os.path.getmtime(docpath) >= timestamp:
+        return True, docpath
+
+    success, docfile = saveModelDocumentation(model_name, model_ver)
+    if not success or not os.path.isfile(docfile):
+        return False, docfile
+
+    shutil.move(docfile, docpath)
+    return True, docpath
+
+def linkFileToRA (raname, source_path):
+    ''' makes the file given as argument available in the RA repo folder, using a hard link when possible 
+        and a copy otherwise (e.g. if the cache and the RAs are in different file systems)
+    '''
+    destpath = os.path.join (ra_path(raname), 'repo', os.path.basename(source_path))
+    if os.path.isfile(destpath):
+        os.remove(destpath)
+    try:
+        os.link(source_path, destpath)
+    except OSError:
+        shutil.copy(source_path, destpath)
+    return destpath
+
+def getRaMolecules (raname):
+    ''' returns a list of tuples (name, key, mol) with the substances defined in the ra. The substances
+        are also written as a SDFile (structure.sdf) in the RA repository
+    '''
+    from rdkit import Chem
+    from namastox.substance import moleculeKey
     # instantiate a ra object
     ra = Ra(raname)
     succes, results = ra.load()
@@ -556,7 +773,7 @@ def predictLocalModels (raname, models, versions):
     if 'substances' in generalInfo:
         generalSubst = generalInfo['substances']
     else:
-        return False, 'no substance defined in {raname}'
+        return False, f'no substance defined in {raname}'
     smiles = []
     names = []
 
@@ -574,7 +791,7 @@ def predictLocalModels (raname, models, versions):
         return False, f'every substance should have an SMILES and a name defined in {raname}'
 
     writer = Chem.SDWriter(structure_sdf)
-    n = 0
+    molecules = []
     for ismiles,iname in zip(smiles, names):
         try:
             mol = Chem.MolFromSmiles(ismiles)
@@ -586,192 +803,495 @@ def predictLocalModels (raname, models, versions):
             mol.SetProp("name",iname)
             mol.SetProp("_Name",iname)
             writer.write(mol)
-        
-        n+=1
+            molecules.append((iname, moleculeKey(mol), mol))
 
     writer.close()
 
-    # profile requires more than one model selected
-    # if only one model is selected, run the prediction twice
-    if len(models)==1:
-        models.append(models[0])
-        versions.append(versions[0])
+    return True, molecules
 
-    label = f'namastox_{id_generator()}'    
+def predictLocalModels (raname, models, versions, label=None):
+    ''' returns a prediction using the substance defined in the ra, using the list of local models and versions specified
+        the label identifying the prediction can be provided as argument, otherwise a random one is generated
+    '''
+    success, molecules = getRaMolecules(raname)
+    if not success:
+        return False, molecules
 
-    arguments = {'label' : label,
-                 'infile': structure_sdf,
-                 'multi' : {'endpoints': models, 
-                            'versions': versions}
-                }
-    
-    success, results = context.profile_cmd(arguments)
-    if success:
-        return True, label
-    
-    return success, results
+    if label is None:
+        label = f'namastox_{id_generator()}'    
 
-def getLocalModelPrediction(raname, prediction_label):
-    ''' 
-    returns the profile result produced by Flame in summary format 
-    '''
-    # TODO: uses the label 'namastox', this does not allow concurrent use (colliding predictions)
-    from flame import manage as flame_manage
+    success, ra_repo_path = getRepositoryPath (raname)
+    if not success:
+        return False, ra_repo_path
 
-    success, results = flame_manage.action_profiles_summary(prediction_label,output=None)
-    if success:
+    return runCachedProfile(label, molecules, models, versions, ra_repo_path)
 
-        # initialize list of results 
-        model=[]
-        units=[]
-        parameters=[]
-        interpretations=[]
-        methods = []
+def predictLocalModelsBatch (ranames, models, versions, label=None):
+    ''' predicts the substances defined in all the ras given as argument, using the list of local models and versions 
+        specified, in a single Flame profile. Substances present in several ras are only predicted once. 
+        The results must be retrieved with getLocalModelPredictionBatch
+    '''
+    ra_molecules = {}
+    molecules = []
+    unique_keys = set()
+    for raname in ranames:
+        success, imolecules = getRaMolecules(raname)
+        if not success:
+            return False, imolecules
+
+        ra_molecules[raname] = ([iname for iname, ikey, imol in imolecules], 
+                                [ikey for iname, ikey, imol in imolecules])
+
+        for imolecule in imolecules:
+            if imolecule[1] not in unique_keys:
+                unique_keys.add(imolecule[1])
+                molecules.append(imolecule)
+
+    if len(molecules) == 0:
+        return False, 'no substance defined in the ras'
+
+    if label is None:
+        label = f'namastox_{id_generator()}'    
+
+    LOG.info(f'batch prediction {label}: {len(molecules)} unique substances from {len(ranames)} ras')
+
+    return runCachedProfile(label, molecules, models, versions, cache_repository_path(), ras=ra_molecules)
+
+def runCachedProfile (label, molecules, models, versions, work_path, ras=None):
+    ''' predicts the molecules, given as a list of tuples (name, key, mol), with the list of local models 
+        and versions specified. Predictions already present in the cache are not recomputed: Flame is only 
+        run for the molecules and models missing in the cache. The plan describing where every prediction 
+        must be obtained is saved with the label, for getLocalModelPrediction. For batch predictions, ras 
+        is a dictionary with the names and keys of the molecules of every ra
+    '''
+    from rdkit import Chem
+    from flame import context
 
-        nmol =  results[0].getVal('obj_num')
-        mol_names =  results[0].getVal('obj_nam')
+    model_list = []
+    for imodel in zip(models, versions):
+        imodel = (imodel[0], int(imodel[1]))
+        if imodel not in model_list:
+            model_list.append(imodel)
+
+    keys = [ikey for iname, ikey, imol in molecules]
+
+    cache = PredictionCache()
+    timestamps = {}
+    pending_models = []
+    pending_keys = set()
+    for imodel in model_list:
+        timestamps[imodel] = getModelTimestamp(*imodel)
+        hits = cache.get(imodel[0], imodel[1], timestamps[imodel], keys)
+        missing = [ikey for ikey in keys if ikey not in hits]
+        PREDICTION_CACHE_TOTAL.inc(len(keys)-len(missing), result='hit')
+        PREDICTION_CACHE_TOTAL.inc(len(missing), result='miss')
+        if len(missing) > 0:
+            pending_models.append(imodel)
+            pending_keys.update(missing)
+
+    plan = {'molnames': [iname for iname, ikey, imol in molecules],
+            'keys': keys,
+            'models': model_list,
+            'timestamps': timestamps,
+            'profile_models': pending_models,
+            'ras': ras}
+
+    LOG.debug(f'prediction {label}: {len(pending_keys)} of {len(set(keys))} molecules and {len(pending_models)} of {len(model_list)} models not found in cache')
+
+    if len(pending_models) > 0:
+
+        # only the molecules missing in the cache are submitted to Flame, named with their key
+        profile_sdf = os.path.join(work_path, f'{label}.sdf')
+        writer = Chem.SDWriter(profile_sdf)
+        written = set()
+        for iname, ikey, imol in molecules:
+            if ikey in pending_keys and ikey not in written:
+                mol = Chem.Mol(imol)
+                mol.SetProp("name",ikey)
+                mol.SetProp("_Name",ikey)
+                writer.write(mol)
+                written.add(ikey)
+        writer.close()
+
+        pmodels = [imodel[0] for imodel in pending_models]
+        pversions = [imodel[1] for imodel in pending_models]
+
+        # profile requires more than one model selected
+        # if only one model is selected, run the prediction twice
+        if len(pmodels)==1:
+            pmodels.append(pmodels[0])
+            pversions.append(pversions[0])
+
+        arguments = {'label' : label,
+                     'infile': profile_sdf,
+                     'multi' : {'endpoints': pmodels, 
+                                'versions': pversions}
+                    }
+        
+        with span('flame.profile', label=label, molecules=len(written), models=len(pending_models)), FLAME_PROFILE_SECONDS.time():
+            success, results = context.profile_cmd(arguments)
+        os.remove(profile_sdf)
+        if not success:
+            return False, results
+
+    savePlan(label, plan)
+    return True, label
+
+def collectPredictions (prediction_label, plan):
+    ''' returns a dictionary, indexed by (model, version), with the quantitative flag and the raw predictions 
+        of every molecule key. The predictions produced by Flame for the label are stored in the cache and 
+        the rest are obtained from the cache
+    '''
+    from flame import manage as flame_manage
 
-        x_val = [[] for _ in range(nmol)] 
-        unc = [[] for _ in range(nmol)]
+    cache = PredictionCache()
+    predictions = {}
 
-        # when only one model is selected we predict twice as a workaround. Here we clean the duplicate
-        if len (results) == 2 and results[0].getMeta('modelID') == results[1].getMeta('modelID'):
-            results.pop(1)
+    if len(plan['profile_models']) > 0:
+        success, results = flame_manage.action_profiles_summary(prediction_label,output=None)
+        if not success:
+            return False, f'unable to retrieve prediction results with error: {results}'
 
         for ii in results:
+            imodel = (ii.getMeta("endpoint"), int(ii.getMeta("version")))
+
+            # when only one model is selected we predict twice as a workaround. Here we skip the duplicate
+            if imodel in predictions:
+                continue
+
+            values = ii.getVal("values")
+            lower = ii.getVal('lower_limit')
+            upper = ii.getVal('upper_limit')
+            rows = {}
+            for j, ikey in enumerate(ii.getVal('obj_nam')):
+                rows[ikey] = {'value': values[j],
+                              'lower': lower[j] if lower is not None else None,
+                              'upper': upper[j] if upper is not None else None}
 
-            # variables for facilitating access to key information
-            iendpoint = ii.getMeta("endpoint")
-            iversion = ii.getMeta("version")
             iquantitative = ii.getMeta("quantitative")
+            cache.put(imodel[0], imodel[1], plan['timestamps'].get(imodel), iquantitative, rows)
+            predictions[imodel] = {'quantitative': iquantitative, 'rows': rows}
+
+    # complete the predictions with the molecules found in the cache
+    for imodel in plan['models']:
+        rows = predictions[imodel]['rows'] if imodel in predictions else {}
+        missing = [ikey for ikey in plan['keys'] if ikey not in rows]
+        if len(missing) == 0:
+            continue
 
-            # defaults
-            confidence = None
-            unit = ''
-            parameter = iendpoint
-            interpretation = ''
-            uncstr = ''
-            imethod = {}
-
-            # extract model information from the documentation
-            success, documentation = getModelDocumentation(iendpoint,iversion)
-
-            if success:
-                if 'AD_parameters' in documentation:
-                    if 'confidence' in documentation['AD_parameters']:
-                        confidence = documentation['AD_parameters']['confidence']
-                        if confidence is not None:
-                            confidence*=100.0
-
-                if iquantitative:
-                    if 'Endpoint_units' in documentation:
-                        if documentation['Endpoint_units'] != 'None':
-                            unit = documentation['Endpoint_units']
-    
-                if 'Endpoint' in documentation:
-                    if documentation['Endpoint'] != 'None':
-                        parameter = documentation['Endpoint']
-    
-                if 'Interpretation' in documentation:
-                    interpretation = documentation['Interpretation']
-
-                success, docfile = saveModelDocumentation(iendpoint,iversion)
-                if success:
-                    destpath = os.path.join (ra_path(raname), 'repo', docfile)
-                    if os.path.isfile(destpath):
-                        os.remove(destpath)
-                    if os.path.isfile(docfile):
-                        shutil.move(docfile, destpath)
-
-            # Generate pseudo-method:
-            imethod['name'] = iendpoint
-            imethod['description'] = interpretation
-            imethod['link'] = f'documentation_{iendpoint}v{iversion}.docx'
-
-            # Iterate for every substance j
-            mollist = ii.getVal("values")
-            for j, ival in enumerate(mollist):
-
-                if iquantitative:
-                    try:
-                        ival = f'{ival:.4f}'
-                    except:
-                        None
-
-                    imethod['sd'] = documentation['Internal_validation_1']['SDEP']
-
-                    if confidence != None:
-                        cilow = ii.getVal('lower_limit')[j]
-                        ciup  = ii.getVal('upper_limit')[j]
-
-                        if cilow !=None and ciup != None:
-                            cilow = float(cilow)
-                            ciup = float(ciup)
-                            uncstr = f'{cilow:.4f} to {ciup:.4f} (%{confidence} conf.)'
-
-                else:
-                    if ival == 0:
-                        ival = 'negative'
-                    elif ival == 1:
-                        ival = 'positive'
-                    else:
-                        ival = 'uncertain'
-
-                    imethod['specificity'] = documentation['Internal_validation_1']['Specificity']
-                    imethod['sensitivity'] = documentation['Internal_validation_1']['Sensitivity']
-
-                    if confidence != None:
-                        uncstr = f'%{confidence} conf.'
-
-
-                x_val[j].append(ival)
-                unc[j].append(uncstr)
-
-            model.append((iendpoint, iversion))
-            units.append(unit)
-            parameters.append(parameter)
-            interpretations.append(interpretation)
-            methods.append(imethod)
-        
-        # reformat list so they can be easily presented
-        extmodel = []
-        extparameters = []
-        extunits = []
-        extinterpretations = []
-        extmethods = []
-
-        extval = []
-        extunc = []
-
-        extmolnames = []
-
-        for i in range(nmol):
-
-            for j in range(len(model)):
-                extmolnames.append(mol_names[i])
-                extval.append(x_val[i][j])
-                extunc.append(unc[i][j])
-
-            for iitem in model:
-                extmodel.append(iitem)
-            for iitem in parameters:
-                extparameters.append(iitem)
-            for iitem in units:
-                extunits.append(iitem)
-            for iitem in interpretations:
-                extinterpretations.append(iitem)
-            for iitem in methods:
-                extmethods.append(iitem)
-
-        # print ({'molnames': extmolnames, 'models':extmodel, 'results':extval, 'uncertainty': extunc, 
-        #         'parameters': extparameters, 'units': extunits, 'interpretations': extinterpretations, 'methods': extmethods})
-        
-        shutil.rmtree(os.path.join(profiles_repository_path(), prediction_label))
-        
-        return True, {'molnames': extmolnames, 'models':extmodel, 'results':extval, 'uncertainty': extunc, 'parameters': extparameters, 'units': extunits, 'interpretations': extinterpretations, 'methods': extmethods}
-    else:
-        return False, f'unable to retrieve prediction results with error: {results}'
+        cached = cache.get(imodel[0], imodel[1], plan['timestamps'].get(imodel), missing)
+        if imodel not in predictions:
+            if len(cached) == 0:
+                return False, f'no prediction found for model {imodel[0]} version {imodel[1]}'
+            predictions[imodel] = {'quantitative': next(iter(cached.values()))['quantitative'], 'rows': rows}
+        rows.update(cached)
 
+    return True, predictions
+
+def getLocalModelPrediction(raname, prediction_label, columnar=False):
+    ''' 
+    returns the profile result produced by Flame in summary format, completed with the predictions 
+    obtained from the cache. If columnar is True, the results are returned as a compact table
+    (see buildPredictionTable) which can be expanded later with renderPredictionTable
+    '''
+    plan = loadPlan(prediction_label)
+    if plan is None:
+        return False, f'prediction {prediction_label} not found'
+
+    success, predictions = collectPredictions(prediction_label, plan)
+    removePredictionProfile(prediction_label)
+    if not success:
+        return False, predictions
+
+    models_info = getModelsInfo(plan['models'], predictions)
+    linkModelsDocumentation(raname, plan['models'])
+
+    table = buildPredictionTable(plan['molnames'], plan['keys'], plan['models'], models_info, predictions)
+    if columnar:
+        return True, tableToDict(table)
+
+    return True, renderPredictionTable(table)
+
+def getLocalModelPredictionBatch (prediction_label, columnar=False):
+    '''
+    returns a dictionary, indexed by ra name, with the results of a batch prediction in the format returned 
+    by getLocalModelPrediction. The model documentation is linked to the repository of every ra
+    '''
+    plan = loadPlan(prediction_label)
+    if plan is None or plan['ras'] is None:
+        return False, f'batch prediction {prediction_label} not found'
+
+    success, predictions = collectPredictions(prediction_label, plan)
+    removePredictionProfile(prediction_label)
+    if not success:
+        return False, predictions
+
+    models_info = getModelsInfo(plan['models'], predictions)
+
+    results = {}
+    for raname, (molnames, keys) in plan['ras'].items():
+        linkModelsDocumentation(raname, plan['models'])
+        table = buildPredictionTable(molnames, keys, plan['models'], models_info, predictions)
+        if columnar:
+            results[raname] = tableToDict(table)
+        else:
+            results[raname] = renderPredictionTable(table)
+
+    return True, results
+
+def getModelsInfo (models, predictions):
+    ''' returns a list with the information of every model (parameter, units, interpretation, confidence, 
+        pseudo-method), extracted from the model documentation
+    '''
+    models_info = []
+    for imodel in models:
+
+        # variables for facilitating access to key information
+        iendpoint, iversion = imodel
+        iquantitative = predictions[imodel]['quantitative']
+
+        # defaults
+        confidence = None
+        unit = ''
+        parameter = iendpoint
+        interpretation = ''
+        imethod = {}
+
+        # extract model information from the documentation
+        success, documentation = getCachedModelDocumentation(iendpoint,iversion)
+
+        if success:
+            if 'AD_parameters' in documentation:
+                if 'confidence' in documentation['AD_parameters']:
+                    confidence = documentation['AD_parameters']['confidence']
+                    if confidence is not None:
+                        confidence*=100.0
+
+            if iquantitative:
+                if 'Endpoint_units' in documentation:
+                    if documentation['Endpoint_units'] != 'None':
+                        unit = documentation['Endpoint_units']
+
+            if 'Endpoint' in documentation:
+                if documentation['Endpoint'] != 'None':
+                    parameter = documentation['Endpoint']
+
+            if 'Interpretation' in documentation:
+                interpretation = documentation['Interpretation']
+
+        # Generate pseudo-method:
+        imethod['name'] = iendpoint
+        imethod['description'] = interpretation
+        imethod['link'] = f'documentation_{iendpoint}v{iversion}.docx'
+
+        if success:
+            if iquantitative:
+                imethod['sd'] = documentation['Internal_validation_1']['SDEP']
+            else:
+                imethod['specificity'] = documentation['Internal_validation_1']['Specificity']
+                imethod['sensitivity'] = documentation['Internal_validation_1']['Sensitivity']
+
+        models_info.append({'quantitative': iquantitative,
+                            'confidence': confidence,
+                            'parameter': parameter,
+                            'unit': unit,
+                            'interpretation': interpretation,
+                            'method': imethod})
+
+    return models_info
+
+def linkModelsDocumentation (raname, models):
+    ''' links the documentation of the models given as argument to the RA repository '''
+    for iendpoint, iversion in models:
+        success, docpath = getCachedDocumentationFile(iendpoint,iversion)
+        if success:
+            linkFileToRA(raname, docpath)
+
+def buildPredictionTable (mol_names, mol_keys, models, models_info, predictions):
+    ''' returns the predictions in columnar form: a dictionary with the molecule names, the models and their
+        information and NumPy arrays of shape (molecules, models) with the values and the lower and upper 
+        limits of the confidence intervals. Missing predictions are represented as NaN
+    '''
+    import numpy as np
+    empty = {'value': None, 'lower': None, 'upper': None}
+    columns = {'value': [], 'lower': [], 'upper': []}
+    for imodel in models:
+        rows = predictions[imodel]['rows']
+        irows = [rows.get(ikey, empty) for ikey in mol_keys]
+        for icol, ilist in columns.items():
+            ilist.append(np.array([irow[icol] for irow in irows], dtype=float))
+
+    nmol = len(mol_names)
+    table = {'molnames': list(mol_names),
+             'models': list(models),
+             'info': models_info}
+    for icol, ilist in columns.items():
+        table[icol] = np.column_stack(ilist) if len(ilist) > 0 else np.empty((nmol, 0))
+
+    return table
+
+def tableToDict (table):
+    ''' returns the columnar table with the arrays converted to nested lists (missing values as None),
+        suitable for serialization
+    '''
+    import numpy as np
+    result = {'molnames': table['molnames'],
+              'models': table['models'],
+              'quantitative': [iinfo['quantitative'] for iinfo in table['info']],
+              'confidence': [iinfo['confidence'] for iinfo in table['info']],
+              'parameters': [iinfo['parameter'] for iinfo in table['info']],
+              'units': [iinfo['unit'] for iinfo in table['info']],
+              'interpretations': [iinfo['interpretation'] for iinfo in table['info']],
+              'methods': [iinfo['method'] for iinfo in table['info']]}
+
+    for icol, ikey in [('value', 'values'), ('lower', 'lower_limits'), ('upper', 'upper_limits')]:
+        iarray = table[icol].astype(object)
+        iarray[np.isnan(table[icol])] = None
+        result[ikey] = iarray.tolist()
+
+    return result
+
+def renderPredictionTable (table):
+    ''' returns the columnar table in summary format, with one element per molecule and model and 
+        the values and uncertainties formatted as strings
+    '''
+    import numpy as np
+    values = table['value']
+    nmol, nmodels = values.shape
+
+    x_val = np.empty((nmol, nmodels), dtype=object)
+    unc = np.full((nmol, nmodels), '', dtype=object)
+
+    for j, iinfo in enumerate(table['info']):
+        ivalues = values[:,j]
+        confidence = iinfo['confidence']
+
+        if iinfo['quantitative']:
+            x_val[:,j] = np.char.mod('%.4f', ivalues)
+            x_val[np.isnan(ivalues), j] = None
+
+            if confidence != None:
+                cilow = table['lower'][:,j]
+                ciup = table['upper'][:,j]
+                valid = ~(np.isnan(cilow) | np.isnan(ciup))
+                if np.any(valid):
+                    uncstr = np.char.add(np.char.add(np.char.mod('%.4f', cilow[valid]), ' to '), 
+                                         np.char.add(np.char.mod('%.4f', ciup[valid]), f' (%{confidence} conf.)'))
+                    unc[valid, j] = uncstr
+        else:
+            x_val[:,j] = np.where(ivalues == 0, 'negative', np.where(ivalues == 1, 'positive', 'uncertain'))
+
+            if confidence != None:
+                unc[:,j] = f'%{confidence} conf.'
+
+    # flatten, so every molecule is followed by the predictions of all models
+    return {'molnames': np.repeat(np.array(table['molnames'], dtype=object), nmodels).tolist(), 
+            'models': table['models']*nmol, 
+            'results': x_val.ravel().tolist(), 
+            'uncertainty': unc.ravel().tolist(), 
+            'parameters': [iinfo['parameter'] for iinfo in table['info']]*nmol, 
+            'units': [iinfo['unit'] for iinfo in table['info']]*nmol, 
+            'interpretations': [iinfo['interpretation'] for iinfo in table['info']]*nmol, 
+            'methods': [iinfo['method'] for iinfo in table['info']]*nmol}
+
+
+def removePredictionProfile (prediction_label):
+    ''' removes the folder created by Flame in the profiles repository and the prediction plan for the 
+        prediction label given as argument
+    '''
+    from flame.util.utils import profiles_repository_path
+    profile_path = os.path.join(profiles_repository_path(), prediction_label)
+    if os.path.isdir(profile_path):
+        shutil.rmtree(profile_path, ignore_errors=True)
+    removePlan(prediction_label)
+
+def _predictionJob (raname, models, versions, prediction_label):
+    ''' runs the prediction and collects the results. Used by submitPrediction in the
+        worker processes of the prediction queue
+    '''
+    try:
+        success, results = predictLocalModels(raname, models, versions, prediction_label)
+        if not success:
+            return False, results
+
+        return getLocalModelPrediction(raname, prediction_label)
+    finally:
+        removePredictionProfile(prediction_label)
+
+def _batchPredictionJob (ranames, models, versions, prediction_label):
+    ''' runs a batch prediction and collects the results. Used by submitBatchPrediction in the
+        worker processes of the prediction queue
+    '''
+    try:
+        success, results = predictLocalModelsBatch(ranames, models, versions, prediction_label)
+        if not success:
+            return False, results
+
+        return getLocalModelPredictionBatch(prediction_label)
+    finally:
+        removePredictionProfile(prediction_label)
+
+def getPredictionQueue ():
+    ''' returns the queue used to run predictions asynchronously. The number of workers can be
+        defined in the configuration file with the key "prediction_workers" (default 2)
+    '''
+    global PREDICTION_QUEUE
+
+    if PREDICTION_QUEUE is None:
+        max_workers = 2
+        success, config = read_config()
+        if success and 'prediction_workers' in config:
+            max_workers = int(config['prediction_workers'])
+        PREDICTION_QUEUE = JobQueue(max_workers=max_workers)
+
+    return PREDICTION_QUEUE
+
+def submitPrediction (raname, models, versions):
+    ''' submits a prediction of the substances defined in the ra, using the list of local models and versions 
+        specified, to the prediction queue and returns immediately a job ID. The results, in the format returned
+        by getLocalModelPrediction, must be retrieved with getPredictionResult
+    '''
+    prediction_label = f'namastox_{id_generator()}'
+
+    job_id = getPredictionQueue().submit(_predictionJob, raname, list(models), list(versions), prediction_label, 
+                                         cleanup=lambda: removePredictionProfile(prediction_label))
+
+    LOG.info(f'prediction {prediction_label} for {raname} submitted as job {job_id}')
+    return True, job_id
+
+def submitBatchPrediction (ranames, models, versions):
+    ''' submits a batch prediction of the substances defined in all the ras given as argument to the prediction 
+        queue and returns immediately a job ID. The results, in the format returned by getLocalModelPredictionBatch, 
+        must be retrieved with getPredictionResult
+    '''
+    prediction_label = f'namastox_{id_generator()}'
+
+    job_id = getPredictionQueue().submit(_batchPredictionJob, list(ranames), list(models), list(versions), prediction_label, 
+                                         cleanup=lambda: removePredictionProfile(prediction_label))
+
+    LOG.info(f'batch prediction {prediction_label} for {len(ranames)} ras submitted as job {job_id}')
+    return True, job_id
+
+def getPredictionStatus (job_id):
+    ''' returns a dictionary describing the status of the prediction job (queued, running, completed, failed or cancelled)
+    '''
+    status = getPredictionQueue().getStatus(job_id)
+    if status is None:
+        return False, f'job {job_id} not found'
+    return True, status
+
+def cancelPrediction (job_id):
+    ''' cancels the prediction job given as argument. Predictions already running are left to finish (see JobQueue.cancel)
+    '''
+    status = getPredictionQueue().cancel(job_id)
+    if status is None:
+        return False, f'job {job_id} not found'
+    return True, f'job {job_id} {status}'
+
+def getPredictionResult (job_id):
+    ''' returns the results of a finished prediction job, in the format returned by getLocalModelPrediction
+    '''
+    return getPredictionQueue().getResult(job_id)
 
 def exportRA (raname):
     '''
@@ -838,64 +1358,99 @@ def getInfoStructure(molname=None, casrn=None):
     now we are using comptox dashboard
     TODO: use ASPA resources instead
     '''
-    # COMPTOX URL
-    url = "https://comptox.epa.gov/dashboard-api/batchsearch/chemicals"
-    
-    # Adding a payload
+    from namastox.comptox import searchIdentifiers
     if casrn != None:
-        payload = {"identifierTypes":["CASRN"],"massError":0,"downloadItems":[],"searchItems":f"{casrn}","inputType":"IDENTIFIER"}
+        identifier, kind = casrn, 'casrn'
     elif molname != None:
-        payload = {"identifierTypes":["chemical_name"],"massError":0,"downloadItems":[],"searchItems":f"{molname}","inputType":"IDENTIFIER"}
+        identifier, kind = molname, 'name'
+    else:
+        return False, 'no name or casrn provided'
 
-    ctx = create_urllib3_context()
-    ctx.load_default_certs()
-    ctx.options |= 0x4  # ssl.OP_LEGACY_SERVER_CONNECT
+    success, results = searchIdentifiers([identifier], kind)
+    if not success:
+        return False, results
 
-    with urllib3.PoolManager(ssl_context=ctx) as http:
-        try:
-            resp = http.request('POST', url, json=payload)
-        except Exception as ins:
-            return False, ins
-        
-        if resp.status==200:
-            result = json.loads(resp.data)
-            if result == []:
-                return False, 'no compound found'
-            return True, result
+    result = results[str(identifier).strip()]
+    if result == []:
+        return False, 'no compound found'
+    return True, result
 
-    return False, resp.status
+def getInfoStructures(molnames=None, casrns=None):
+    ''' 
+    gets information for a list of substances, using either their names or their casrn, as a
+    dictionary with the results of every name or casrn. Searches are batched and cached
+    '''
+    from namastox.comptox import searchIdentifiers
+    if casrns != None:
+        return searchIdentifiers(casrns, 'casrn')
+    elif molnames != None:
+        return searchIdentifiers(molnames, 'name')
 
-def getTableContents (filename):
+    return False, 'no names or casrn provided'
 
-    LOG.info (f'import table {filename}')
+@traced
+def action_similar (smiles, top=10, cutoff=None):
+    '''
+    returns a list with the substances of the repository most similar to the SMILES given as argument,
+    including the RAs where every substance is used
+    '''
+    from namastox.similarity import searchSimilar
+    return searchSimilar(smiles, top=top, cutoff=cutoff)
+
+def sniffSeparator (filename, sample_size=TABLE_SAMPLE_SIZE):
+    ''' returns the field separator of the table, guessed from a sample of the beginning of the file '''
+    with open(filename, 'r', newline='') as f:
+        sample = f.read(sample_size)
+
+    # do not pass an incomplete line to the sniffer
+    if len(sample) == sample_size and '\n' in sample:
+        sample = sample[:sample.rindex('\n')]
 
-    # use pandas CVS utility to import and convert to a dictionary
-    table_dataframe = pd.read_csv(filename, sep=None).replace(np.nan, None)
-    table_dict = table_dataframe.to_dict('records')
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+    except csv.Error:
+        return ','
+
+def iterTableContents (filename, sep=None, chunksize=TABLE_CHUNK_SIZE):
+    ''' generator reading the table in chunks of rows and yielding tuples (values, uncertainties), where values
+        and uncertainties are lists with a dictionary per row containing the required keys. The separator is
+        guessed from a sample of the file unless provided. Only the required columns are read
+    '''
+    import pandas as pd
+    if sep is None:
+        sep = sniffSeparator(filename)
 
     # split in a values and uncertainties list, each item containing a dictionary with the required keys
     val_labels = ['substance', 'method', 'parameter', 'value', 'unit']
     unc_labels = ['uncertainty', 'term']
 
+    columns = pd.read_csv(filename, sep=sep, nrows=0).columns
+    val_columns = [label for label in val_labels if label in columns]
+    unc_columns = [label for label in unc_labels if label in columns]
+
+    for chunk in pd.read_csv(filename, sep=sep, usecols=val_columns+unc_columns, chunksize=chunksize):
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+
+        values = chunk[val_columns].to_dict('records')
+        if len(unc_columns) > 0:
+            uncertainties = chunk[unc_columns].to_dict('records')
+        else:
+            uncertainties = [{} for i in range(len(chunk))]
+
+        yield values, uncertainties
+
+def getTableContents (filename, sep=None, chunksize=TABLE_CHUNK_SIZE):
+
+    LOG.info (f'import table {filename}')
+
     values = []
     uncertainties = []
-        
-    for item in table_dict:
-        v_dict = {}
-        u_dict = {}
-        for v_label in val_labels:
-            if v_label in item:
-                v_dict[v_label] = item[v_label]
-        
-        values.append(v_dict)
-    
-        for u_label in unc_labels:
-            if u_label in item:
-                u_dict[u_label] = item[u_label]
-            
-        uncertainties.append(u_dict)
+
+    for ivalues, iuncertainties in iterTableContents(filename, sep=sep, chunksize=chunksize):
+        values.extend(ivalues)
+        uncertainties.extend(iuncertainties)
     
     if len(values)==0:
         return False, 'No value found', 'Aborted'
 
-    return True, values, uncertainties
\ No newline at end of file
+    return True, values, uncertainties
@@ -0,0 +1,271 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX metrics of the main operations, exported in Prometheus text format
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import bisect
+import threading
+from namastox.logger import get_logger
+
+LOG = get_logger(__name__)
+
+# metrics defined, indexed by name
+REGISTRY = {}
+REGISTRY_LOCK = threading.Lock()
+
+# HTTP server exposing the metrics (see serveMetrics)
+METRICS_SERVER = None
+
+# default buckets of the histograms timing operations, in seconds
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# default buckets of the histograms counting items
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def formatValue (value):
+    if value == float('inf'):
+        return '+Inf'
+    if type(value) == float and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def formatLabels (names, values, extra=None):
+    items = [f'{iname}="{str(ivalue)}"' for iname, ivalue in zip(names, values)]
+    if extra is not None:
+        items.append(extra)
+    if len(items) == 0:
+        return ''
+    return '{'+','.join(items)+'}'
+
+class Metric:
+    ''' Base class of the metrics. The values are stored by tuples of label values, in the order
+        of the label names given in the constructor
+    '''
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key (self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f'metric {self.name} requires labels {self.labels}')
+        return tuple(labels[iname] for iname in self.labels)
+
+    def reset (self):
+        with self.lock:
+            self.values = {}
+
+    def header (self):
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+
+class Counter(Metric):
+    ''' Counter which can only be incremented '''
+    kind = 'counter'
+
+    def inc (self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get (self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def export (self):
+        lines = self.header()
+        with self.lock:
+            values = sorted(self.values.items())
+        for ikey, ivalue in values:
+            lines.append(f'{self.name}{formatLabels(self.labels, ikey)} {formatValue(ivalue)}')
+        return lines
+
+class Timer:
+    ''' context manager observing the time spent in the block in a histogram '''
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter()-self.start, **self.labels)
+        return False
+
+class Histogram(Metric):
+    ''' Histogram counting the values observed in every bucket, with their sum and count. Every
+        observation costs a binary search and the update of one bucket
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe (self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # counts of every bucket (non cumulative) plus +Inf, sum
+                entry = self.values[key] = [[0]*(len(self.buckets)+1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time (self, **labels):
+        ''' returns a context manager observing the time spent in the block, e.g.
+
+            with RA_LOAD_SECONDS.time():
+                ...
+        '''
+        return Timer(self, labels)
+
+    def get (self, **labels):
+        ''' returns a tuple (count, sum) of the observations '''
+        entry = self.values.get(self.key(labels))
+        if entry is None:
+            return 0, 0.0
+        return sum(entry[0]), entry[1]
+
+    def export (self):
+        lines = self.header()
+        with self.lock:
+            values = sorted((ikey, (list(ientry[0]), ientry[1])) for ikey, ientry in self.values.items())
+        for ikey, (icounts, isum) in values:
+            cumulative = 0
+            for ibound, icount in zip(self.buckets+(float('inf'),), icounts):
+                cumulative += icount
+                ilabels = formatLabels(self.labels, ikey, f'le="{formatValue(float(ibound))}"')
+                lines.append(f'{self.name}_bucket{ilabels} {cumulative}')
+            lines.append(f'{self.name}_sum{formatLabels(self.labels, ikey)} {formatValue(isum)}')
+            lines.append(f'{self.name}_count{formatLabels(self.labels, ikey)} {cumulative}')
+        return lines
+
+def register (metric):
+    ''' adds the metric to the registry and returns it. If a metric with the same name is already
+        registered, the existing one is returned instead
+    '''
+    with REGISTRY_LOCK:
+        if metric.name in REGISTRY:
+            return REGISTRY[metric.name]
+        REGISTRY[metric.name] = metric
+    return metric
+
+def counter (name, description, labels=()):
+    return register(Counter(name, description, labels))
+
+def histogram (name, description, labels=(), buckets=TIME_BUCKETS):
+    return register(Histogram(name, description, labels, buckets))
+
+def resetMetrics ():
+    with REGISTRY_LOCK:
+        metrics = list(REGISTRY.values())
+    for imetric in metrics:
+        imetric.reset()
+
+def exportMetrics ():
+    ''' returns all the metrics in Prometheus text format '''
+    with REGISTRY_LOCK:
+        metrics = sorted(REGISTRY.values(), key=lambda x: x.name)
+    lines = []
+    for imetric in metrics:
+        lines += imetric.export()
+    return '\n'.join(lines)+'\n'
+
+def writeMetrics (filename):
+    ''' writes the metrics in Prometheus text format to the file given as argument. The file is
+        replaced atomically, so it can be read at any time (e.g. by the textfile collector of
+        the node exporter)
+    '''
+    tmp_file = f'{filename}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_file, 'w') as f:
+            f.write(exportMetrics())
+        os.replace(tmp_file, filename)
+    except Exception as e:
+        return False, f'unable to write metrics to {filename} with error: {e}'
+
+    return True, filename
+
+def serveMetrics (port=9464, host='127.0.0.1'):
+    ''' starts a thread serving the metrics in Prometheus text format at http://host:port/metrics
+        By default, only local connections are accepted
+    '''
+    global METRICS_SERVER
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = exportMetrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            LOG.debug(format % args)
+
+    if METRICS_SERVER is not None:
+        return False, 'metrics server already running'
+
+    try:
+        METRICS_SERVER = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        return False, f'unable to serve metrics at {host}:{port} with error: {e}'
+
+    threading.Thread(target=METRICS_SERVER.serve_forever, daemon=True).start()
+    port = METRICS_SERVER.server_address[1]
+    LOG.info(f'metrics available at http://{host}:{port}/metrics')
+    return True, port
+
+def stopMetrics ():
+    global METRICS_SERVER
+    if METRICS_SERVER is not None:
+        METRICS_SERVER.shutdown()
+        METRICS_SERVER.server_close()
+        METRICS_SERVER = None
+
+# metrics of the main operations
+
+RA_LOAD_SECONDS = histogram('namastox_ra_load_seconds', 'Time spent loading RAs', ('cache',))
+RA_SAVE_SECONDS = histogram('namastox_ra_save_seconds', 'Time spent saving RAs')
+RA_HISTORY_FILES = histogram('namastox_ra_history_files', 'Number of files in the history of the RAs saved',
+                             buckets=SIZE_BUCKETS)
+WORKFLOW_LOAD_SECONDS = histogram('namastox_workflow_load_seconds', 'Time spent loading workflows', ('source',))
+PREDICTION_CACHE_TOTAL = counter('namastox_prediction_cache_total',
+                                 'Predictions (molecule and model) found or not found in the cache', ('result',))
+FLAME_PROFILE_SECONDS = histogram('namastox_flame_profile_seconds', 'Time spent running predictions with Flame')
+JOBS_TOTAL = counter('namastox_jobs_total', 'Jobs (e.g. batch predictions) by final status', ('status',))
+JOB_SECONDS = histogram('namastox_job_seconds', 'Time from submission to end of the jobs')
+COALESCED_TOTAL = counter('namastox_coalesced_calls_total', 'Calls served by an identical call already in progress', ('action',))
+REPORT_RENDER_SECONDS = histogram('namastox_report_render_seconds', 'Time spent rendering reports', ('format', 'status'))
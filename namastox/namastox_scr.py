@@ -23,32 +23,29 @@
 import os
 import argparse
 from namastox.logger import get_logger
-from namastox import __version__
-from namastox.config import configure
-from namastox.manage import action_new, action_kill, action_list, action_steps, action_info
-from namastox.update import action_update
-from namastox.status import action_status
-from namastox.report import action_report
-from namastox.results import action_results
 
 LOG = get_logger(__name__)
 
-def main():
+# commands which are never forwarded to the daemon
+LOCAL_COMMANDS = ['config', 'serve']
 
-    LOG.debug('-------------NEW RUN-------------\n')
+# number of functions and modules listed in the profile summaries (see profileCommand)
+PROFILE_TOP = 40
+
+def parseArguments(argv=None):
+    ''' parses the command line arguments (argv, or sys.argv if not provided) and returns them as a Namespace '''
 
-    results = None
     parser = argparse.ArgumentParser(description='NAMASTOX')
 
     parser.add_argument('-c', '--command',
                         action='store',
-                        choices=['config', 'new', 'kill', 'list', 'steps', 'info',  'status', 'update', 'results', 'report'],
+                        choices=['config', 'new', 'kill', 'list', 'steps', 'info',  'status', 'update', 'results', 'report', 'batch', 'serve'],
                         help='Action type: \'config\' or \'new\' or \'kill\' or \'list\' or \'steps\' or \'info\' '
-                        'or \'status\' or \'update\' or \'results\' or \'report\'',
+                        'or \'status\' or \'update\' or \'results\' or \'report\' or \'batch\' or \'serve\'',
                         required=True)
 
     parser.add_argument('-r', '--raname',
-                        help='Name of RA',
+                        help='Name of RA. In batch reports, comma-separated list of names or patterns (e.g. "ASPA*")',
                         required=False)
 
     parser.add_argument('-s', '--step',
@@ -75,85 +72,279 @@ def main():
                         help='report in Word format',
                         required=False)
     
+    parser.add_argument('-f', '--format',
+                        help='report format(s): yaml, excel, word or html. In batch reports, comma-separated list',
+                        required=False)
+
+    parser.add_argument('-n', '--workers',
+                        help='number of worker processes used in batch reports',
+                        type=int,
+                        required=False)
+
+    parser.add_argument('--force',
+                        help='regenerate batch reports even if they are up to date',
+                        action='store_true',
+                        required=False)
+
     parser.add_argument('-d', '--directory',
                         help='configuration dir',
                         required=False)
     
     parser.add_argument('-a', '--action',
-                        help='action',
+                        help='action. Use \'stop\' with the serve command to stop a running daemon',
+                        required=False)
+
+    parser.add_argument('--local',
+                        help='run the command in this process, even if a daemon is running',
+                        action='store_true',
                         required=False)
 
-    args = parser.parse_args()
+    parser.add_argument('--trace',
+                        help='file where the timings of the operations run by the command are appended, as JSON lines',
+                        required=False)
+
+    parser.add_argument('--profile',
+                        help='profile the command with cProfile (\'cpu\', default) or with cProfile and tracemalloc (\'memory\'). '
+                             'The statistics and a summary are written next to the log file',
+                        nargs='?',
+                        const='cpu',
+                        choices=['cpu', 'memory'],
+                        required=False)
+
+    parser.add_argument('--metrics',
+                        help='file where the metrics of the operations are written, in Prometheus text format',
+                        required=False)
+
+    args = parser.parse_args(argv)
+
+    # file names are converted to absolute paths, since the command can be run by a daemon
+    for iarg in ['infile', 'outfile', 'directory', 'trace', 'metrics']:
+        if getattr(args, iarg) is not None:
+            setattr(args, iarg, os.path.abspath(getattr(args, iarg)))
+
+    return args
+
+def dispatch(args):
+    ''' runs the command defined in the arguments and returns a tuple (success, results) '''
 
     if args.infile is not None:
         if not os.path.isfile(args.infile):
-            LOG.error(f'Input file {args.infile} not found')
-            return 
+            return False, f'Input file {args.infile} not found'
 
     # make sure flame has been configured before running any command, unless this command if used to 
     # configure flame
     # if args.command != 'config':
     #     utils.config_test()
 
+    # modules implementing the commands are imported only when needed, so every command only
+    # pays the import cost of its own dependencies
     if args.command == 'config':
+        from namastox.config import configure
         success, results = configure(args.directory, (args.action == 'silent'))
         if not success:
-            LOG.error(f'{results}, configuration unchanged')
+            return False, f'{results}, configuration unchanged'
 
     elif args.command == 'new':
         if (args.raname is None or args.outfile is None ):
-            LOG.error('namastox new : raname and output file arguments are compulsory')
-            return
+            return False, 'namastox new : raname and output file arguments are compulsory'
+        from namastox.manage import action_new
         success, results = action_new(args.raname, args.outfile)
 
     elif args.command == 'list':
+        from namastox.manage import action_list
         success, results = action_list()   
 
     elif args.command == 'steps':
         if (args.raname is None ):
-            LOG.error('namastox steps : raname argument is compulsory')
-            return
+            return False, 'namastox steps : raname argument is compulsory'
+        from namastox.manage import action_steps
         success, results = action_steps(args.raname)   
 
     elif args.command == 'info':
         if (args.raname is None ):
-            LOG.error('namastox info : raname argument is compulsory')
-            return
+            return False, 'namastox info : raname argument is compulsory'
+        from namastox.manage import action_info
         success, results = action_info(args.raname)   
 
     elif args.command == 'kill':
         if (args.raname is None):
-            LOG.error('namastox kill : raname argument is compulsory')
-            return
+            return False, 'namastox kill : raname argument is compulsory'
+        from namastox.manage import action_kill
         success, results = action_kill(args.raname)   
 
     elif args.command == 'status':
         if (args.raname is None):
-            LOG.error('namastox status : raname argument is compulsory')
-            return
+            return False, 'namastox status : raname argument is compulsory'
+        from namastox.status import action_status
         success, results = action_status(args.raname, args.step, args.outfile)   
 
     elif args.command == 'update':
         if (args.raname is None or args.infile is None or args.outfile is None ):
-            LOG.error('namastox update : raname, input file and output file arguments are compulsory')
-            return
+            return False, 'namastox update : raname, input file and output file arguments are compulsory'
+        from namastox.update import action_update
         success, results = action_update (args.raname, args.infile, args.outfile)
 
     elif args.command == 'results':
         if (args.raname is None ):
-            LOG.error('namastox update : raname argument is compulsory')
-            return
+            return False, 'namastox update : raname argument is compulsory'
+        from namastox.results import action_results
         success, results = action_results (args.raname, args.step)
 
     elif args.command == 'report':
-        if (args.raname is None or (args.pdf is None and args.word is None)):
-            LOG.error('namastox report : raname and PDF or Word output file arguments are compulsory')
-            return
+        report_format = args.format
+        if report_format is None and args.word is not None:
+            report_format = 'word'
+
+        if (args.raname is None or report_format is None):
+            return False, 'namastox report : raname and format (or Word output file) arguments are compulsory'
+
+        from namastox.report import action_report
+        success, results = action_report (args.raname, report_format)
+
+    elif args.command == 'batch':
+        if (args.raname is None or args.format is None):
+            return False, 'namastox batch : raname list and format arguments are compulsory'
+
+        patterns = [i.strip() for i in args.raname.split(',') if i.strip()!='']
+        formats = [i.strip() for i in args.format.split(',') if i.strip()!='']
+        from namastox.report import action_report_batch
+        success, results = action_report_batch (patterns, formats, args.workers, args.force)
+
+    elif args.command == 'serve':
+        from namastox.daemon import serve, stop
+        if args.action == 'stop':
+            success, results = stop()
+        else:
+            success, results = serve()
+
+    return success, results
+
+def moduleName(filename):
+    ''' returns the name of the module (or the file name, if not found) defined in the file given as argument '''
+    import sys
+    for ipath in sorted(sys.path, key=len, reverse=True):
+        if ipath and filename.startswith(ipath+os.sep):
+            module = os.path.splitext(filename[len(ipath)+1:])[0].replace(os.sep, '.')
+            return module[:-9] if module.endswith('.__init__') else module
+    return filename
+
+def profileCommand(args):
+    ''' runs the command as dispatch does. If requested in the arguments, the command is run under 
+        cProfile and, optionally, tracemalloc. The statistics are written to a .prof file, next to 
+        the log file, together with a text summary listing the functions with the largest cumulative 
+        time and the modules allocating more memory
+    '''
+    if args.profile is None:
+        return dispatch(args)
+
+    import io
+    import time
+    import pstats
+    import cProfile
+    import tracemalloc
+    from namastox.logger import get_log_file
+
+    basename = os.path.join(get_log_file().parent, f"namastox_{args.command}_{time.strftime('%Y%m%d_%H%M%S')}")
+
+    memory = (args.profile == 'memory')
+    if memory:
+        tracemalloc.start()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return dispatch(args)
+    finally:
+        profiler.disable()
+
+        # the memory used by the profilers themselves is not reported
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, cProfile.__file__),
+                                                                  tracemalloc.Filter(False, tracemalloc.__file__)])
+            tracemalloc.stop()
+
+        profiler.dump_stats(basename+'.prof')
+
+        summary = io.StringIO()
+        summary.write(f'namastox {args.command} profile ({time.strftime("%Y-%m-%d %H:%M:%S")})\n\n')
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+
+        if memory:
+            modules = {}
+            for istat in snapshot.statistics('filename'):
+                imodule = moduleName(istat.traceback[0].filename)
+                size, count = modules.get(imodule, (0, 0))
+                modules[imodule] = (size+istat.size, count+istat.count)
+
+            summary.write(f'memory allocated: {current/1024:.1f} KiB, peak: {peak/1024:.1f} KiB\n\n')
+            summary.write(f'{"KiB":>12} {"blocks":>10}  module\n')
+            for imodule, (size, count) in sorted(modules.items(), key=lambda x: -x[1][0])[:PROFILE_TOP]:
+                summary.write(f'{size/1024:12.1f} {count:10d}  {imodule}\n')
+
+        with open(basename+'.txt', 'w') as f:
+            f.write(summary.getvalue())
+
+        LOG.info(f'profile of {args.command} written to {basename}.prof and {basename}.txt')
+
+def runCommand(args):
+    ''' runs the command as dispatch does, appending the spans recorded to the trace file,
+        profiling it and writing the metrics to the metrics file, if requested in the arguments
+    '''
+    if args.trace is None:
+        success, results = profileCommand(args)
+    else:
+        from namastox import trace
+        enabled = trace.isEnabled()
+        trace.enableTracing()
+        try:
+            with trace.span(f'command.{args.command}'):
+                success, results = profileCommand(args)
+        finally:
+            trace.enableTracing(enabled)
+            trace.exportSpans(args.trace)
+
+    if args.metrics is not None:
+        from namastox.metrics import writeMetrics
+        metrics_success, metrics_results = writeMetrics(args.metrics)
+        if not metrics_success:
+            LOG.error(metrics_results)
+
+    return success, results
+
+def main(argv=None):
+
+    from namastox.utils import apply_log_config
+    apply_log_config()
+
+    LOG.debug('-------------NEW RUN-------------\n')
+
+    args = parseArguments(argv)
+
+    # commands are forwarded to the daemon, if running, and run in this process otherwise
+    forwarded = None
+    if not args.local and args.command not in LOCAL_COMMANDS:
+        from namastox.daemon import forward
+        forwarded = forward(args)
+
+    if forwarded is not None:
+        success, results = forwarded
+    else:
+        success, results = runCommand(args)
+
+    if args.command == 'batch' and success:
+        LOG.info(f"{len(results['completed'])} report(s) completed, {len(results['skipped'])} skipped, "
+                 f"{len(results['failed'])} failed")
+        for ifailed in results['failed']:
+            LOG.error(f"{ifailed['raname']} ({ifailed['format']}): {ifailed['error']}")
+        return
 
-        success, results = action_report (args.raname, args.pdf, args.word)
-    
     if results is not None and type(results) != dict:
-        LOG.info (results)
+        if success:
+            LOG.info (results)
+        else:
+            LOG.error (results)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -21,11 +21,13 @@
 # along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
 
 from namastox.ra import Ra
+from namastox.trace import traced
 import os
 import random
 import string
 from datetime import date
 
+@traced
 def action_notes(raname, step=None, out='json'):
     ''' returns the list of results available for this raname/step
     '''
@@ -41,6 +43,7 @@ def action_notes(raname, step=None, out='json'):
 
     return True, notes
 
+@traced
 def action_note(raname, noteid):
     ''' returns a given note for this raname
     '''
@@ -61,6 +64,7 @@ def action_note(raname, noteid):
     return False, f'no note with id {noteid} found'
 
 
+@traced
 def action_note_add (raname,  note):
     ''' adds the note given as argument to this raname
     '''
@@ -90,6 +94,7 @@ def action_note_add (raname,  note):
     
     return True, 'OK'
 
+@traced
 def action_note_delete(raname, noteid):
     ''' remove a given note for this raname
     '''
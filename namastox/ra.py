@@ -26,12 +26,69 @@ import yaml
 import os
 import time
 import hashlib
+import copy
+import threading
+from collections import OrderedDict
 from namastox.utils import ra_path, TASK_TYPES
 from namastox.task import Task
 from namastox.workflow import Workflow
 from namastox.logger import get_logger
+from namastox.trace import traced
+from namastox.metrics import RA_LOAD_SECONDS, RA_SAVE_SECONDS, RA_HISTORY_FILES
 LOG = get_logger(__name__)
 
+# parsed RA files, indexed by (RA path, step). Only used in long running processes (see enableCache)
+RA_CACHE = None
+RA_CACHE_SIZE = 256
+RA_CACHE_LOCK = threading.Lock()
+
+def enableCache (size=RA_CACHE_SIZE):
+    ''' keeps in memory the contents of the last RA files loaded, so they are only parsed again when
+        the files change. Used by the daemon, where the same RAs are loaded many times
+    '''
+    global RA_CACHE, RA_CACHE_SIZE
+    with RA_CACHE_LOCK:
+        RA_CACHE = OrderedDict()
+        RA_CACHE_SIZE = size
+
+def getCachedRa (rapath, step):
+    ''' returns a tuple (revision, contents) with a copy of the cached contents of the RA and step given
+        as argument, or None if not cached or if the file changed since it was cached
+    '''
+    if RA_CACHE is None:
+        return None
+
+    with RA_CACHE_LOCK:
+        entry = RA_CACHE.get((rapath, step))
+        if entry is not None:
+            RA_CACHE.move_to_end((rapath, step))
+
+    if entry is None:
+        return None
+
+    revision, contents = entry
+    try:
+        ra_stat = os.stat(revision[0])
+    except OSError:
+        return None
+
+    if (revision[0], ra_stat.st_mtime_ns, ra_stat.st_size) != revision:
+        return None
+
+    return revision, copy.deepcopy(contents)
+
+def setCachedRa (rapath, step, revision, contents):
+    ''' stores a copy of the contents of the RA and step given as argument in the cache, if enabled '''
+    if RA_CACHE is None:
+        return
+
+    contents = copy.deepcopy(contents)
+    with RA_CACHE_LOCK:
+        RA_CACHE[(rapath, step)] = (revision, contents)
+        RA_CACHE.move_to_end((rapath, step))
+        while len(RA_CACHE) > RA_CACHE_SIZE:
+            RA_CACHE.popitem(last=False)
+
 class Ra:
     ''' Class storing all the risk assessment information
     '''
@@ -42,6 +99,9 @@ class Ra:
         self.raname = raname
         self.rapath = ra_path(raname)
         self.workflow = None  
+
+        # identifies the version of the YAML file loaded (see load)
+        self.revision = None
         
         # default, these are loaded from a YAML file
         self.ra = {
@@ -138,9 +198,12 @@ class Ra:
                     self.users_write = '*'
     
 
+    @traced
     def load(self, step=None):       
         ''' load the Ra object from a YAML file
         '''
+        start = time.perf_counter()
+
         # obtain the path and the default name of the raname parameters
         if not os.path.isdir (self.rapath):
             return False, f'Risk assessment "{self.rapath}" not found'
@@ -150,38 +213,50 @@ class Ra:
         if not os.path.isfile(ra_file_name):
             return False, f'Risk assessment definition {ra_file_name} file not found'
 
-        # load status from yaml
-        yaml_dict = {}
-        try:
-            with open(ra_file_name, 'r') as pfile:
-                yaml_dict = yaml.safe_load(pfile)
-        except Exception as e:
-            return False, f'error:{e}'
-        
-        # if a defined step is requested
         if step is not None:
             try:
                 step = int(step)
             except:
                 return False, 'step must be a positive int'
 
-            found = False
-            # check first if the requested step is the last one
-            if not self.checkStep(yaml_dict, step):
-                ra_hist_path = os.path.join (self.rapath,'hist')
-                for ra_hist_file in os.listdir(ra_hist_path):
-                    ra_hist_item = os.path.join(ra_hist_path, ra_hist_file)
-                    if os.path.isfile(ra_hist_item):
-                        idict = {}
-                        with open(ra_hist_item, 'r') as pfile:
-                            idict = yaml.safe_load(pfile)
-                        if self.checkStep(idict, step):
-                            yaml_dict = idict
-                            found = True
-                            break
+        # the contents of the file are parsed only if not cached
+        cached = getCachedRa(self.rapath, step)
+        if cached is not None:
+            self.revision, yaml_dict = cached
+        else:
+            # load status from yaml
+            yaml_dict = {}
+            try:
+                ra_stat = os.stat(ra_file_name)
+                self.revision = (ra_file_name, ra_stat.st_mtime_ns, ra_stat.st_size)
+                with open(ra_file_name, 'r') as pfile:
+                    yaml_dict = yaml.safe_load(pfile)
+            except Exception as e:
+                return False, f'error:{e}'
+        
+            # if a defined step is requested
+            if step is not None:
+                found = False
+                # check first if the requested step is the last one
+                if not self.checkStep(yaml_dict, step):
+                    ra_hist_path = os.path.join (self.rapath,'hist')
+                    for ra_hist_file in os.listdir(ra_hist_path):
+                        ra_hist_item = os.path.join(ra_hist_path, ra_hist_file)
+                        if os.path.isfile(ra_hist_item):
+                            idict = {}
+                            with open(ra_hist_item, 'r') as pfile:
+                                idict = yaml.safe_load(pfile)
+                            if self.checkStep(idict, step):
+                                yaml_dict = idict
+                                ra_stat = os.stat(ra_hist_item)
+                                self.revision = (ra_hist_item, ra_stat.st_mtime_ns, ra_stat.st_size)
+                                found = True
+                                break
                                 
-                if not found:
-                    return False, 'step not found'                
+                    if not found:
+                        return False, 'step not found'                
+
+            setCachedRa(self.rapath, step, self.revision, yaml_dict)
 
         # validate yaml_dict
         keylist = ['ra', 'general', 'results', 'notes']
@@ -193,20 +268,30 @@ class Ra:
         if self.ra['step']>0 : 
             self.workflow = Workflow(self.raname, self.ra['workflow_name'])
 
+        RA_LOAD_SECONDS.observe(time.perf_counter()-start, cache='miss' if cached is None else 'hit')
         return True, 'OK'
 
+    @traced
     def save (self):
         ''' saves the Ra object to a YAML file
         '''
+        start = time.perf_counter()
         rafile = os.path.join (self.rapath,'ra.yaml')
+
         dict_temp = {
             'ra': self.ra,
             'general': self.general, 
             'results': self.results,
             'notes': self.notes
         }
-        with open(rafile,'w') as f:
+        # the file is replaced at once, so other processes reading the RA never find it half written
+        tmpfile = f'{rafile}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmpfile,'w') as f:
             f.write(yaml.dump(dict_temp))
+        os.replace(tmpfile, rafile)
+
+        ra_stat = os.stat(rafile)
+        self.revision = (rafile, ra_stat.st_mtime_ns, ra_stat.st_size)
 
         # rename other yaml file in the historic describing the same step as bk_
         step = self.ra['step']
@@ -215,7 +300,8 @@ class Ra:
 
         rahistpath = os.path.join (self.rapath,'hist')
 
-        for ra_hist_file in os.listdir(rahistpath):
+        hist_files = os.listdir(rahistpath)
+        for ra_hist_file in hist_files:
             if not ra_hist_file.startswith('ra_'):
                 continue
             ra_hist_item = os.path.join(rahistpath, ra_hist_file)
@@ -243,6 +329,9 @@ class Ra:
         rahist = os.path.join (rahistpath,f'ra{time_label}.yaml')
         shutil.copyfile(rafile, rahist)
 
+        RA_HISTORY_FILES.observe(len(hist_files)+1)
+        RA_SAVE_SECONDS.observe(time.perf_counter()-start)
+
     def getStatus(self):
         ''' return a dictionary with RA status
         '''
@@ -396,6 +485,11 @@ class Ra:
 
         self.general = input['general']
 
+        # substances are added to the registry and referenced by key. The RA is removed from the 
+        # substances no longer listed
+        from namastox.substance import registerSubstances
+        registerSubstances(self.general.get('substances') or [], self.raname)
+
         # if we are aditing an existing RA, simply return
         if self.ra['step']>0:
             LOG.info('Existing general info has been updated')
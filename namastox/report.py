@@ -22,17 +22,22 @@
 
 from namastox.logger import get_logger
 from namastox.ra import Ra
+from namastox.trace import traced
+from namastox.metrics import REPORT_RENDER_SECONDS
+from namastox.reportview import getReportView
 import os
 import yaml
-from rdkit import Chem
-from rdkit.Chem import Draw
-import xlsxwriter
+import time
 from datetime import date
-from namastox.utils import id_generator
-import docx
-from docx.shared import Cm
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
+from namastox.utils import ra_repository_path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import fnmatch
+import base64
+import io
+import html
+import re
+from urllib.parse import urlsplit
 
 # from docx import Document
 # from docx.shared import Pt
@@ -40,7 +45,15 @@ from docx.oxml import OxmlElement
 
 LOG = get_logger(__name__)
 
+# name of the file generated in the RA folder for every report format
+REPORT_FILES = {'yaml': 'report.yaml',
+                'excel': 'report.xlsx',
+                'word': 'report.docx',
+                'html': 'report.html'}
+
 def generateSubstanceImage (smiles, oname):
+    from rdkit import Chem
+    from rdkit.Chem import Draw
     try:
         m = Chem.MolFromSmiles(smiles)
     except:
@@ -49,7 +62,33 @@ def generateSubstanceImage (smiles, oname):
     Draw.MolToFile(m, oname, imageType='png')
     return True
 
+def getSubstanceImage (ra, i, substance):
+    ''' returns the path to the PNG image for the i-th substance of the RA. Registered substances use the
+        image stored in the substance registry, otherwise the image is cached in the RA folder. Both are 
+        generated only when not present. Returns None if the image cannot be generated
+    '''
+    from namastox.substance import SubstanceRegistry
+
+    if 'inchikey' in substance:
+        try:
+            spath = SubstanceRegistry().getImage(substance['inchikey'])
+            if spath is not None:
+                return spath
+        except Exception as e:
+            LOG.debug(f'unable to obtain registry image for {substance["inchikey"]}: {e}')
+
+    spath = os.path.join(ra.rapath, f'substance-{str(i)}.png')
+    if os.path.isfile(spath):
+        return spath
+    if generateSubstanceImage(substance['smiles'], spath):
+        return spath
+    return None
+
+@traced
 def report_excel (ra):
+    import xlsxwriter
+
+    view = getReportView(ra)
     reportfile = os.path.join (ra.rapath,'report.xlsx')
 
     if os.path.isfile(reportfile):
@@ -83,11 +122,7 @@ def report_excel (ra):
         worksheet.write(irow, 3, raitem[ilabel], value_format )
         irow+=1
 
-    substances_items = ra.general['substances']
-
-    # generate substance image
-    if 'smiles' in substances_items:
-        generateSubstanceImage(ra, substances_items['smiles'])
+    substances_items = view.substances
 
     substance_keys = ['name', 'casrn', 'id', 'smiles']
     
@@ -96,12 +131,8 @@ def report_excel (ra):
 
         # generate substance image
         if 'smiles' in isubstance:
-            spath = os.path.join(ra.rapath, f'substance-{str(i)}.png')
-            if os.path.isfile(spath):
-                success = True
-            else:
-                success = generateSubstanceImage(isubstance['smiles'],spath)
-            if success:
+            spath = getSubstanceImage(ra, i, isubstance)
+            if spath is not None:
                 worksheet.set_row(irow, 60)
                 worksheet.write(irow, 2, 'structure', label_format )
                 worksheet.insert_image (irow, 3, spath, {"x_scale": 0.25, "y_scale": 0.25})
@@ -119,20 +150,12 @@ def report_excel (ra):
     # Results section
 
     bool_to_text = {True:'Yes', False:'No'}
-    workflow = ra.workflow
-
-    for reitem in ra.results:
-
-        # Name and Description are not in results but in workflow
-        inode = workflow.getNode(reitem['id'])
-        itask = inode.getTask()
-        idict = itask.getDescriptionDict()
-        name = idict['task description']['name']
-        description = idict['task description']['description']
-        if 'label' in reitem:
-            label = reitem['label']
-        else:
-            label = ''
+
+    for item in view.results:
+        reitem = item['result']
+        name = item['name']
+        description = item['description']
+        label = item['label']
 
         worksheet.write(irow, 0, name+f" ({label})", label_format )
 
@@ -144,7 +167,7 @@ def report_excel (ra):
         worksheet.write(irow, 3, reitem['summary'], value_format )
         irow+=1
 
-        if 'decision' in reitem:
+        if item['kind'] == 'decision':
             worksheet.write(irow, 1, 'decision', label_format )
             worksheet.write(irow, 3, bool_to_text[reitem['decision']], value_format )
             irow+=1
@@ -200,10 +223,10 @@ def report_excel (ra):
 
                             irow+=1
                         
-                if len(reitem['values'])==len(reitem['uncertainties']):
+                if item['pairs'] is not None:
                     worksheet.write(irow, 1, 'result', label_format )
                     
-                    for iresult,iuncertain in zip(reitem['values'],reitem['uncertainties']):
+                    for iresult,iuncertain in item['pairs']:
                             
                         if 'substance' in iresult:
                             worksheet.write(irow, 2, iresult['substance'], label_format )
@@ -276,7 +299,7 @@ def report_excel (ra):
     irow+=1
 
     # Notes section
-    for noitem in ra.notes:
+    for noitem in view.notes:
         worksheet.write(irow, 0, f"{noitem['title']} ({noitem['id']})", label_format )
         worksheet.write(irow, 1, 'note', label_format )
         worksheet.write(irow, 3, noitem['text'], value_format )
@@ -294,11 +317,139 @@ def report_excel (ra):
 
     return True, reportfile
 
-def addGeneralSection (document, ra, item):
-    if item in ra.general and ra.general[item]!=None and len(ra.general[item])>2:
-        item_title = item.capitalize().replace('_',' ')
-        document.add_heading(item_title, level=3)
-        document.add_paragraph (ra.general[item])
+# base Word document shared by all reports (see getWordTemplate)
+WORD_TEMPLATE = None
+
+# table styles used in Word reports
+WORD_TABLE_STYLES = ['Table Grid', 'Light Grid Accent 1']
+
+def addTOC (paragraph):
+    ''' appends to the paragraph a Word field with a table of contents, updated by the
+        end-user when the document is opened
+    '''
+    from docx.oxml.ns import qn
+    from docx.oxml import OxmlElement
+
+    run = paragraph.add_run()
+
+    fldChar = OxmlElement('w:fldChar')  # creates a new element
+    fldChar.set(qn('w:fldCharType'), 'begin')  # sets attribute on element
+
+    instrText = OxmlElement('w:instrText')
+    instrText.set(qn('xml:space'), 'preserve')  # sets attribute on element
+    instrText.text = 'TOC \\o "1-2" \\h \\z \\u'   # change 1-3 depending on heading levels you need
+
+    fldChar2 = OxmlElement('w:fldChar')
+    fldChar2.set(qn('w:fldCharType'), 'separate')
+
+    fldChar3 = OxmlElement('w:t')
+    fldChar3.text = "<Please right-click to update TOC>"
+
+    fldChar2.append(fldChar3)
+
+    fldChar4 = OxmlElement('w:fldChar')
+    fldChar4.set(qn('w:fldCharType'), 'end')
+
+    r_element = run._r
+    r_element.append(fldChar)
+    r_element.append(instrText)
+    r_element.append(fldChar2)
+    r_element.append(fldChar4)
+
+def getWordTemplate ():
+    ''' returns the base document used by all Word reports, serialized as bytes. The document 
+        contains the fixed sections and the table of contents, with placeholders for the title and 
+        the date. It is built only once per process and cloned for every report by WordReport
+    '''
+    import docx
+
+    global WORD_TEMPLATE
+
+    if WORD_TEMPLATE is None:
+        document = docx.Document()
+
+        # Title and date placeholders, replaced in every report
+        document.add_heading('<Title>', 0)
+        document.add_paragraph ('<Report date>')
+
+        # Fixed sections
+        document.add_paragraph ('Author')
+        document.add_paragraph ('<Disclaimer>')  
+        document.add_paragraph ('<How to use this report>')  
+
+        # Table of Contents
+        document.add_heading ('Table of Contents')
+        addTOC (document.add_paragraph())
+
+        # make sure the styles used in the reports are defined in the template
+        for istyle in WORD_TABLE_STYLES + ['List Bullet']:
+            document.styles[istyle]
+
+        buffer = io.BytesIO()
+        document.save(buffer)
+        WORD_TEMPLATE = buffer.getvalue()
+
+    return WORD_TEMPLATE
+
+class WordReport:
+    ''' Small fragment API used to write the sections of a Word report over a clone
+        of the base template returned by getWordTemplate
+    '''
+    def __init__(self, title):
+        ''' constructor '''
+        import docx
+        self.document = docx.Document(io.BytesIO(getWordTemplate()))
+
+        # fill the title and date placeholders
+        paragraphs = self.document.paragraphs
+        paragraphs[0].runs[0].text = str(title) if title is not None else ''
+        paragraphs[1].runs[0].text = f'Report date {date.today().isoformat()}'
+
+        # styles are resolved by name only once
+        self.styles = {}
+        for istyle in WORD_TABLE_STYLES + ['List Bullet']:
+            self.styles[istyle] = self.document.styles[istyle]
+
+    def heading (self, text, level=1):
+        return self.document.add_heading (text, level=level)
+
+    def paragraph (self, text=''):
+        return self.document.add_paragraph (text)
+
+    def bullet (self, text):
+        return self.document.add_paragraph (text, style=self.styles['List Bullet'])
+
+    def link (self, label, url):
+        ''' adds a bullet with the label given as argument, followed by a hyperlink to url '''
+        link_p = self.bullet(label+' : ')
+        addHyperlink(link_p, url, url)
+
+    def picture (self, path, width=4.0):
+        from docx.shared import Cm
+        self.document.add_picture (path, width=Cm(width))
+
+    def frame (self, text):
+        ''' adds the text in italics, inside a single cell table '''
+        t = self.document.add_table(rows = 1, cols = 1, style=self.styles['Table Grid'])
+        t.rows[0].cells[0].paragraphs[0].add_run(text).italic = True
+
+    def table (self, header, rows, style='Light Grid Accent 1'):
+        ''' adds a table with the header and the list of rows given as argument. All rows
+            are created at once and the style is applied to the table, not to every row
+        '''
+        t = self.document.add_table(rows = 1+len(rows), cols=len(header), style=self.styles[style])
+        t.autofit = True
+        for icell, ival in zip(t.rows[0].cells, header):
+            icell.text = ival
+        for irow, row_values in zip(t.rows[1:], rows):
+            for icell, ival in zip(irow.cells, row_values):
+                if ival is not None:
+                    insertText(icell, ival)
+        return t
+
+    def save (self, reportfile):
+        self.document.save(reportfile)
+
 
 def addHyperlink(paragraph, url, text):
     """
@@ -309,6 +460,7 @@ def addHyperlink(paragraph, url, text):
     :param text: The text displayed for the url
     :return: The hyperlink object
     """
+    import docx
 
     # This gets access to the document.xml.rels file and gets a new relation id value
     part = paragraph.part
@@ -336,36 +488,25 @@ def addHyperlink(paragraph, url, text):
 def insertText (cell, val):
     cell.text = str(val) 
 
-def addResult (document, ra, reitem, section, order):
+def addResult (report, item, section, order):
     bool_to_text = {True:'Yes', False:'No'}
-    workflow = ra.workflow
-
-    # Name and Description are not in results but in workflow
-    inode = workflow.getNode(reitem['id'])
-    itask = inode.getTask()
-    idict = itask.getDescriptionDict()
-    name = idict['task description']['name']
-    description = idict['task description']['description']
-    if 'label' in reitem:
-        label = reitem['label']
-    else:
-        label = ''
+    reitem = item['result']
+    name = item['name']
+    description = item['description']
+    label = item['label']
 
-    #TODO add subsection number
-    document.add_heading (f"{str(section)}.{str(order)} {name} ({label})", level=2)
-    t = document.add_table(rows = 1, cols = 1, style='Table Grid')
-    dparagraph = t.rows[0].cells[0].paragraphs[0]
-    dparagraph.add_run(description).italic = True
+    report.heading (f"{str(section)}.{str(order)} {name} ({label})", level=2)
+    report.frame (description)
     
-    document.add_heading ('Summary', level=3)
-    document.add_paragraph(reitem['summary'])
+    report.heading ('Summary', level=3)
+    report.paragraph(reitem['summary'])
 
-    if 'decision' in reitem:
-        document.add_heading('Decision', level=3)
-        document.add_paragraph(bool_to_text[reitem['decision']])
+    if item['kind'] == 'decision':
+        report.heading('Decision', level=3)
+        report.paragraph(bool_to_text[reitem['decision']])
 
-        document.add_heading('Justification', level=3 )
-        document.add_paragraph(reitem['justification'])
+        report.heading('Justification', level=3 )
+        report.paragraph(reitem['justification'])
     
     else:
         # Table with methods
@@ -373,154 +514,77 @@ def addResult (document, ra, reitem, section, order):
             methods = reitem['methods']
             if len(methods)>0:
 
-                document.add_heading('Methods', level=3 )
-        
-                t = document.add_table(rows = 1, cols=6)
-                t.style = 'Light Grid Accent 1'
-                t.autofit = True
-                hdr_cells = t.rows[0].cells
-                hdr_cells[0].text = 'Name'
-                hdr_cells[1].text = 'Description'
-                hdr_cells[2].text = 'Link'
-                hdr_cells[3].text = 'Sensit.'
-                hdr_cells[4].text = 'Spec.'
-                hdr_cells[5].text = 'SD'
-        
+                report.heading('Methods', level=3 )
+
+                rows = []
+                doc_links = []
                 for iresult in methods:
-                    line_cells = t.add_row().cells
-                    insertText(line_cells[0], iresult['name'])
-                    if 'description' in iresult:
-                        insertText(line_cells[1], iresult['description'])
-                    if 'link' in iresult:
-                        link = iresult['link']
-                        insertText(line_cells[2], link)
-
-                        # model documentation in included in the zip with attachements and 
-                        # can be linked
-                        if link.startswith('documentation_'):
-                            link_p = document.add_paragraph (link+' : ', style='List Bullet')
-                            addHyperlink(link_p, link, link)
-
-                    if 'sensitivity' in iresult:
-                        insertText(line_cells[3], iresult['sensitivity'])
-                    if 'specificity' in iresult:
-                        insertText(line_cells[4], iresult['specificity'])
-                    if 'sd' in iresult:
-                        insertText(line_cells[5], iresult['sd'])
-
-
-        document.add_heading('Result', level=3 )
+                    rows.append([iresult.get(ikey) for ikey in ['name', 'description', 'link', 'sensitivity', 'specificity', 'sd']])
+
+                    # model documentation in included in the zip with attachements and 
+                    # can be linked
+                    if 'link' in iresult and iresult['link'].startswith('documentation_'):
+                        doc_links.append(iresult['link'])
+        
+                report.table(['Name', 'Description', 'Link', 'Sensit.', 'Spec.', 'SD'], rows)
+
+                for link in doc_links:
+                    report.link(link, link)
+
+        report.heading('Result', level=3 )
 
         if reitem['result_type'] == 'text':
 
             for iresult in reitem['values']:
-                document.add_paragraph(iresult)
+                report.paragraph(iresult)
 
         elif reitem['result_type'] == 'value':
-                
 
             # Table with values and uncertainties
-            if len(reitem['values'])==len(reitem['uncertainties']):
+            if item['pairs'] is not None:
 
-                # check if there is at least one element for the three optional columns
-                iheader = 3
-                method_touch = False
-                for iresult in reitem['values']:
-                    if 'method' in iresult and iresult['method']!='':
-                        method_touch = True
-                        iheader+=1
-                        break
+                # optional columns with at least one element
+                method_touch = item['columns']['method']
+                unit_touch = item['columns']['unit']
+                uncertainty_touch = item['columns']['uncertainty']
+                term_touch = item['columns']['term']
 
-                unit_touch = False
-                for iresult in reitem['values']:
-                    if 'unit' in iresult and iresult['unit']!='':
-                        unit_touch = True
-                        iheader+=1
-                        break
-
-                uncertainty_touch = False
-                for iuncertain in reitem['uncertainties']:
-                    if 'uncertainty' in iuncertain and iuncertain['uncertainty'] != 0:
-                        uncertainty_touch = True
-                        iheader+=1
-                        break
-
-                term_touch = False
-                for iuncertain in reitem['uncertainties']:
-                    if 'term' in iuncertain and iuncertain['term'] != '':
-                        term_touch = True
-                        iheader+=1
-                        break
-
-                t = document.add_table(rows = 1, cols=iheader)
-
-                # t.style = 'Table Grid'
-                t.style = 'Light Grid Accent 1'
-                t.autofit = True
-                hdr_cells = t.rows[0].cells
-                hdr_cells[0].text = 'Substance'
-                hdr_cells[1].text = 'Parameter'
-                hdr_cells[2].text = 'Value'
-                
-                # add headers for optional columns
-                iheader = 3
+                header = ['Substance', 'Parameter', 'Value']
                 if method_touch:
-                    hdr_cells[iheader].text = 'Method'
-                    iheader +=1 
-
+                    header.append('Method')
                 if unit_touch:
-                    hdr_cells[iheader].text = 'Unit'
-                    iheader +=1
-
+                    header.append('Unit')
                 if uncertainty_touch:
-                    hdr_cells[iheader].text = 'Uncertainty'
-                    iheader +=1
-
+                    header.append('Uncertainty')
                 if term_touch:
-                    hdr_cells[iheader].text = 'Term'
-
-                for iresult,iuncertain in zip(reitem['values'],reitem['uncertainties']):
-                    line_cells = t.add_row().cells
-                    if 'substance' in iresult:
-                        insertText(line_cells[0], iresult['substance'])
+                    header.append('Term')
 
-                    if 'parameter' in iresult:
-                        insertText(line_cells[1], iresult['parameter'])
-
-                    if 'value' in iresult:
-                        insertText(line_cells[2], iresult['value'])
+                rows = []
+                for iresult,iuncertain in item['pairs']:
+                    row = [iresult.get('substance'), iresult.get('parameter'), iresult.get('value')]
 
                     # for the optional columns, add only if the column exist, but even
                     # so, check if for this particular objetc we must add something
-                    
-                    icol = 3
                     if method_touch:
-                        if 'method' in iresult and iresult['method']!='':
-                            insertText(line_cells[icol], iresult['method'])
-                        icol+=1
-                    
+                        row.append(iresult['method'] if 'method' in iresult and iresult['method']!='' else None)
                     if unit_touch:
-                        if 'unit' in iresult and iresult['unit']!='':
-                            insertText(line_cells[icol], iresult['unit'])
-                        icol+=1
-
+                        row.append(iresult['unit'] if 'unit' in iresult and iresult['unit']!='' else None)
                     if uncertainty_touch:
-                        if 'uncertainty' in iuncertain and iuncertain['uncertainty'] != '':
-                            insertText(line_cells[icol], iuncertain['uncertainty'])
-                        icol+=1
-
+                        row.append(iuncertain['uncertainty'] if 'uncertainty' in iuncertain and iuncertain['uncertainty']!='' else None)
                     if term_touch:
-                        if 'term' in iuncertain and iuncertain['term'] != '':
-                            insertText(line_cells[icol], iuncertain['term'])
+                        row.append(iuncertain['term'] if 'term' in iuncertain and iuncertain['term']!='' else None)
+                    rows.append(row)
+
+                report.table(header, rows)
                         
     if len(reitem['links'])> 0:    
-        document.add_heading('Supporting documents', level=3 )
+        report.heading('Supporting documents', level=3 )
         for ilink in reitem['links']: 
-            link_p = document.add_paragraph (ilink['label'].replace('_',' ')+' : ', style='List Bullet')
-            addHyperlink(link_p, ilink['File'], ilink['File'])
-
+            report.link (ilink['label'].replace('_',' '), ilink['File'])
 
+@traced
 def report_word (ra):
+    view = getReportView(ra)
     reportfile = os.path.join (ra.rapath,'report.docx')
 
     if os.path.isfile(reportfile):
@@ -528,69 +592,16 @@ def report_word (ra):
             os.remove(reportfile)
         except:
             return False, 'Failed! the report file is open or not writtable'
-        
-    # path = os.path.dirname(os.path.abspath(__file__))
-    # path = os.path.join(path,'default')
-    # template = os.path.join(path,'generic_word.docx')
-    # document = Document(template)
-    document = docx.Document()
-
-    ## define style for normal and heading 1
-    # normal_style = document.styles['Normal']
-    # normal_font = normal_style.font
-    # normal_font.name = 'Calibri'
-    # normal_font.size = Pt(10)
-
-    # heading_style = document.styles['heading 1']
-    # heading_font = heading_style.font
-    # heading_font.name = 'Calibri'
-    # heading_font.color.rgb = RGBColor(0x00, 0x00, 0x00)
-    # heading_font.size = Pt(12)
-
-    # Title
-    document.add_heading(ra.general['title'], 0)
-
-    # Fixed sections
-    document.add_paragraph (f'Report date {date.today().isoformat()}')
-    document.add_paragraph ('Author')
-    document.add_paragraph ('<Disclaimer>')  
-    document.add_paragraph ('<How to use this report>')  
-
-    # Table of Contents
-    document.add_heading ('Table of Contents')
-    paragraph = document.add_paragraph()
-    run = paragraph.add_run()
-
-    fldChar = OxmlElement('w:fldChar')  # creates a new element
-    fldChar.set(qn('w:fldCharType'), 'begin')  # sets attribute on element
-
-    instrText = OxmlElement('w:instrText')
-    instrText.set(qn('xml:space'), 'preserve')  # sets attribute on element
-    instrText.text = 'TOC \\o "1-2" \\h \\z \\u'   # change 1-3 depending on heading levels you need
-
-    fldChar2 = OxmlElement('w:fldChar')
-    fldChar2.set(qn('w:fldCharType'), 'separate')
-
-    fldChar3 = OxmlElement('w:t')
-    fldChar3.text = "<Please right-click to update TOC>"
-
-    fldChar2.append(fldChar3)
-
-    fldChar4 = OxmlElement('w:fldChar')
-    fldChar4.set(qn('w:fldCharType'), 'end')
 
-    r_element = run._r
-    r_element.append(fldChar)
-    r_element.append(instrText)
-    r_element.append(fldChar2)
-    r_element.append(fldChar4)
+    # Title, fixed sections and TOC are already present in the template
+    report = WordReport(view.title)
 
     # General info section
-    document.add_heading ('1. General information', level=1)
+    report.heading ('1. General information', level=1)
 
     # -> substance
-    document.add_heading ('Substance', level=3)
-    substances_items = ra.general['substances']
+    report.heading ('Substance', level=3)
+    substances_items = view.substances
 
     substance_keys = ['name', 'casrn', 'id']
     
@@ -598,87 +609,195 @@ def report_word (ra):
 
         # generate substance image
         if 'smiles' in isubstance:
-            spath = os.path.join(ra.rapath, f'substance-{str(i)}.png')
-            if os.path.isfile(spath):
-                success = True
-            else:
-                success = generateSubstanceImage(isubstance['smiles'],spath)
-            if success:
-                document.add_picture (spath, width=Cm(4.0))
+            spath = getSubstanceImage(ra, i, isubstance)
+            if spath is not None:
+                report.picture (spath, width=4.0)
 
         # add name, CAS and ID's
         for ikey in substance_keys: 
             if ikey in isubstance and isubstance[ikey] != None and isubstance[ikey]!='':
-                #TODO: add the structure graph, removing 'smiles' as text
-                document.add_paragraph(ikey + ': '+isubstance[ikey], style='List Bullet')
+                report.bullet(ikey + ': '+isubstance[ikey])
 
         # add empty line between items
         if len(substances_items)>1:
-            document.add_paragraph ('')
+            report.paragraph ('')
 
     # -> rest of sub-sections in General Information
-    items = ['general_description', 'background', 'regulatory_framework', 'endpoint', 'species']
-    for item in items:
-        addGeneralSection (document, ra, item)
+    for item_title, item_text in view.general_items:
+        report.heading(item_title, level=3)
+        report.paragraph (item_text)
 
     # Results section
-
-    ra_sections = [ 
-        {'id':'A', 're': [], 'label': 'Preliminary'},
-        {'id':'H', 're': [], 'label': 'Hazard'},
-        {'id':'B', 're': [], 'label': 'ADME'},
-        {'id':'E', 're': [], 'label': 'Exposure'},
-        {'id':'X', 're': [], 'label': 'Integration'},
-        {'id':'Z', 're': [], 'label': 'Conclusions'}
-    ]
-
-    # try to assign the results to standard results sections
-    assigned = 0
-    for reitem in ra.results:
-        id = reitem['id'][0]
-
-        for isection in ra_sections:
-            if id == isection['id']:
-                isection['re'].append(reitem)
-                assigned +=1
-
-    # if we failed to assign probably the workflow is custom 
-    # so don't assign sections
-    if assigned < len(ra.results):
-        document.add_heading ('2. Results',level=1 )
-        iorder=1
-        for reitem in ra.results:
-            addResult (document, ra, reitem, 2, iorder)
+    for isec, ilabel, iitems in view.sections:
+        report.heading (f'{isec}. {ilabel}',level=1 )
+        iorder = 1
+        for item in iitems:
+            addResult (report, item, isec, iorder)
             iorder+=1
-    else:
-        isec = 1
-        for isection in ra_sections:
-            # skip empty sections
-            if len(isection['re'])==0: 
-                continue
-
-            # assign section sequential number
-            isec+=1
-            document.add_heading (f'{isec}. {isection["label"]}',level=1 )
-            iorder = 1
-            for reitem in isection['re']:
-                addResult (document, ra, reitem, isec, iorder)
-                iorder+=1
     
     # Notes section. We decided to avoid numbering this section
-    document.add_heading ('Notes', level=1)
-    for noitem in ra.notes:
-        document.add_heading (f"{noitem['title']} ({noitem['id']})", level=3)
-        document.add_paragraph(noitem['text'])
+    report.heading ('Notes', level=1)
+    for noitem in view.notes:
+        report.heading (f"{noitem['title']} ({noitem['id']})", level=3)
+        report.paragraph(noitem['text'])
     
     try:
-        document.save(reportfile)
+        report.save(reportfile)
     except:
         return False, f'error saving document as {reportfile}'
 
     return True, reportfile
 
+HTML_STYLE = """body {font-family: Calibri, Arial, sans-serif; margin: 2em; color: #222222}
+h1, h2 {color: #2E4A7D}
+table {border-collapse: collapse; margin: 0.5em 0em}
+th, td {border: 1px solid #AEAEAD; padding: 0.2em 0.6em; vertical-align: top; text-align: left}
+th {background-color: #DCE6F2}
+.description {font-style: italic; border: 1px solid #AEAEAD; padding: 0.4em}
+.value {color: #3465A4}
+"""
+
+def htmlText (val):
+    ''' escapes any value for its inclusion in HTML, representing None as an empty string '''
+    if val is None:
+        return ''
+    return html.escape(str(val))
+
+# URL schemes rendered as links in the HTML reports. Links without scheme are relative
+HTML_LINK_SCHEMES = ('', 'http', 'https', 'mailto')
+
+def htmlLink (url):
+    ''' returns a HTML link to the URL given as argument, or the URL as plain text when its scheme is 
+        not listed in HTML_LINK_SCHEMES (e.g. javascript:)
+    '''
+    if url is None:
+        return ''
+
+    # browsers ignore control characters and whitespace in URLs (e.g. "java\tscript:")
+    try:
+        scheme = urlsplit(re.sub(r'[\x00-\x20\x7f]', '', str(url))).scheme.lower()
+    except ValueError:
+        scheme = None
+
+    if scheme not in HTML_LINK_SCHEMES:
+        return htmlText(url)
+    return f'<a href="{htmlText(str(url).strip())}">{htmlText(url)}</a>'
+
+def htmlTable (header, rows):
+    ''' returns a HTML table with the header and the list of rows given as argument '''
+    chunk = '<table>\n<tr>' + ''.join([f'<th>{htmlText(i)}</th>' for i in header]) + '</tr>\n'
+    for irow in rows:
+        chunk += '<tr>' + ''.join([f'<td>{htmlText(i)}</td>' for i in irow]) + '</tr>\n'
+    return chunk + '</table>\n'
+
+def htmlResult (item, section, order):
+    ''' returns the HTML describing a single result '''
+    bool_to_text = {True:'Yes', False:'No'}
+
+    reitem = item['result']
+    name = item['name']
+    description = item['description']
+    label = item['label']
+
+    chunk  = f'<h2>{section}.{order} {htmlText(name)} ({htmlText(label)})</h2>\n'
+    chunk += f'<p class="description">{htmlText(description)}</p>\n'
+    chunk += f'<h3>Summary</h3>\n<p>{htmlText(reitem.get("summary"))}</p>\n'
+
+    if item['kind'] == 'decision':
+        chunk += f'<h3>Decision</h3>\n<p>{bool_to_text.get(reitem["decision"], "")}</p>\n'
+        chunk += f'<h3>Justification</h3>\n<p>{htmlText(reitem.get("justification"))}</p>\n'
+
+    else:
+        methods = reitem.get('methods', [])
+        if len(methods)>0:
+            rows = []
+            for imethod in methods:
+                rows.append([imethod.get(i, '') for i in ['name', 'description', 'link', 'sensitivity', 'specificity', 'sd']])
+            chunk += '<h3>Methods</h3>\n' + htmlTable(['Name', 'Description', 'Link', 'Sensit.', 'Spec.', 'SD'], rows)
+
+        chunk += '<h3>Result</h3>\n'
+
+        if reitem['result_type'] == 'text':
+            for iresult in reitem['values']:
+                chunk += f'<p class="value">{htmlText(iresult)}</p>\n'
+
+        elif reitem['result_type'] == 'value':
+            pairs = item['pairs']
+            if pairs is None:
+                pairs = [(iresult, {}) for iresult in item['values']]
+
+            rows = []
+            for iresult, iuncertain in pairs:
+                rows.append([iresult.get('substance', ''), iresult.get('parameter', ''), iresult.get('value', ''),
+                             iresult.get('method', ''), iresult.get('unit', ''), 
+                             iuncertain.get('uncertainty', ''), iuncertain.get('term', '')])
+            chunk += htmlTable(['Substance', 'Parameter', 'Value', 'Method', 'Unit', 'Uncertainty', 'Term'], rows)
+
+    links = [ilink for ilink in reitem.get('links', []) if ilink.get('include', True)]
+    if len(links)> 0:
+        chunk += '<h3>Supporting documents</h3>\n<ul>\n'
+        for ilink in links:
+            chunk += f'<li>{htmlText(ilink["label"].replace("_"," "))} : {htmlLink(ilink["File"])}</li>\n'
+        chunk += '</ul>\n'
+
+    if 'date' in reitem:
+        chunk += f'<p>Date: {htmlText(reitem["date"])}</p>\n'
+
+    return chunk
+
+def report_html (ra):
+    ''' generator producing the report as a sequence of HTML chunks, one per section, so the 
+        output can be sent to the client before the whole report is built
+    '''
+    view = getReportView(ra)
+
+    yield (f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+           f'<title>{htmlText(view.title)}</title>\n<style>\n{HTML_STYLE}</style>\n</head>\n<body>\n')
+
+    # Title
+    chunk  = f'<h1>{htmlText(view.title)}</h1>\n'
+    chunk += f'<p>Report date {date.today().isoformat()}</p>\n'
+    yield chunk
+
+    # General info section
+    chunk  = '<h1>1. General information</h1>\n<h3>Substance</h3>\n'
+    substance_keys = ['name', 'casrn', 'id']
+    for i, isubstance in enumerate(view.substances):
+
+        # structures are inlined from the cached PNG images
+        if 'smiles' in isubstance:
+            spath = getSubstanceImage(ra, i, isubstance)
+            if spath is not None:
+                with open(spath, 'rb') as f:
+                    image = base64.b64encode(f.read()).decode('ascii')
+                chunk += f'<img src="data:image/png;base64,{image}" width="150" alt="{htmlText(isubstance["smiles"])}">\n'
+
+        chunk += '<ul>\n'
+        for ikey in substance_keys:
+            if ikey in isubstance and isubstance[ikey] != None and isubstance[ikey]!='':
+                chunk += f'<li>{ikey}: {htmlText(isubstance[ikey])}</li>\n'
+        chunk += '</ul>\n'
+
+    for item_title, item_text in view.general_items:
+        chunk += f'<h3>{htmlText(item_title)}</h3>\n<p>{htmlText(item_text)}</p>\n'
+    yield chunk
 
+    # Results section
+    for isec, ilabel, iitems in view.sections:
+        yield f'<h1>{isec}. {htmlText(ilabel)}</h1>\n'
+        for iorder, item in enumerate(iitems):
+            yield htmlResult (item, isec, iorder+1)
+
+    # Notes section
+    chunk = '<h1>Notes</h1>\n'
+    for noitem in view.notes:
+        chunk += f'<h3>{htmlText(noitem["title"])} ({htmlText(noitem["id"])})</h3>\n<p>{htmlText(noitem["text"])}</p>\n'
+    yield chunk
+
+    yield '</body>\n</html>\n'
+
+
+@traced
 def action_report (raname, report_format):
 
     # instantiate a ra object
@@ -687,6 +806,16 @@ def action_report (raname, report_format):
 
     if not succes:
         return False, results
+
+    start = time.perf_counter()
+    success, results = renderReport(ra, report_format)
+    REPORT_RENDER_SECONDS.observe(time.perf_counter()-start, format=report_format, 
+                                  status='success' if success else 'error')
+
+    return success, results
+
+def renderReport (ra, report_format):
+    ''' writes the report of the RA in the format given as argument, in the RA folder '''
     
     if report_format == 'yaml':
     
@@ -711,5 +840,147 @@ def action_report (raname, report_format):
 
         return report_word(ra)
 
+    elif report_format == 'html':
+
+        reportfile = os.path.join (ra.rapath, REPORT_FILES['html'])
+        try:
+            with open(reportfile,'w', encoding='utf-8') as f:
+                for chunk in report_html(ra):
+                    f.write(chunk)
+        except Exception as e:
+            return False, f'error saving document as {reportfile}: {e}'
+
+        return True, reportfile
+
     return False, 'format unsupported'
 
+@traced
+def action_report_stream (raname):
+    ''' returns a generator producing the HTML report in chunks, suitable for streaming 
+        responses in the web service
+    '''
+    # instantiate a ra object
+    ra = Ra(raname)
+    succes, results = ra.load()
+
+    if not succes:
+        return False, results
+
+    return True, report_html(ra)
+
+
+def reportIsCurrent (rapath, report_format):
+    ''' returns True if the report file for the format given as argument exists and 
+        is newer than the RA definition (ra.yaml)
+    '''
+    if not report_format in REPORT_FILES:
+        return False
+
+    reportfile = os.path.join (rapath, REPORT_FILES[report_format])
+    rafile = os.path.join (rapath, 'ra.yaml')
+    if not os.path.isfile(reportfile) or not os.path.isfile(rafile):
+        return False
+
+    return os.path.getmtime(reportfile) >= os.path.getmtime(rafile)
+
+def selectRas (patterns):
+    ''' returns a sorted list with the names of the RAs in the repository matching 
+        any of the names or shell-style patterns (e.g. "ASPA*") given as argument
+    '''
+    rdir = ra_repository_path()
+    if rdir is None or not os.path.isdir(rdir):
+        return []
+
+    ranames = [i for i in os.listdir(rdir) if os.path.isdir(os.path.join(rdir,i))]
+
+    selected = []
+    for ipattern in patterns:
+        for iname in fnmatch.filter(ranames, ipattern):
+            if not iname in selected:
+                selected.append(iname)
+
+    return sorted(selected)
+
+def _report_worker (raname, report_format):
+    ''' wrapper of action_report used by the process pool in action_report_batch. Any exception
+        is captured and returned as an error, so a single failing RA does not abort the batch
+    '''
+    try:
+        success, results = action_report(raname, report_format)
+    except Exception as e:
+        success, results = False, f'error: {e}'
+    return raname, report_format, success, results
+
+@traced
+def action_report_batch (patterns, formats, workers=None, force=False):
+    ''' generates reports for every RA matching the names or patterns given as argument, in 
+        every format listed in formats, using a bounded pool of worker processes
+        
+        reports which are newer than the RA definition are skipped, unless force is True
+
+        if a worker process dies, the reports lost with it are run again one by one, each in a new process,
+        and those killing their worker again are reported as failed
+
+        returns a dictionary with lists of completed, skipped and failed reports
+    '''
+    ranames = selectRas(patterns)
+    if len(ranames) == 0:
+        return False, 'no risk assessment matching the selection found'
+
+    for iformat in formats:
+        if not iformat in REPORT_FILES:
+            return False, f'format {iformat} unsupported'
+
+    summary = {'completed': [], 'skipped': [], 'failed': []}
+
+    # discard RA/format combinations with a report still current
+    jobs = []
+    rdir = ra_repository_path()
+    for raname in ranames:
+        for iformat in formats:
+            if not force and reportIsCurrent(os.path.join(rdir, raname), iformat):
+                summary['skipped'].append({'raname': raname, 'format': iformat})
+                LOG.info(f'{raname} ({iformat}) report is up to date, skipped')
+                continue
+            jobs.append((raname, iformat))
+
+    if len(jobs) == 0:
+        return True, summary
+
+    if workers is None:
+        workers = min(4, os.cpu_count() or 1)
+    workers = max(1, min(int(workers), len(jobs)))
+
+    LOG.info(f'generating {len(jobs)} report(s) using {workers} worker(s)')
+
+    def record (raname, iformat, success, results):
+        if success:
+            summary['completed'].append({'raname': raname, 'format': iformat, 'file': results})
+            LOG.info(f'[{len(summary["completed"])+len(summary["failed"])}/{len(jobs)}] {raname} ({iformat}) report completed')
+        else:
+            summary['failed'].append({'raname': raname, 'format': iformat, 'error': str(results)})
+            LOG.error(f'[{len(summary["completed"])+len(summary["failed"])}/{len(jobs)}] {raname} ({iformat}) report failed: {results}')
+
+    # reports lost because a worker process died. The pool is broken and all its pending reports are lost
+    retry = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_report_worker, raname, iformat): (raname, iformat) for raname, iformat in jobs}
+
+        for ifuture in as_completed(futures):
+            try:
+                record(*ifuture.result())
+            except BrokenProcessPool:
+                retry.append(futures[ifuture])
+
+    # the reports lost are run again one by one, each in a new process, so the report killing its worker
+    # (e.g. out of memory) does not take the others with it
+    if len(retry) > 0:
+        LOG.error(f'a worker process died, {len(retry)} report(s) will be run again one by one')
+    for raname, iformat in retry:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                record(*executor.submit(_report_worker, raname, iformat).result())
+            except BrokenProcessPool as e:
+                record(raname, iformat, False, f'worker process died: {e}')
+
+    return True, summary
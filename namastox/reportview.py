@@ -0,0 +1,172 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX report view model
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from collections import OrderedDict
+from namastox.logger import get_logger
+
+LOG = get_logger(__name__)
+
+# standard report sections, assigned using the first letter of the result ID
+RA_SECTIONS = [
+    {'id':'A', 'label': 'Preliminary'},
+    {'id':'H', 'label': 'Hazard'},
+    {'id':'B', 'label': 'ADME'},
+    {'id':'E', 'label': 'Exposure'},
+    {'id':'X', 'label': 'Integration'},
+    {'id':'Z', 'label': 'Conclusions'}
+]
+
+# sub-sections of General Information included in the reports
+GENERAL_ITEMS = ['general_description', 'background', 'regulatory_framework', 'endpoint', 'species']
+
+# maximum number of views kept in memory
+VIEW_CACHE_SIZE = 32
+
+VIEW_CACHE = OrderedDict()
+VIEW_CACHE_LOCK = threading.Lock()
+
+class ReportView:
+    ''' Class storing the RA contents in the form used by all the report renderers. The
+        workflow metadata (name, description) is joined to every result, the results are
+        assigned to report sections and the values are paired with their uncertainties
+        only once, when the view is built
+    '''
+    def __init__(self, ra):
+        ''' constructor '''
+        self.title = ra.general.get('title')
+        self.general = ra.general
+        self.notes = ra.notes
+        self.substances = ra.general.get('substances', [])
+
+        # sub-sections of General Information with a meaningful content
+        self.general_items = []
+        for item in GENERAL_ITEMS:
+            if item in ra.general and ra.general[item]!=None and len(ra.general[item])>2:
+                self.general_items.append((item.capitalize().replace('_',' '), ra.general[item]))
+
+        # results, in the order in which were entered
+        self.results = [self.buildItem(ra.workflow, reitem) for reitem in ra.results]
+
+        # results assigned to sections, as a list of (number, label, items)
+        self.sections = self.buildSections(self.results)
+
+    def buildItem (self, workflow, reitem):
+        ''' returns a dictionary describing the result given as argument, ready for rendering
+        '''
+        # Name and Description are not in results but in workflow
+        itask = workflow.getTask(reitem['id'])
+        if itask is not None:
+            name = itask.getName()
+            description = itask.getDescriptionText()
+        else:
+            name = reitem['id']
+            description = ''
+
+        item = {'id': reitem['id'],
+                'name': name,
+                'description': description,
+                'label': reitem.get('label', ''),
+                'summary': reitem.get('summary'),
+                'date': reitem.get('date'),
+                'links': reitem.get('links', []),
+                'result': reitem}
+
+        if 'decision' in reitem:
+            item['kind'] = 'decision'
+            item['decision'] = reitem['decision']
+            item['justification'] = reitem.get('justification')
+            return item
+
+        item['kind'] = reitem.get('result_type')
+        item['values'] = reitem.get('values', [])
+        item['uncertainties'] = reitem.get('uncertainties', [])
+        item['methods'] = reitem.get('methods', [])
+
+        # values and uncertainties are paired only if the size of both lists match
+        item['pairs'] = None
+        if item['kind'] == 'value' and len(item['values']) == len(item['uncertainties']):
+            item['pairs'] = list(zip(item['values'], item['uncertainties']))
+
+            # optional columns present in at least one value or uncertainty
+            item['columns'] = {
+                'method': any('method' in ival and ival['method']!='' for ival in item['values']),
+                'unit': any('unit' in ival and ival['unit']!='' for ival in item['values']),
+                'uncertainty': any('uncertainty' in iunc and iunc['uncertainty']!=0 for iunc in item['uncertainties']),
+                'term': any('term' in iunc and iunc['term']!='' for iunc in item['uncertainties'])
+            }
+
+        return item
+
+    def buildSections (self, items):
+        ''' assigns the items to the standard report sections and returns a list of tuples
+            (section number, section label, list of items), skipping empty sections.
+            Section 1 is reserved for the general information
+        '''
+        assigned = {isection['id']: [] for isection in RA_SECTIONS}
+        for item in items:
+            id = item['id'][0]
+            if id in assigned:
+                assigned[id].append(item)
+
+        # if we failed to assign probably the workflow is custom
+        # so don't assign sections
+        if sum([len(i) for i in assigned.values()]) < len(items):
+            return [(2, 'Results', items)]
+
+        sections = []
+        isec = 1
+        for isection in RA_SECTIONS:
+            # skip empty sections
+            if len(assigned[isection['id']])==0:
+                continue
+
+            # assign section sequential number
+            isec+=1
+            sections.append((isec, isection['label'], assigned[isection['id']]))
+
+        return sections
+
+def getReportView (ra):
+    ''' returns the ReportView of the RA given as argument. Views are cached in memory
+        using the RA path and revision as key, so they are only built once per RA version
+    '''
+    revision = getattr(ra, 'revision', None)
+    if revision is None:
+        return ReportView(ra)
+
+    key = (ra.rapath, revision)
+    with VIEW_CACHE_LOCK:
+        if key in VIEW_CACHE:
+            VIEW_CACHE.move_to_end(key)
+            return VIEW_CACHE[key]
+
+    view = ReportView(ra)
+
+    with VIEW_CACHE_LOCK:
+        VIEW_CACHE[key] = view
+        while len(VIEW_CACHE) > VIEW_CACHE_SIZE:
+            VIEW_CACHE.popitem(last=False)
+
+    LOG.debug(f'report view built for {ra.rapath} revision {revision}')
+
+    return view
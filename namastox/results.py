@@ -22,9 +22,13 @@
 
 from namastox.logger import get_logger
 from namastox.ra import Ra
+from namastox.trace import traced
+from namastox.utils import single_flight
 
 LOG = get_logger(__name__)
 
+@traced
+@single_flight('raname', 'step', 'out')
 def action_results(raname, step=None, out='text'):
     ''' returns the list of results available for this raname/step
     '''
@@ -81,6 +85,7 @@ def action_results(raname, step=None, out='text'):
         
     return True, f'{len(output)} results found for {raname}'
 
+@traced
 def action_result(raname, resultid, out='text'):
     ''' returns the a given results this raname
     '''
@@ -107,6 +112,7 @@ def action_result(raname, resultid, out='text'):
     
     return True, 'result found'
     
+@traced
 def action_task(raname, resultid):
     ''' returns the task resultid
     '''
@@ -122,6 +128,7 @@ def action_task(raname, resultid):
     
     return True, itask
 
+@traced
 def action_pendingTasks(raname):
     ''' returns a list of dictionaries with a short description of the pending tasks
     '''
@@ -137,6 +144,7 @@ def action_pendingTasks(raname):
     else:
         return False, 'no active nodes'
 
+@traced
 def action_pendingTask(raname, resultid):
     ''' returns a dictionary with a template of the pending task resultid
     '''
@@ -152,6 +160,7 @@ def action_pendingTask(raname, resultid):
     else:
         return False, f'active node {resultid} not found'
     
+@traced
 def action_upstreamTasks(raname, resultid):
     ''' returns a dictionary with a list of selected fields of upstream tasks for the resultid task
     '''
@@ -0,0 +1,207 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX substance similarity index
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import threading
+import numpy as np
+from rdkit import Chem
+from namastox.logger import get_logger
+from namastox.utils import cache_repository_path, ra_repository_path, ra_path
+from namastox.substance import SubstanceRegistry, computeFingerprint, FP_BITS
+
+LOG = get_logger(__name__)
+
+# indices loaded in memory, by cache folder of the repository (see getIndex)
+SIMILARITY_INDEX = {}
+SIMILARITY_LOCK = threading.Lock()
+
+# number of bits set in every possible byte, used to count the bits of the packed fingerprints
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+class SimilarityIndex:
+    ''' Class storing the Morgan fingerprints of all the substances in the registry as a NumPy array
+        of packed bits (one row per substance), used to run vectorized Tanimoto searches. The index 
+        is saved in the cache folder and refreshed incrementally with the registry entries written 
+        after the last refresh, identified by their sequence number
+    '''
+    def __init__(self):
+        ''' constructor '''
+        self.keys = []
+        self.positions = {}
+        self.fingerprints = np.zeros((0, FP_BITS//8), dtype=np.uint8)
+        self.counts = np.zeros((0,), dtype=np.int32)
+        self.watermark = None
+
+    def load (self):
+        ''' loads the index saved in the cache folder, if any '''
+        index_path = cache_repository_path('similarity')
+        keys_file = os.path.join(index_path, 'keys.json')
+        fp_file = os.path.join(index_path, 'fingerprints.npy')
+        if not os.path.isfile(keys_file) or not os.path.isfile(fp_file):
+            return False
+
+        try:
+            with open(keys_file, 'r') as f:
+                header = json.load(f)
+            fingerprints = np.load(fp_file)
+        except Exception as e:
+            LOG.error(f'unable to load similarity index with error: {e}')
+            return False
+
+        # both files are not written at once, an index interrupted while saved is rebuilt
+        if fingerprints.shape[0] != len(header['keys']):
+            return False
+
+        self.keys = header['keys']
+        self.watermark = header['sequence']
+        self.positions = {ikey: i for i, ikey in enumerate(self.keys)}
+        self.fingerprints = fingerprints
+        self.counts = popcount(fingerprints)
+        return True
+
+    def save (self):
+        ''' saves the index in the cache folder '''
+        index_path = cache_repository_path('similarity')
+        np.save(os.path.join(index_path, 'fingerprints.npy'), self.fingerprints)
+        with open(os.path.join(index_path, 'keys.json'), 'w') as f:
+            json.dump({'keys': self.keys, 'sequence': self.watermark}, f)
+
+    def refresh (self):
+        ''' adds to the index the registry entries created or updated since the last refresh. Returns the
+            number of entries added or replaced
+        '''
+        registry = SubstanceRegistry()
+        rows = registry.getFingerprints(since=self.watermark)
+        if len(rows) == 0:
+            return 0
+
+        new_keys = []
+        new_fps = []
+        for ikey, ifp, iseq in rows:
+            ifp = np.frombuffer(ifp, dtype=np.uint8)
+            if ikey in self.positions:
+                self.fingerprints[self.positions[ikey]] = ifp
+            else:
+                self.positions[ikey] = len(self.keys) + len(new_keys)
+                new_keys.append(ikey)
+                new_fps.append(ifp)
+            iseq = iseq or 0
+            self.watermark = iseq if self.watermark is None else max(self.watermark, iseq)
+
+        if len(new_fps) > 0:
+            self.keys.extend(new_keys)
+            self.fingerprints = np.vstack([self.fingerprints, np.array(new_fps, dtype=np.uint8)])
+
+        self.counts = popcount(self.fingerprints)
+        self.save()
+
+        LOG.debug(f'similarity index refreshed with {len(rows)} substances')
+        return len(rows)
+
+    def search (self, fingerprint, top=10, cutoff=None):
+        ''' returns a list of tuples (key, similarity) with the top most similar substances to the
+            fingerprint (packed bits) given as argument, sorted by decreasing Tanimoto similarity
+        '''
+        if len(self.keys) == 0:
+            return []
+
+        query = np.frombuffer(fingerprint, dtype=np.uint8)
+        common = popcount(self.fingerprints & query)
+        union = self.counts + popcount(query[np.newaxis,:])[0] - common
+        similarity = np.divide(common, union, out=np.zeros(common.shape, dtype=float), where=union>0)
+
+        top = min(top, len(self.keys))
+        candidates = np.argpartition(-similarity, top-1)[:top]
+        candidates = candidates[np.argsort(-similarity[candidates])]
+
+        results = []
+        for i in candidates:
+            if cutoff is not None and similarity[i] < cutoff:
+                break
+            results.append((self.keys[i], float(similarity[i])))
+        return results
+
+def popcount (fingerprints):
+    ''' returns the number of bits set in every row of the array of packed bits '''
+    if fingerprints.shape[0] == 0:
+        return np.zeros((0,), dtype=np.int32)
+    return POPCOUNT_TABLE[fingerprints].sum(axis=1, dtype=np.int32)
+
+def getIndex ():
+    ''' returns the similarity index of the repository, loaded once per process and refreshed with the latest 
+        registry entries. Substances are added to the registry when the general info of the RA is updated
+        (see Ra.updateGeneralInfo), so the index is only updated here, by the searches
+    '''
+    index_path = cache_repository_path('similarity')
+    with SIMILARITY_LOCK:
+        index = SIMILARITY_INDEX.get(index_path)
+        if index is None:
+            index = SIMILARITY_INDEX[index_path] = SimilarityIndex()
+            index.load()
+        index.refresh()
+        return index
+
+def rebuildIndex ():
+    ''' registers the substances of every RA in the repository and builds the similarity index from scratch
+    '''
+    from namastox.ra import Ra
+
+    for raname in os.listdir(ra_repository_path()):
+        if not os.path.isfile(os.path.join(ra_path(raname), 'ra.yaml')):
+            continue
+        ra = Ra(raname)
+        success, results = ra.load()
+        if not success or ra.general is None:
+            continue
+        substances = ra.general.get('substances')
+        if substances:
+            SubstanceRegistry().register(substances, raname)
+
+    with SIMILARITY_LOCK:
+        index = SIMILARITY_INDEX[cache_repository_path('similarity')] = SimilarityIndex()
+        index.refresh()
+        return index
+
+def searchSimilar (smiles, top=10, cutoff=None):
+    ''' returns a list with the top registered substances most similar to the SMILES given as argument. 
+        Every item is a dictionary with the registry entry, the similarity and the RAs (still existing)
+        using the substance. Substances not used in any RA are skipped
+    '''
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return False, f'incorrect SMILES format: {smiles}'
+
+    hits = getIndex().search(computeFingerprint(mol), top=top, cutoff=cutoff)
+
+    registry = SubstanceRegistry()
+    results = []
+    for ikey, isimilarity in hits:
+        entry = registry.get(ikey)
+        if entry is None:
+            continue
+        entry['similarity'] = isimilarity
+        entry['ras'] = [iraname for iraname in entry['ras'] if os.path.isdir(ra_path(iraname))]
+        if len(entry['ras']) > 0:
+            results.append(entry)
+
+    return True, results
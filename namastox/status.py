@@ -22,9 +22,11 @@
 
 from namastox.logger import get_logger
 from namastox.ra import Ra
+from namastox.trace import traced
 
 LOG = get_logger(__name__)
 
+@traced
 def action_status(raname,  step=None, ofile=None, out='text'):
     ''' return status of RA "raname", at step "step"
     '''
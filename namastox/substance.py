@@ -0,0 +1,260 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX substance registry
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import sqlite3
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import Draw, rdFingerprintGenerator
+from namastox.logger import get_logger
+from namastox.utils import substance_repository_path
+
+LOG = get_logger(__name__)
+
+# Morgan fingerprints stored in the registry
+FP_RADIUS = 2
+FP_BITS = 2048
+FP_GENERATOR = None
+
+def moleculeKey (mol):
+    ''' returns the key used to identify the molecule in the registry and the caches: the InChIKey or, 
+        when it cannot be computed, the canonical SMILES
+    '''
+    try:
+        key = Chem.MolToInchiKey(mol)
+        if key:
+            return key
+    except:
+        pass
+    return Chem.MolToSmiles(mol)
+
+def computeFingerprint (mol):
+    ''' returns the Morgan fingerprint of the molecule as packed bits (bytes) '''
+    global FP_GENERATOR
+    if FP_GENERATOR is None:
+        FP_GENERATOR = rdFingerprintGenerator.GetMorganGenerator(radius=FP_RADIUS, fpSize=FP_BITS)
+    return np.packbits(FP_GENERATOR.GetFingerprintAsNumPy(mol)).tobytes()
+
+def mergeList (stored, new):
+    ''' returns the list stored with the new items appended, skipping duplicates and empty items '''
+    for item in new:
+        if item not in (None, '', 'na') and item not in stored:
+            stored.append(item)
+    return stored
+
+class SubstanceRegistry:
+    ''' Class storing every substance used in the repository, indexed by InChIKey (or canonical SMILES 
+        when the InChIKey cannot be computed). Every entry contains the canonical SMILES, the names, 
+        CASRN and IDs used for the substance, the RAs where it is used and derived artifacts (fingerprint, 
+        structure image). Predictions are stored in the prediction cache, using the same key
+    '''
+    def __init__(self):
+        ''' constructor '''
+        self.path = os.path.join(substance_repository_path(), 'registry.db')
+        connection = self.connect()
+        with connection:
+            connection.execute('''CREATE TABLE IF NOT EXISTS substances (
+                                    inchikey TEXT PRIMARY KEY, smiles TEXT, names TEXT, casrn TEXT, 
+                                    ids TEXT, ras TEXT, fingerprint BLOB, created REAL, updated REAL, seq INTEGER)''')
+            connection.execute('CREATE INDEX IF NOT EXISTS substances_seq ON substances (seq)')
+        connection.close()
+
+    def connect (self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def register (self, substances, raname=None):
+        ''' adds the substances, given as dictionaries with keys smiles, name, casrn and id, to the registry 
+            and returns the list of keys assigned (None for substances with wrong or missing SMILES). 
+            Existing entries are completed with the new names, CASRN, IDs and RA. When the RA is given,
+            the substances are the whole list of the RA, and the RA is removed from any other entry
+        '''
+        entries = {}
+        keys = []
+        for isubstance in substances:
+            mol = None
+            if isubstance.get('smiles'):
+                mol = Chem.MolFromSmiles(isubstance['smiles'])
+            if mol is None:
+                keys.append(None)
+                continue
+
+            ikey = moleculeKey(mol)
+            keys.append(ikey)
+            if ikey not in entries:
+                entries[ikey] = {'smiles': Chem.MolToSmiles(mol), 'names': [], 'casrn': [], 'ids': [], 
+                                 'fingerprint': computeFingerprint(mol)}
+            ientry = entries[ikey]
+            mergeList(ientry['names'], [isubstance.get('name')])
+            mergeList(ientry['casrn'], [isubstance.get('casrn')])
+            mergeList(ientry['ids'], [isubstance.get('id')])
+
+        if len(entries) == 0 and not raname:
+            return keys
+
+        now = time.time()
+        connection = self.connect()
+        try:
+            with connection:
+                # the write lock is taken before reading, so the sequence numbers follow the order of the
+                # commits and readers never see a number lower than one already seen (see getFingerprints)
+                connection.execute('BEGIN IMMEDIATE')
+                seq = connection.execute('SELECT COALESCE(MAX(seq), 0)+1 FROM substances').fetchone()[0]
+                for ikey, ientry in entries.items():
+                    row = connection.execute('SELECT names, casrn, ids, ras FROM substances WHERE inchikey=?', [ikey]).fetchone()
+                    if row is None:
+                        connection.execute('INSERT INTO substances VALUES (?,?,?,?,?,?,?,?,?,?)', 
+                                           [ikey, ientry['smiles'], json.dumps(ientry['names']), json.dumps(ientry['casrn']),
+                                            json.dumps(ientry['ids']), json.dumps([raname] if raname else []), 
+                                            ientry['fingerprint'], now, now, seq])
+                    else:
+                        names, casrn, ids, ras = [json.loads(i) for i in row]
+                        connection.execute('UPDATE substances SET names=?, casrn=?, ids=?, ras=?, updated=?, seq=? WHERE inchikey=?', 
+                                           [json.dumps(mergeList(names, ientry['names'])), json.dumps(mergeList(casrn, ientry['casrn'])),
+                                            json.dumps(mergeList(ids, ientry['ids'])), json.dumps(mergeList(ras, [raname])), 
+                                            now, seq, ikey])
+                if raname:
+                    self.pruneRa(connection, raname, keep=entries, now=now)
+        finally:
+            connection.close()
+
+        LOG.debug(f'{len(entries)} substances registered')
+        return keys
+
+    def pruneRa (self, connection, raname, keep=(), newname=None, now=None):
+        ''' removes the RA from the entries not listed in keep, or replaces it by newname, using the connection
+            given as argument. Only the list of RAs changes, so the sequence numbers are kept
+        '''
+        rows = connection.execute('SELECT inchikey, ras FROM substances WHERE ras LIKE ?', [f'%{json.dumps(raname)}%']).fetchall()
+        for ikey, ras in rows:
+            ras = json.loads(ras)
+            if ikey in keep or not raname in ras:
+                continue
+            ras = [i for i in ras if i != raname]
+            if newname is not None:
+                mergeList(ras, [newname])
+            connection.execute('UPDATE substances SET ras=?, updated=? WHERE inchikey=?', [json.dumps(ras), now or time.time(), ikey])
+
+    def replaceRa (self, raname, newname=None):
+        ''' removes the RA from every entry of the registry or, if newname is given, renames it '''
+        connection = self.connect()
+        try:
+            with connection:
+                self.pruneRa(connection, raname, newname=newname)
+        finally:
+            connection.close()
+
+    def get (self, key):
+        ''' returns a dictionary describing the substance with the key given as argument, or None if not found '''
+        connection = self.connect()
+        try:
+            row = connection.execute('SELECT inchikey, smiles, names, casrn, ids, ras FROM substances WHERE inchikey=?', [key]).fetchone()
+        finally:
+            connection.close()
+
+        if row is None:
+            return None
+
+        return {'inchikey': row[0], 
+                'smiles': row[1], 
+                'names': json.loads(row[2]), 
+                'casrn': json.loads(row[3]), 
+                'ids': json.loads(row[4]), 
+                'ras': json.loads(row[5])}
+
+    def search (self, name=None, casrn=None):
+        ''' returns the list of keys of the substances with the name or CASRN given as argument '''
+        connection = self.connect()
+        try:
+            rows = connection.execute('SELECT inchikey, names, casrn FROM substances').fetchall()
+        finally:
+            connection.close()
+
+        keys = []
+        for ikey, names, icasrn in rows:
+            if name is not None and name in json.loads(names):
+                keys.append(ikey)
+            elif casrn is not None and casrn in json.loads(icasrn):
+                keys.append(ikey)
+        return keys
+
+    def getFingerprints (self, since=None):
+        ''' returns a list of tuples (key, fingerprint, seq) with the substances written after the sequence number
+            since. Every write of the registry gets a higher sequence number, assigned when the write lock is held
+        '''
+        connection = self.connect()
+        try:
+            if since is None:
+                rows = connection.execute('SELECT inchikey, fingerprint, seq FROM substances').fetchall()
+            else:
+                rows = connection.execute('SELECT inchikey, fingerprint, seq FROM substances WHERE seq>?', [since]).fetchall()
+        finally:
+            connection.close()
+        return rows
+
+    def getImage (self, key):
+        ''' returns the path to the PNG image of the substance, generated the first time it is requested. 
+            Returns None if the substance is not registered
+        '''
+        image_path = os.path.join(substance_repository_path('images'), f'{key}.png')
+        if os.path.isfile(image_path):
+            return image_path
+
+        entry = self.get(key)
+        if entry is None:
+            return None
+
+        mol = Chem.MolFromSmiles(entry['smiles'])
+        if mol is None:
+            return None
+
+        Draw.MolToFile(mol, image_path, imageType='png')
+        return image_path
+
+def registerSubstances (substances, raname=None):
+    ''' registers the substances given as argument and adds to every substance the field "inchikey" 
+        with the key of the registry entry. Errors are logged and do not interrupt the caller
+    '''
+    try:
+        keys = SubstanceRegistry().register(substances, raname)
+    except Exception as e:
+        LOG.error(f'unable to register substances with error: {e}')
+        return False
+
+    for isubstance, ikey in zip(substances, keys):
+        if ikey is not None:
+            isubstance['inchikey'] = ikey
+    return True
+
+def unregisterRa (raname, newname=None):
+    ''' removes the RA from the substance registry or, if newname is given, renames it. Errors are logged and 
+        do not interrupt the caller
+    '''
+    try:
+        SubstanceRegistry().replaceRa(raname, newname)
+    except Exception as e:
+        LOG.error(f'unable to update substance registry with error: {e}')
+        return False
+    return True
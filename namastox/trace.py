@@ -0,0 +1,201 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tracing of the time spent in the main operations
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# Flame is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import itertools
+import functools
+import threading
+from collections import deque
+
+# tracing is disabled by default. It can be enabled setting the environment variable
+# NAMASTOX_TRACE or calling enableTracing
+TRACE_ENABLED = os.environ.get('NAMASTOX_TRACE', '') not in ('', '0')
+
+# maximum number of finished spans kept in memory
+TRACE_SIZE = 100000
+
+# finished spans, as dictionaries (see Span.toDict)
+SPANS = deque(maxlen=TRACE_SIZE)
+
+# number of calls, total and maximum time (in seconds) of every span name
+STATS = {}
+
+TRACE_LOCK = threading.Lock()
+SPAN_IDS = itertools.count(1)
+
+# stack of open spans of every thread, used to link the spans to their parents
+LOCAL = threading.local()
+
+def enableTracing (enabled=True):
+    ''' enables or disables the recording of spans '''
+    global TRACE_ENABLED
+    TRACE_ENABLED = enabled
+
+def isEnabled ():
+    return TRACE_ENABLED
+
+class Span:
+    ''' Class recording the time spent in a block of code, to be used as a context manager.
+        Spans opened inside other spans in the same thread are recorded as their children
+    '''
+    __slots__ = ('name', 'attributes', 'id', 'parent', 'start', 'duration', 'error')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.error = None
+
+    def __enter__(self):
+        stack = getattr(LOCAL, 'stack', None)
+        if stack is None:
+            stack = LOCAL.stack = []
+        self.id = next(SPAN_IDS)
+        self.parent = stack[-1].id if stack else None
+        stack.append(self)
+        self.start = time.time()
+        self.duration = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.duration
+        if exc_type is not None:
+            self.error = repr(exc_value)
+        stack = LOCAL.stack
+        if stack and stack[-1] is self:
+            stack.pop()
+        recordSpan(self)
+        return False
+
+    def set (self, key, value):
+        ''' adds an attribute to the span '''
+        self.attributes[key] = value
+
+    def toDict (self):
+        return {'name': self.name,
+                'id': self.id,
+                'parent': self.parent,
+                'pid': os.getpid(),
+                'thread': threading.get_ident(),
+                'start': self.start,
+                'duration': self.duration,
+                'error': self.error,
+                'attributes': self.attributes}
+
+class NullSpan:
+    ''' span returned when tracing is disabled, which does nothing '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set (self, key, value):
+        pass
+
+NULL_SPAN = NullSpan()
+
+def recordSpan (span):
+    with TRACE_LOCK:
+        SPANS.append(span.toDict())
+        stats = STATS.get(span.name)
+        if stats is None:
+            STATS[span.name] = [1, span.duration, span.duration]
+        else:
+            stats[0] += 1
+            stats[1] += span.duration
+            if span.duration > stats[2]:
+                stats[2] = span.duration
+
+def span (name, **attributes):
+    ''' returns a context manager recording the time spent in the block as a span with the name
+        and attributes given as argument, e.g.
+
+        with span('flame.profile', models=len(models)):
+            ...
+    '''
+    if not TRACE_ENABLED:
+        return NULL_SPAN
+    return Span(name, attributes)
+
+def traced (func=None, name=None):
+    ''' decorator recording every call of the function as a span, named after the module and
+        the function unless a name is given. The first argument of action functions (the RA name)
+        is recorded as an attribute
+    '''
+    if func is None:
+        return functools.partial(traced, name=name)
+
+    if name is None:
+        name = f'{func.__module__.rsplit(".", 1)[-1]}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not TRACE_ENABLED:
+            return func(*args, **kwargs)
+        attributes = {}
+        if args and type(args[0]) == str:
+            attributes['raname'] = args[0]
+        elif args and hasattr(args[0], 'raname'):
+            attributes['raname'] = args[0].raname
+        with Span(name, attributes):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+def getSpans ():
+    ''' returns a list with the finished spans, as dictionaries '''
+    with TRACE_LOCK:
+        return list(SPANS)
+
+def getStats ():
+    ''' returns a dictionary, indexed by span name, with the number of calls, the total, mean
+        and maximum time (in seconds)
+    '''
+    with TRACE_LOCK:
+        return {iname: {'count': istats[0],
+                        'total': istats[1],
+                        'mean': istats[1]/istats[0],
+                        'max': istats[2]} for iname, istats in STATS.items()}
+
+def clearSpans ():
+    with TRACE_LOCK:
+        SPANS.clear()
+        STATS.clear()
+
+def exportSpans (filename, clear=True):
+    ''' appends the finished spans to the file given as argument, as JSON lines, and returns
+        the number of spans written
+    '''
+    with TRACE_LOCK:
+        spans = list(SPANS)
+        if clear:
+            SPANS.clear()
+
+    with open(filename, 'a') as f:
+        for ispan in spans:
+            f.write(json.dumps(ispan, default=str)+'\n')
+
+    return len(spans)
@@ -24,9 +24,11 @@ import os
 import yaml
 from namastox.logger import get_logger
 from namastox.ra import Ra
+from namastox.trace import traced
 
 LOG = get_logger(__name__)
 
+@traced
 def action_update(raname, ifile, ofile=None):
     ''' use the input file to update RA. The udpated RA version is stored in the repository and copied
         in the historic archive 
@@ -64,6 +66,7 @@ def action_update(raname, ifile, ofile=None):
 
     return True, f'{raname} updated'
 
+@traced
 def action_update_general_info (raname, input_dict):
     ''' use the input dictionary with General Info to update RA. The updated RA version is stored in the repository and copied
         in the historic archive 
@@ -85,6 +88,7 @@ def action_update_general_info (raname, input_dict):
 
     return True, f'{raname} General Info updated'
 
+@traced
 def action_update_result (raname, step, input_dict):
     ''' use the input dictionary with Result to update RA. The updated RA version is stored in the repository and copied
         in the historic archive 
@@ -104,4 +108,43 @@ def action_update_result (raname, step, input_dict):
     # save new version and replace the previous one
     ra.save()
 
-    return True, f'{raname} result updated'
\ No newline at end of file
+    return True, f'{raname} result updated'
+
+@traced
+def action_update_table (raname, result_id, filename, input_result=None, sep=None):
+    ''' use the table (CSV or TSV) given as argument to add values and uncertainties to the result with the ID given 
+        as argument, updating the RA. The table is read with getTableContents, so only the required columns are parsed,
+        but the whole table is loaded in memory before the RA is updated and saved. Other fields of the result can be 
+        provided in input_result, which is not modified. The updated RA version is stored in the repository and copied 
+        in the historic archive 
+    '''
+    from namastox.manage import getTableContents
+
+    # instantiate a ra object
+    ra = Ra(raname)
+    succes, results = ra.load()
+    if not succes:
+        return False, results
+
+    if not os.path.isfile(filename):
+        return False, f'{filename} not found'
+
+    success, values, uncertainties = getTableContents(filename, sep=sep)
+    if not success:
+        return False, values
+
+    result = dict(input_result) if input_result is not None else {}
+    result['id'] = result_id
+    result['values'] = list(result.get('values', [])) + values
+    result['uncertainties'] = list(result.get('uncertainties', [])) + uncertainties
+
+    # use input dictionary to update RA
+    success, results = ra.update({'result': [result]})
+
+    if not success:
+        return False, results
+    
+    # save new version and replace the previous one
+    ra.save()
+
+    return True, f'{raname} result updated'
@@ -21,9 +21,15 @@
 # along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import copy
 import yaml
 import string
 import random 
+import inspect
+import functools
+import threading
+import contextlib
+import contextvars
 
 TASK_TYPES = ['TASK', 'MODULE', 'OPERATOR']
 
@@ -36,26 +42,143 @@ TASK_TYPES = ['TASK', 'MODULE', 'OPERATOR']
 #     else:
 #         return os.path.join(path, 'ver%0.6d' % (version))
 
+class RepositoryPaths:
+    '''
+    Resolves the paths of a NAMASTOX repository (RAs, cache, substances...). Every
+    path is validated, and the folder created if needed, only the first time it
+    is requested. The paths must be invalidated when the configuration changes.
+    By default, the configuration is obtained with read_config, but it can be
+    provided in the constructor, to work with other repositories (see use_paths)
+    '''
+    def __init__(self, config=None):
+        self.configuration = config
+        self.paths = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def fromRoot(cls, root_path):
+        ''' returns paths for the repository placed at the root folder given as argument '''
+        root_path = os.path.abspath(root_path)
+        return cls({'root_repository': root_path,
+                    'ras': os.path.join(root_path, 'ras'),
+                    'config_status': True})
+
+    def getConfig(self):
+        ''' returns a tuple (success, configuration) '''
+        if self.configuration is not None:
+            return True, self.configuration
+        return read_file_config()
+
+    def invalidate(self):
+        with self.lock:
+            self.paths = {}
+
+    def resolve(self, key, getter):
+        ''' returns the path identified by key, obtained calling getter with the configuration
+            and created if it does not exist, only the first time is requested
+        '''
+        path = self.paths.get(key)
+        if path is not None:
+            return path
+
+        success, config = self.getConfig()
+        if not success:
+            return None
+
+        path = getter(config)
+        with self.lock:
+            if not os.path.isdir(path):
+                os.makedirs(path, exist_ok=True)
+            self.paths[key] = path
+        return path
+
+    def ras(self):
+        return self.resolve(('ras',), lambda config: config['ras'])
+
+    def cache(self, *items):
+        return self.resolve(('cache',)+items, lambda config: os.path.join(config['root_repository'], 'cache', *items))
+
+    def substances(self, *items):
+        return self.resolve(('substances',)+items, lambda config: os.path.join(config['root_repository'], 'substances', *items))
+
+# paths of the repository defined in the configuration file
+DEFAULT_PATHS = RepositoryPaths()
+
+# version (mtime, size) of the configuration file read (see reload_config_if_changed)
+CONFIG_REVISION = None
+
+# paths injected in the current context (thread or asyncio task) with use_paths, overriding the default
+CURRENT_PATHS = contextvars.ContextVar('namastox_paths', default=None)
+
+def get_paths():
+    '''
+    Returns the RepositoryPaths used in the current context
+    '''
+    paths = CURRENT_PATHS.get()
+    if paths is None:
+        return DEFAULT_PATHS
+    return paths
+
+@contextlib.contextmanager
+def use_paths(paths):
+    '''
+    Context manager making every function in NAMASTOX work with the repository given as argument, 
+    as a RepositoryPaths or a root folder, within the current context. For example
+
+    with use_paths('/data/tenant1'):
+        action_list(...)
+    '''
+    if not isinstance(paths, RepositoryPaths):
+        paths = RepositoryPaths.fromRoot(paths)
+    token = CURRENT_PATHS.set(paths)
+    try:
+        yield paths
+    finally:
+        CURRENT_PATHS.reset(token)
+
+def repository_root():
+    '''
+    Returns the absolute path of the root of the repository used in the current context, used to
+    identify the repository (e.g. in the keys of the calls coalesced). None if it is not configured
+    '''
+    success, config = get_paths().getConfig()
+    if not success or config.get('root_repository') is None:
+        return None
+    return os.path.abspath(config['root_repository'])
+
+def invalidate_paths():
+    '''
+    Forgets the paths resolved, which will be validated again when requested
+    '''
+    get_paths().invalidate()
+
 def ra_repository_path():
     '''
     Returns the path to the root of the raname repository,
     containing all ranames and versions
     '''
-    success, config = read_config()
-    if success: 
-        repository_path = config['ras']
-        if not os.path.isdir(repository_path):
-            os.makedirs(repository_path)
-        return repository_path
-        
-    return None
+    return get_paths().ras()
+
+def cache_repository_path(*items):
+    '''
+    Returns the path to the cache folder, placed in the root repository next to the 
+    ras folder, or to the subfolder given as argument, creating it if it does not exist
+    '''
+    return get_paths().cache(*items)
+
+def substance_repository_path(*items):
+    '''
+    Returns the path to the substance registry folder, placed in the root repository next to the 
+    ras folder, or to the subfolder given as argument, creating it if it does not exist
+    '''
+    return get_paths().substances(*items)
 
 def ra_path(raname):
     '''
     Returns the path to the raname given as argumen, containg all versions
     '''
     base_path = ra_repository_path()
-    if os.path.isdir(base_path):
+    if base_path is not None:
         return os.path.join(base_path, raname)
     
     return None
@@ -68,6 +191,21 @@ def ra_path(raname):
 #     return path_expand (ra_tree_path(raname), version)
 
 def read_config():
+    '''
+    Returns the configuration of the repository used in the current context, 
+    read from the configuration file unless injected with use_paths.
+
+    Returns:
+    --------
+    Boolean, dict
+    '''
+    paths = CURRENT_PATHS.get()
+    if paths is not None:
+        return paths.getConfig()
+
+    return read_file_config()
+
+def read_file_config():
     '''
     Reads configuration file "config.yaml" and checks
     sanity of raname repository path.
@@ -77,12 +215,14 @@ def read_config():
     Boolean, dict
     '''
 
+    global CONFIG_REVISION
+
     if 'namastox_configuration' in globals():
         return True, globals()['namastox_configuration']
 
     try:
-        source_dir = os.path.dirname(os.path.dirname(__file__)) 
-        config_nam = os.path.join(source_dir,'config.yaml')
+        config_nam = config_file()
+        revision = config_revision()
         with open(config_nam,'r') as f:
             conf = yaml.safe_load(f)
     except Exception as e:
@@ -109,11 +249,53 @@ def read_config():
                 conf[i] = os.path.abspath(conf[i])
             except:
                 return False, f'Configuration file incorrect. Unable to convert "{conf[i]}" to a valid path.'
-        
+
     globals()['namastox_configuration'] = conf
+    CONFIG_REVISION = revision
 
     return True, conf
 
+def config_file():
+    '''
+    Returns the path of the configuration file "config.yaml"
+    '''
+    source_dir = os.path.dirname(os.path.dirname(__file__)) 
+    return os.path.join(source_dir,'config.yaml')
+
+def config_revision():
+    '''
+    Returns a tuple (mtime, size) identifying the version of the configuration file, or None if it
+    does not exist
+    '''
+    try:
+        config_stat = os.stat(config_file())
+    except OSError:
+        return None
+    return (config_stat.st_mtime_ns, config_stat.st_size)
+
+def reload_config_if_changed():
+    '''
+    Forgets the configuration and the repository paths if the configuration file changed since it was
+    read (e.g. by "namastox -c config" run in another process), so they are read again when needed.
+    Returns True if they were forgotten. Used by long running processes, such as the daemon
+    '''
+    if not 'namastox_configuration' in globals() or config_revision() == CONFIG_REVISION:
+        return False
+
+    globals().pop('namastox_configuration', None)
+    DEFAULT_PATHS.invalidate()
+    return True
+
+def apply_log_config():
+    '''
+    Applies the optional settings of the log file ("log_dir" and "log_level") of the configuration file.
+    Called once, when the process starts (see namastox_scr.main and daemon.serve)
+    '''
+    success, conf = read_config()
+    if success and ('log_dir' in conf or 'log_level' in conf):
+        from namastox.logger import configure_logging
+        configure_logging(conf.get('log_dir'), conf.get('log_level'))
+
 def set_repositories(root_path):
     """
     Set the raname repository path.
@@ -151,12 +333,78 @@ def write_config(config: dict) -> None:
     """Writes the configuration to disk"""
     config['config_status'] = True
     
-    globals()['flame_configuration'] = config
+    global CONFIG_REVISION
 
-    source_dir = os.path.dirname(os.path.dirname(__file__)) 
-    with open(os.path.join(source_dir,'config.yaml'), 'w') as f:
+    globals()['namastox_configuration'] = config
+    DEFAULT_PATHS.invalidate()
+
+    with open(config_file(), 'w') as f:
         yaml.dump(config, f, default_flow_style=False)
+    CONFIG_REVISION = config_revision()
+
+
+# calls in progress of the functions decorated with single_flight, indexed by function and arguments
+INFLIGHT_CALLS = {}
+INFLIGHT_LOCK = threading.Lock()
+
+def single_flight(*arguments):
+    '''
+    Decorator making concurrent calls of the function with the same values of the arguments
+    given as names (e.g. 'raname', 'step', 'out') in the same repository share a single execution: 
+    the first call runs the function and the calls arriving while it runs wait and receive a copy 
+    of the same result (or the same exception). Used by read-only actions requested by many 
+    clients at once
+    '''
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            try:
+                key = (func.__module__, func.__qualname__, repository_root(), 
+                       tuple(bound.arguments[iarg] for iarg in arguments))
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+
+            with INFLIGHT_LOCK:
+                call = INFLIGHT_CALLS.get(key)
+                leader = call is None
+                if leader:
+                    call = INFLIGHT_CALLS[key] = {'done': threading.Event(), 'result': None, 'error': None, 'waiters': 0}
+                else:
+                    call['waiters'] += 1
+
+            if not leader:
+                from namastox.metrics import COALESCED_TOTAL
+                COALESCED_TOTAL.inc(action=func.__name__)
+                call['done'].wait()
+                if call['error'] is not None:
+                    raise call['error']
+                return copy.deepcopy(call['result'])
+
+            try:
+                result = func(*args, **kwargs)
+                call['result'] = result
+            except BaseException as e:
+                # also KeyboardInterrupt or SystemExit, which must not look like a successful call
+                call['error'] = e
+                raise
+            finally:
+                with INFLIGHT_LOCK:
+                    del INFLIGHT_CALLS[key]
+                call['done'].set()
+
+            # no more waiters can join now. The result kept in call is only read by the waiters,
+            # which receive copies, so the caller can modify its own result
+            if call['waiters'] > 0:
+                return copy.deepcopy(result)
+            return result
 
+        return wrapper
+    return decorator
 
 def id_generator(size=10, chars=string.ascii_uppercase + string.digits):
     '''
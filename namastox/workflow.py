@@ -23,12 +23,14 @@
 # import yaml
 import os
 import sys
+import time
 import pickle
-import pandas as pd
-import numpy as np
+import threading
 from namastox.utils import ra_path, TASK_TYPES
 from namastox.node import Node
 from namastox.logger import get_logger
+from namastox.trace import traced
+from namastox.metrics import WORKFLOW_LOAD_SECONDS
 from namastox.node import Node
 
 LOG = get_logger(__name__)
@@ -45,6 +47,18 @@ EXPOSURE_STROKE = '#C3CDE0'
 WORKFLOW_FILL = '#FFFF00'
 WORKFLOW_STROKE = '#FFFF00'
 
+# compiled workflows, indexed by pickle path. Only used in long running processes (see enableCache)
+WORKFLOW_CACHE = None
+WORKFLOW_CACHE_LOCK = threading.Lock()
+
+def enableCache ():
+    ''' keeps in memory the compiled workflows loaded, so the pickles are only read again when they
+        change. The nodes are shared by all the Workflow objects and must not be modified
+    '''
+    global WORKFLOW_CACHE
+    with WORKFLOW_CACHE_LOCK:
+        WORKFLOW_CACHE = {}
+
 class Workflow:
     ''' Class storing all the risk assessment information
     '''
@@ -72,8 +86,11 @@ class Workflow:
             sys.exit(-1)
 
 
+    @traced
     def import_table (self):
         ''' parse a TSV defining the workflow '''
+        import numpy as np
+        import pandas as pd
 
         table_path = os.path.join (self.rapath,self.workflow)
         
@@ -119,6 +136,7 @@ class Workflow:
 
         return True
          
+    @traced
     def load(self):       
         ''' load the Expert object from a pickle
         '''
@@ -128,8 +146,20 @@ class Workflow:
         # DEBUG ONLY!!!
         # print ('debug trick in workflow 126')
         # if True:
-            return self.import_table()
+            with WORKFLOW_LOAD_SECONDS.time(source='table'):
+                return self.import_table()
         
+        start = time.perf_counter()
+        if WORKFLOW_CACHE is not None:
+            pickl_stat = os.stat(pickl_path)
+            revision = (pickl_stat.st_mtime_ns, pickl_stat.st_size)
+            with WORKFLOW_CACHE_LOCK:
+                entry = WORKFLOW_CACHE.get(pickl_path)
+            if entry is not None and entry[0] == revision:
+                self.nodes, self.firstNodeId, self.catalogue = entry[1]
+                WORKFLOW_LOAD_SECONDS.observe(time.perf_counter()-start, source='cache')
+                return True
+
         with open(pickl_path,'rb') as f:
             self.nodes = pickle.load(f)
             self.firstNodeId = pickle.load(f)
@@ -137,7 +167,12 @@ class Workflow:
                 self.catalogue = pickle.load(f)
             except:
                 return False
+
+        if WORKFLOW_CACHE is not None:
+            with WORKFLOW_CACHE_LOCK:
+                WORKFLOW_CACHE[pickl_path] = (revision, (self.nodes, self.firstNodeId, self.catalogue))
             
+        WORKFLOW_LOAD_SECONDS.observe(time.perf_counter()-start, source='pickle')
         return True
 
     def save (self):
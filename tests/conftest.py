@@ -0,0 +1,36 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX test fixtures
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from namastox.logger import configure_logging
+from namastox.utils import use_paths
+
+@pytest.fixture(scope='session', autouse=True)
+def log_dir(tmp_path_factory):
+    ''' writes the log of the tests in a temporary folder, instead of the current directory '''
+    configure_logging(directory=str(tmp_path_factory.mktemp('log')))
+
+@pytest.fixture
+def repository(tmp_path):
+    ''' runs the test on an empty repository in a temporary folder, returning its RepositoryPaths '''
+    with use_paths(str(tmp_path)) as paths:
+        yield paths
@@ -0,0 +1,123 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the asyncio interface
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import asyncio
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from namastox import aio, utils
+
+@pytest.fixture
+def pools():
+    ''' stops the pools of aio after the test '''
+    yield
+    aio.shutdown()
+
+def test_ra_lock_order(repository):
+    ''' reads share the lock, writes wait for the reads running and go before the reads arriving later '''
+    events = []
+
+    async def action(name, mode, seconds):
+        async with aio.lockRa('ra1', mode):
+            events.append(f'{name}+')
+            await asyncio.sleep(seconds)
+            events.append(f'{name}-')
+
+    async def main():
+        await asyncio.gather(action('r1', aio.READ, 0.1), action('r2', aio.READ, 0.1),
+                             action('w1', aio.WRITE, 0.05), action('r3', aio.READ, 0.01))
+
+    asyncio.run(main())
+    assert events[:2] == ['r1+', 'r2+']
+    assert events[4:] == ['w1+', 'w1-', 'r3+', 'r3-']
+    assert aio.RA_LOCKS == {}
+
+def test_ra_lock_other_ras(repository):
+    ''' writes on different RAs, or on the same RA in different repositories, run at the same time '''
+    events = []
+
+    async def write(raname, root):
+        with utils.use_paths(root):
+            async with aio.lockRa(raname, aio.WRITE):
+                events.append(f'{raname}+')
+                await asyncio.sleep(0.05)
+                events.append(f'{raname}-')
+
+    async def main(tmp_root):
+        await asyncio.gather(write('ra1', tmp_root+'/a'), write('ra2', tmp_root+'/a'), write('ra1', tmp_root+'/b'))
+
+    asyncio.run(main(repository.configuration['root_repository']))
+    assert events[:3] == ['ra1+', 'ra2+', 'ra1+']
+
+def test_reads_coalesced(repository, pools, monkeypatch):
+    calls = []
+
+    def slowRead(raname):
+        calls.append(raname)
+        time.sleep(0.2)
+        return True, {'raname': raname}
+
+    monkeypatch.setattr(utils, 'slowRead', slowRead, raising=False)
+
+    async def main():
+        return await asyncio.gather(*[aio.run('utils', 'slowRead', aio.READ, aio.THREAD, iraname)
+                                      for iraname in ['ra1', 'ra1', 'ra1', 'ra2']])
+
+    results = asyncio.run(main())
+    assert sorted(calls) == ['ra1', 'ra2']
+    assert results[0] == results[2] == (True, {'raname': 'ra1'})
+    assert aio.INFLIGHT == {}
+
+def test_repository_in_workers(repository, pools):
+    ''' actions run in worker processes use the repository of the caller '''
+    result = asyncio.run(aio.run('utils', 'repository_root', aio.READ, aio.PROCESS))
+    assert result == repository.configuration['root_repository']
+
+def test_broken_pool_recreated(repository, pools):
+    pool = aio.getPool(aio.PROCESS)
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+
+    result = asyncio.run(aio.run('utils', 'repository_root', aio.READ, aio.PROCESS))
+    assert result == repository.configuration['root_repository']
+    assert aio.getPool(aio.PROCESS) is not pool
+
+def test_coalesced_results_copied(repository, pools, monkeypatch):
+    ''' every caller of a coalesced read can modify its result without changing the results of the others '''
+    def slowRead(raname):
+        time.sleep(0.2)
+        return True, {'values': [1]}
+
+    monkeypatch.setattr(utils, 'slowRead', slowRead, raising=False)
+
+    async def modify():
+        success, results = await aio.run('utils', 'slowRead', aio.READ, aio.THREAD, 'ra1')
+        results['values'].append(2)
+        return results
+
+    async def main():
+        return await asyncio.gather(*[modify() for i in range(4)])
+
+    results = asyncio.run(main())
+    assert results == [{'values': [1, 2]}]*4
+    assert len(set(id(i) for i in results)) == 4
@@ -0,0 +1,90 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the benchmark helpers
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import subprocess
+import pytest
+from namastox.benchmark import parseImportTime, percentiles, folderSize, compareBaseline
+
+IMPORT_TIME = '''import time: self [us] | cumulative | imported package
+import time:       100 |        100 |   _io
+import time:       200 |        300 | marshal
+import time:        50 |         50 |     encodings.aliases
+import time:       400 |       1450 |   encodings
+import time:      1000 |       2500 | yaml
+'''
+
+def test_parse_import_time():
+    total, modules = parseImportTime(IMPORT_TIME)
+    assert modules == [('yaml', 0.0025), ('marshal', 0.0003)]
+    assert total == pytest.approx(0.0028)
+
+def test_parse_import_time_ignores_other_lines():
+    total, modules = parseImportTime('INFO - completed\nimport time: wrong line\n' + IMPORT_TIME)
+    assert len(modules) == 2
+    assert parseImportTime('') == (0, [])
+
+def test_parse_import_time_python():
+    ''' parses the output of the running interpreter '''
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import json'], capture_output=True, text=True)
+    total, modules = parseImportTime(process.stderr)
+    assert 'json' in [i[0] for i in modules]
+    assert total > 0
+
+def test_percentiles():
+    results = percentiles([i/100.0 for i in range(100, 0, -1)])
+    assert results['count'] == 100
+    assert results['min'] == 0.01
+    assert results['max'] == 1.0
+    assert results['mean'] == pytest.approx(0.505)
+    assert (results['p50'], results['p90'], results['p95'], results['p99']) == (0.5, 0.9, 0.95, 0.99)
+
+def test_percentiles_nearest_rank():
+    results = percentiles([3.0, 1.0, 2.0])
+    assert (results['p50'], results['p90'], results['p99']) == (2.0, 3.0, 3.0)
+
+    results = percentiles([5.0])
+    assert results['min'] == results['p50'] == results['p99'] == results['max'] == 5.0
+
+def test_folder_size(tmp_path):
+    (tmp_path / 'a.yaml').write_text('x'*10)
+    (tmp_path / 'b.yaml').write_text('x'*5)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'c.yaml').write_text('x'*100)
+    assert folderSize(str(tmp_path)) == (2, 15)
+
+def test_compare_baseline():
+    baseline = {'case': {'load': {'min': 1.0, 'peak_kb': 100.0}, 'html': {'min': 1.0, 'peak_kb': 100.0},
+                         'yaml': {'min': 1.0}}}
+    current = {'case': {'load': {'min': 1.1, 'peak_kb': 110.0}, 'html': {'min': 1.0, 'peak_kb': 200.0},
+                        'yaml': {'min': 2.0}},
+               'new': {'load': {'min': 1.0}}}
+
+    comparison, regressions = compareBaseline(current, baseline)
+    assert sorted(regressions) == ['case/html', 'case/yaml']
+    assert comparison['case']['html']['memory_regression'] and not comparison['case']['html']['time_regression']
+    assert comparison['case']['yaml']['time_regression'] and comparison['case']['yaml']['memory_ratio'] is None
+    assert not comparison['case']['load']['regression']
+    assert not 'new' in comparison
+
+    comparison, regressions = compareBaseline(current, baseline, tolerance=1.5, memory_tolerance=1.5)
+    assert regressions == []
@@ -0,0 +1,92 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the prediction cache
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from namastox.cache import PredictionCache
+
+PREDICTIONS = {'KEY-A': {'value': 1.5, 'lower': 1.0, 'upper': 2.0},
+               'KEY-B': {'value': 0, 'lower': None, 'upper': None}}
+
+def test_database_in_cache_folder(repository):
+    PredictionCache()
+    assert os.path.isfile(os.path.join(repository.cache(), 'predictions.db'))
+
+def test_put_get(repository):
+    cache = PredictionCache()
+    cache.put('model1', 2, 100.0, True, PREDICTIONS)
+
+    hits = cache.get('model1', 2, 100.0, ['KEY-A', 'KEY-B', 'KEY-C'])
+    assert set(hits.keys()) == {'KEY-A', 'KEY-B'}
+    assert hits['KEY-A'] == {'quantitative': True, 'value': 1.5, 'lower': 1.0, 'upper': 2.0}
+    assert hits['KEY-B']['value'] == 0
+    assert hits['KEY-B']['lower'] is None
+
+def test_other_model_version_or_timestamp(repository):
+    ''' predictions of other models, versions or builds of the model (timestamp) are not returned '''
+    cache = PredictionCache()
+    cache.put('model1', 2, 100.0, False, PREDICTIONS)
+
+    assert cache.get('model2', 2, 100.0, ['KEY-A']) == {}
+    assert cache.get('model1', 3, 100.0, ['KEY-A']) == {}
+    assert cache.get('model1', 2, 200.0, ['KEY-A']) == {}
+    assert cache.get('model1', 2, None, ['KEY-A']) == {}
+
+def test_replace(repository):
+    cache = PredictionCache()
+    cache.put('model1', 2, 100.0, True, PREDICTIONS)
+    cache.put('model1', 2, 100.0, True, {'KEY-A': {'value': 3.0, 'lower': 2.5, 'upper': 3.5}})
+    assert cache.get('model1', 2, 100.0, ['KEY-A'])['KEY-A']['value'] == 3.0
+
+def test_no_timestamp_not_stored(repository):
+    cache = PredictionCache()
+    cache.put('model1', 2, None, True, PREDICTIONS)
+    cache.put('model1', 2, 100.0, True, {})
+    assert cache.get('model1', 2, 100.0, list(PREDICTIONS.keys())) == {}
+
+def test_many_keys(repository):
+    ''' queries with more keys than the SQL parameters allowed in a single query '''
+    cache = PredictionCache()
+    predictions = {f'KEY-{i}': {'value': i, 'lower': None, 'upper': None} for i in range(1200)}
+    cache.put('model1', 1, 100.0, True, predictions)
+
+    hits = cache.get('model1', 1, 100.0, list(predictions.keys()) + ['KEY-1', 'missing'])
+    assert len(hits) == 1200
+    assert hits['KEY-1199']['value'] == 1199
+
+def test_numpy_values(repository):
+    import numpy as np
+    cache = PredictionCache()
+    cache.put('model1', 1, 100.0, True, {'KEY-A': {'value': np.float64(0.25), 'lower': np.int64(0), 'upper': None}})
+    hit = cache.get('model1', 1, 100.0, ['KEY-A'])['KEY-A']
+    assert hit['value'] == 0.25 and hit['lower'] == 0
+
+def test_clear(repository):
+    cache = PredictionCache()
+    cache.put('model1', 1, 100.0, True, PREDICTIONS)
+    cache.put('model2', 1, 100.0, True, PREDICTIONS)
+
+    cache.clear('model1')
+    assert cache.get('model1', 1, 100.0, ['KEY-A']) == {}
+    assert len(cache.get('model2', 1, 100.0, ['KEY-A'])) == 1
+
+    cache.clear()
+    assert cache.get('model2', 1, 100.0, ['KEY-A']) == {}
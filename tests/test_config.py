@@ -0,0 +1,67 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the configuration file
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import yaml
+import pytest
+from namastox import utils
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    ''' makes NAMASTOX read the configuration from a temporary file, returning a function writing it '''
+    path = tmp_path / 'config.yaml'
+    monkeypatch.setattr(utils, 'config_file', lambda: str(path))
+    monkeypatch.setattr(utils, 'CONFIG_REVISION', None)
+    monkeypatch.delitem(utils.__dict__, 'namastox_configuration', raising=False)
+
+    def write(root, mtime):
+        with open(path, 'w') as f:
+            yaml.dump({'root_repository': str(tmp_path / root), 'config_status': True}, f)
+        os.utime(path, ns=(mtime, mtime))
+
+    yield write
+    utils.DEFAULT_PATHS.invalidate()
+
+def test_read_config(config_file, tmp_path):
+    config_file('repo1', 10**18)
+    success, config = utils.read_file_config()
+    assert success
+    assert config['ras'] == str(tmp_path / 'repo1' / 'ras')
+    assert not utils.reload_config_if_changed()
+
+def test_reload_config_if_changed(config_file, tmp_path):
+    config_file('repo1', 10**18)
+    utils.read_file_config()
+    assert utils.DEFAULT_PATHS.ras() == str(tmp_path / 'repo1' / 'ras')
+
+    config_file('repo2', 2*10**18)
+    assert utils.reload_config_if_changed()
+    assert utils.read_file_config()[1]['root_repository'] == str(tmp_path / 'repo2')
+    assert utils.DEFAULT_PATHS.ras() == str(tmp_path / 'repo2' / 'ras')
+    assert not utils.reload_config_if_changed()
+
+def test_write_config(config_file, tmp_path):
+    config_file('repo1', 10**18)
+    success, config = utils.read_file_config()
+    config['root_repository'] = str(tmp_path / 'repo2')
+    utils.write_config(config)
+    assert not utils.reload_config_if_changed()
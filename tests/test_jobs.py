@@ -0,0 +1,98 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the job queue
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+from namastox.jobs import JobQueue, JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED, JOB_CANCELLING
+
+def succeed(value):
+    return True, value
+
+def fail(value):
+    return False, value
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return True, seconds
+
+def die():
+    os._exit(1)
+
+def waitFor(queue, job_id, timeout=30):
+    start = time.time()
+    while queue.getStatus(job_id)['finished'] is None:
+        assert time.time()-start < timeout
+        time.sleep(0.05)
+    return queue.getStatus(job_id)
+
+def test_results():
+    queue = JobQueue(max_workers=1)
+    try:
+        job_ok = queue.submit(succeed, 5)
+        job_ko = queue.submit(fail, 'error')
+        assert waitFor(queue, job_ok)['status'] == JOB_COMPLETED
+        assert waitFor(queue, job_ko)['status'] == JOB_FAILED
+        assert queue.getResult(job_ok) == (True, 5)
+        assert queue.getResult(job_ko) == (False, 'error')
+        assert queue.getStatus(job_ok) is None
+    finally:
+        queue.shutdown()
+
+def test_cancel():
+    cleaned = []
+    queue = JobQueue(max_workers=1)
+    try:
+        running = queue.submit(sleep, 1.0, cleanup=lambda: cleaned.append('running'))
+        # the pool takes one job more than workers, which cannot be cancelled any more
+        queue.submit(sleep, 0)
+        queued = queue.submit(sleep, 0, cleanup=lambda: cleaned.append('queued'))
+        while queue.getStatus(running)['status'] != 'running':
+            time.sleep(0.05)
+
+        assert queue.cancel(queued) == JOB_CANCELLED
+        assert queue.getStatus(queued) is None
+        assert queue.cancel(running) == JOB_CANCELLING
+        assert queue.getStatus(running)['status'] == JOB_CANCELLING
+        assert queue.getResult(running)[0] is False
+
+        start = time.time()
+        while queue.getStatus(running) is not None:
+            assert time.time()-start < 30
+            time.sleep(0.05)
+        assert sorted(cleaned) == ['queued', 'running']
+        assert queue.cancel(running) is None
+    finally:
+        queue.shutdown()
+
+def test_broken_pool():
+    ''' the jobs of a pool broken by a dead worker fail and the next jobs run in a new pool '''
+    queue = JobQueue(max_workers=1)
+    try:
+        job_id = queue.submit(die)
+        assert waitFor(queue, job_id)['status'] == JOB_FAILED
+        assert queue.getResult(job_id)[0] is False
+
+        job_id = queue.submit(succeed, 1)
+        assert waitFor(queue, job_id)['status'] == JOB_COMPLETED
+        assert queue.getResult(job_id) == (True, 1)
+    finally:
+        queue.shutdown()
@@ -0,0 +1,67 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the logging setup
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import pytest
+from namastox import logger
+from namastox.logger import get_logger, configure_logging
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+@pytest.fixture
+def file_level():
+    ''' restores the level of the log file after the test '''
+    level = logger.LOG_LEVEL
+    yield
+    configure_logging(level=level)
+
+def test_disabled_level_rejected(file_level):
+    ''' messages below the levels of the file and the console never create a record '''
+    configure_logging(level='WARNING')
+    log = get_logger('namastox.test')
+    handler = RecordingHandler()
+    logging.getLogger(logger.ROOT_LOGGER).addHandler(handler)
+    try:
+        assert not log.isEnabledFor(logging.DEBUG)
+        log.debug('disabled')
+        assert handler.records == []
+
+        # INFO is still shown in the console
+        assert log.isEnabledFor(logging.INFO)
+        log.info('enabled')
+        assert [i.getMessage() for i in handler.records] == ['enabled']
+    finally:
+        logging.getLogger(logger.ROOT_LOGGER).removeHandler(handler)
+
+def test_debug_level(file_level):
+    configure_logging(level='DEBUG')
+    assert get_logger('namastox.test').isEnabledFor(logging.DEBUG)
+
+def test_names_outside_hierarchy():
+    assert get_logger('__main__').name == 'namastox.__main__'
+    assert get_logger('namastox.ra').name == 'namastox.ra'
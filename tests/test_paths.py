@@ -0,0 +1,106 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the repository path service
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import asyncio
+import threading
+from namastox import utils
+from namastox.utils import RepositoryPaths, use_paths, get_paths, read_config, repository_root
+from namastox.aio import callAction
+
+def test_from_root(tmp_path):
+    paths = RepositoryPaths.fromRoot(str(tmp_path))
+    success, config = paths.getConfig()
+    assert success
+    assert config['root_repository'] == str(tmp_path)
+    assert paths.ras() == os.path.join(str(tmp_path), 'ras')
+
+def test_paths_created_on_request(tmp_path):
+    paths = RepositoryPaths.fromRoot(str(tmp_path))
+    assert not os.path.exists(tmp_path / 'cache')
+    cache_path = paths.cache('similarity')
+    assert cache_path == os.path.join(str(tmp_path), 'cache', 'similarity')
+    assert os.path.isdir(cache_path)
+
+def test_paths_resolved_once(tmp_path):
+    paths = RepositoryPaths.fromRoot(str(tmp_path))
+    first = paths.substances()
+    os.rmdir(first)
+    assert paths.substances() == first
+    assert not os.path.isdir(first)
+
+    paths.invalidate()
+    assert os.path.isdir(paths.substances())
+
+def test_use_paths(repository, tmp_path):
+    assert get_paths() is repository
+    assert utils.ra_repository_path() == os.path.join(str(tmp_path), 'ras')
+    assert utils.ra_path('ra1') == os.path.join(str(tmp_path), 'ras', 'ra1')
+    assert utils.cache_repository_path() == os.path.join(str(tmp_path), 'cache')
+    assert read_config() == (True, repository.configuration)
+    assert repository_root() == str(tmp_path)
+
+def test_use_paths_restored(tmp_path):
+    previous = get_paths()
+    with use_paths(str(tmp_path / 'a')):
+        with use_paths(str(tmp_path / 'b')):
+            assert repository_root() == str(tmp_path / 'b')
+        assert repository_root() == str(tmp_path / 'a')
+    assert get_paths() is previous
+
+def test_use_paths_threads(tmp_path):
+    ''' every thread works with its own repository '''
+    barrier = threading.Barrier(4)
+    roots = {}
+
+    def worker(i):
+        with use_paths(str(tmp_path / f'r{i}')):
+            barrier.wait()
+            roots[i] = utils.ra_repository_path()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for ithread in threads:
+        ithread.start()
+    for ithread in threads:
+        ithread.join()
+
+    for i in range(4):
+        assert roots[i] == os.path.join(str(tmp_path), f'r{i}', 'ras')
+
+def test_use_paths_tasks(repository, tmp_path):
+    ''' asyncio tasks inherit the repository of the context where they are created '''
+    async def root():
+        return repository_root()
+
+    async def main():
+        return await asyncio.gather(asyncio.ensure_future(root()), root())
+
+    assert asyncio.run(main()) == [str(tmp_path), str(tmp_path)]
+
+def test_use_paths_workers(repository, tmp_path):
+    ''' the configuration sent to the workers of aio selects the same repository '''
+    success, config = repository.getConfig()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(callAction('utils', 'ra_repository_path', config, (), {})))
+    thread.start()
+    thread.join()
+    assert result == [os.path.join(str(tmp_path), 'ras')]
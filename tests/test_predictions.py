@@ -0,0 +1,76 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the prediction tables
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from namastox.manage import buildPredictionTable, renderPredictionTable, tableToDict
+
+def modelInfo(quantitative, confidence=None, parameter='p', unit='u'):
+    return {'quantitative': quantitative, 'confidence': confidence, 'parameter': parameter, 
+            'unit': unit, 'interpretation': 'i', 'method': 'm'}
+
+INFO = [modelInfo(True, 95, 'LD50', 'mg/kg'), modelInfo(False, 80, 'Ames', '')]
+
+PREDICTIONS = {'ld50': {'rows': {'K1': {'value': 1.5, 'lower': 1.0, 'upper': 2.0},
+                                 'K2': {'value': 3.0, 'lower': 2.5, 'upper': 3.5}}},
+               'ames': {'rows': {'K1': {'value': 0, 'lower': None, 'upper': None},
+                                 'K2': {'value': 1, 'lower': None, 'upper': None}}}}
+
+def test_table():
+    table = buildPredictionTable(['ethanol', 'benzene'], ['K1', 'K2'], ['ld50', 'ames'], INFO, PREDICTIONS)
+    assert table['molnames'] == ['ethanol', 'benzene']
+    assert table['value'].shape == (2, 2)
+    assert np.array_equal(table['value'], [[1.5, 0], [3.0, 1]])
+    assert np.array_equal(table['upper'][:,0], [2.0, 3.5])
+
+    rendered = renderPredictionTable(table)
+    assert rendered['molnames'] == ['ethanol', 'ethanol', 'benzene', 'benzene']
+    assert rendered['models'] == ['ld50', 'ames', 'ld50', 'ames']
+    assert rendered['results'] == ['1.5000', 'negative', '3.0000', 'positive']
+    assert rendered['uncertainty'] == ['1.0000 to 2.0000 (%95 conf.)', '%80 conf.', 
+                                       '2.5000 to 3.5000 (%95 conf.)', '%80 conf.']
+    assert rendered['parameters'] == ['LD50', 'Ames', 'LD50', 'Ames']
+
+def test_table_empty():
+    table = buildPredictionTable(['ethanol', 'benzene'], ['K1', 'K2'], [], [], {})
+    assert table['value'].shape == (2, 0)
+
+    rendered = renderPredictionTable(table)
+    assert rendered['molnames'] == []
+    assert rendered['results'] == []
+    assert rendered['uncertainty'] == []
+
+    assert tableToDict(table)['values'] == [[], []]
+
+def test_table_missing_values():
+    ''' molecules without prediction, or without confidence interval, are rendered empty '''
+    predictions = {'ld50': {'rows': {'K1': {'value': 1.5, 'lower': None, 'upper': None}}},
+                   'ames': {'rows': {'K2': {'value': 1, 'lower': None, 'upper': None}}}}
+    table = buildPredictionTable(['ethanol', 'benzene'], ['K1', 'K2'], ['ld50', 'ames'], INFO, predictions)
+    assert np.isnan(table['value'][1,0])
+    assert np.isnan(table['value'][0,1])
+
+    rendered = renderPredictionTable(table)
+    assert rendered['results'] == ['1.5000', 'uncertain', None, 'positive']
+    assert rendered['uncertainty'] == ['', '%80 conf.', '', '%80 conf.']
+
+    values = tableToDict(table)['values']
+    assert values == [[1.5, None], [None, 1.0]]
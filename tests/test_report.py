@@ -0,0 +1,54 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the reports
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from namastox import report
+
+def reportOrDie(raname, report_format):
+    if raname == 'bad':
+        os._exit(1)
+    return raname, report_format, True, f'{raname}.{report_format}'
+
+def makeRas(repository, ranames):
+    for raname in ranames:
+        os.makedirs(os.path.join(repository.ras(), raname))
+
+def test_batch_survives_dead_worker(repository, monkeypatch):
+    makeRas(repository, ['bad', 'ra1', 'ra2', 'ra3'])
+    monkeypatch.setattr(report, '_report_worker', reportOrDie)
+
+    success, summary = report.action_report_batch(['*'], ['yaml'], workers=2, force=True)
+
+    assert success
+    assert [i['raname'] for i in summary['failed']] == ['bad']
+    assert 'worker process died' in summary['failed'][0]['error']
+    assert sorted(i['raname'] for i in summary['completed']) == ['ra1', 'ra2', 'ra3']
+
+def test_html_link():
+    assert report.htmlLink('https://example.org/a?b=1&c=2') == '<a href="https://example.org/a?b=1&amp;c=2">https://example.org/a?b=1&amp;c=2</a>'
+    assert report.htmlLink('mailto:someone@example.org').startswith('<a href="mailto:')
+    assert report.htmlLink('docs/study.pdf') == '<a href="docs/study.pdf">docs/study.pdf</a>'
+    assert report.htmlLink(None) == ''
+
+    for url in ['javascript:alert(1)', ' JavaScript:alert(1)', 'java\tscript:alert(1)', 'data:text/html,<script>x</script>']:
+        assert not '<a' in report.htmlLink(url)
+        assert not '<script>' in report.htmlLink(url)
@@ -0,0 +1,137 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the substance similarity index
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import numpy as np
+import pytest
+from rdkit import Chem
+from namastox.substance import SubstanceRegistry, computeFingerprint, FP_BITS
+from namastox.similarity import SimilarityIndex, popcount, searchSimilar
+
+def fingerprint(smiles):
+    return computeFingerprint(Chem.MolFromSmiles(smiles))
+
+def test_popcount():
+    rng = np.random.default_rng(0)
+    fingerprints = rng.integers(0, 256, size=(20, FP_BITS//8), dtype=np.uint8)
+    expected = np.unpackbits(fingerprints, axis=1).sum(axis=1)
+    assert np.array_equal(popcount(fingerprints), expected)
+    assert popcount(fingerprints[:0]).shape == (0,)
+
+def test_refresh(repository):
+    registry = SubstanceRegistry()
+    registry.register([{'smiles': 'CCO', 'name': 'ethanol'}, {'smiles': 'c1ccccc1', 'name': 'benzene'}], 'ra1')
+
+    index = SimilarityIndex()
+    assert index.refresh() == 2
+    assert len(index.keys) == 2
+    assert index.refresh() == 0
+
+    registry.register([{'smiles': 'CCCO', 'name': 'propanol'}], 'ra2')
+    assert index.refresh() == 1
+    assert len(index.keys) == 3
+
+def test_refresh_updated_entries(repository):
+    ''' entries updated (e.g. used in a new RA) are replaced, not duplicated '''
+    registry = SubstanceRegistry()
+    registry.register([{'smiles': 'CCO', 'name': 'ethanol'}], 'ra1')
+    index = SimilarityIndex()
+    index.refresh()
+
+    registry.register([{'smiles': 'OCC', 'name': 'EtOH'}], 'ra2')
+    assert index.refresh() == 1
+    assert len(index.keys) == 1
+    assert index.fingerprints.shape[0] == 1
+
+def test_refresh_clock_independent(repository, monkeypatch):
+    ''' rows written after the last refresh are found even if their time stamp is older '''
+    registry = SubstanceRegistry()
+    registry.register([{'smiles': 'CCO'}], 'ra1')
+    index = SimilarityIndex()
+    index.refresh()
+
+    monkeypatch.setattr(time, 'time', lambda: 0.0)
+    registry.register([{'smiles': 'CCCO'}], 'ra2')
+    assert index.refresh() == 1
+    assert len(index.keys) == 2
+
+def test_registry_ras(repository):
+    ''' the RAs listed in every entry follow the substances registered, removed and renamed '''
+    registry = SubstanceRegistry()
+    ethanol, benzene = registry.register([{'smiles': 'CCO'}, {'smiles': 'c1ccccc1'}], 'ra1')
+    registry.register([{'smiles': 'CCO'}], 'ra2')
+
+    registry.register([{'smiles': 'CCO'}], 'ra1')
+    assert registry.get(ethanol)['ras'] == ['ra1', 'ra2']
+    assert registry.get(benzene)['ras'] == []
+
+    registry.replaceRa('ra1', 'ra3')
+    assert registry.get(ethanol)['ras'] == ['ra2', 'ra3']
+
+    registry.replaceRa('ra2')
+    registry.register([], 'ra3')
+    assert registry.get(ethanol)['ras'] == []
+
+def test_save_load(repository):
+    SubstanceRegistry().register([{'smiles': 'CCO'}, {'smiles': 'CCN'}], 'ra1')
+    index = SimilarityIndex()
+    index.refresh()
+
+    loaded = SimilarityIndex()
+    assert loaded.load()
+    assert loaded.keys == index.keys
+    assert loaded.watermark == index.watermark
+    assert np.array_equal(loaded.fingerprints, index.fingerprints)
+    assert loaded.refresh() == 0
+
+def test_search(repository):
+    SubstanceRegistry().register([{'smiles': 'CCO'}, {'smiles': 'CCCO'}, {'smiles': 'c1ccccc1'}], 'ra1')
+    index = SimilarityIndex()
+    index.refresh()
+
+    hits = index.search(fingerprint('CCO'), top=3)
+    assert len(hits) == 3
+    assert hits[0][1] == pytest.approx(1.0)
+    assert [i[1] for i in hits] == sorted([i[1] for i in hits], reverse=True)
+    assert hits[1][0] == Chem.MolToInchiKey(Chem.MolFromSmiles('CCCO'))
+
+    assert len(index.search(fingerprint('CCO'), top=1)) == 1
+    assert all(i[1] >= 0.5 for i in index.search(fingerprint('CCO'), top=3, cutoff=0.5))
+
+def test_search_empty():
+    assert SimilarityIndex().search(fingerprint('CCO')) == []
+
+def test_search_similar(repository):
+    ''' only substances used in RAs still present in the repository are returned '''
+    SubstanceRegistry().register([{'smiles': 'CCO', 'name': 'ethanol'}], 'ra1')
+    SubstanceRegistry().register([{'smiles': 'CCCO', 'name': 'propanol'}], 'ra2')
+    os.makedirs(os.path.join(repository.ras(), 'ra1'))
+
+    success, results = searchSimilar('CCO', top=5)
+    assert success
+    assert [i['names'] for i in results] == [['ethanol']]
+    assert results[0]['ras'] == ['ra1']
+    assert results[0]['similarity'] == pytest.approx(1.0)
+
+    success, results = searchSimilar('not a smiles')
+    assert not success
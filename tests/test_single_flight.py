@@ -0,0 +1,137 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the coalescing of concurrent calls
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import threading
+from namastox.utils import single_flight, use_paths
+
+def runConcurrently(func, arguments):
+    ''' calls func with every argument in its own thread, all at once, and returns the results (or
+        exceptions raised) in the same order
+    '''
+    barrier = threading.Barrier(len(arguments))
+    results = [None]*len(arguments)
+
+    def worker(i, argument):
+        barrier.wait()
+        try:
+            results[i] = func(argument)
+        except BaseException as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i, iarg)) for i, iarg in enumerate(arguments)]
+    for ithread in threads:
+        ithread.start()
+    for ithread in threads:
+        ithread.join()
+    return results
+
+def test_single_call():
+    @single_flight('raname')
+    def action(raname, out='text'):
+        return True, raname
+    assert action('ra1') == (True, 'ra1')
+
+def test_coalesced():
+    calls = []
+
+    @single_flight('raname')
+    def action(raname):
+        calls.append(raname)
+        time.sleep(0.2)
+        return True, {'raname': raname}
+
+    results = runConcurrently(action, ['ra1']*6 + ['ra2']*4)
+    assert sorted(calls) == ['ra1', 'ra2']
+    assert results == [(True, {'raname': 'ra1'})]*6 + [(True, {'raname': 'ra2'})]*4
+
+def test_results_copied():
+    ''' callers receive their own copies of the result, which can be modified safely '''
+    @single_flight('raname')
+    def action(raname):
+        time.sleep(0.2)
+        return True, {'values': [1]}
+
+    def modify(raname):
+        success, results = action(raname)
+        results['values'].append(2)
+        return results
+
+    results = runConcurrently(modify, ['ra1']*5)
+    assert results == [{'values': [1, 2]}]*5
+    assert len(set(id(i) for i in results)) == 5
+
+def test_exception_propagated():
+    @single_flight('raname')
+    def action(raname):
+        time.sleep(0.2)
+        raise ValueError(raname)
+
+    results = runConcurrently(action, ['ra1']*4)
+    assert all(isinstance(i, ValueError) for i in results)
+
+def test_base_exception_propagated():
+    ''' waiters must not take an interrupted call for a successful call returning None '''
+    @single_flight('raname')
+    def action(raname):
+        time.sleep(0.2)
+        raise KeyboardInterrupt()
+
+    results = runConcurrently(action, ['ra1']*4)
+    assert all(isinstance(i, KeyboardInterrupt) for i in results)
+
+def test_not_coalesced_after_completion():
+    calls = []
+
+    @single_flight('raname')
+    def action(raname):
+        calls.append(raname)
+        return True, raname
+
+    action('ra1')
+    action('ra1')
+    assert calls == ['ra1', 'ra1']
+
+def test_repositories_not_coalesced(tmp_path):
+    ''' the same RA in different repositories are different calls '''
+    calls = []
+
+    @single_flight('raname')
+    def action(raname):
+        calls.append(raname)
+        time.sleep(0.2)
+        return True, raname
+
+    def call(root):
+        with use_paths(str(root)):
+            return action('ra1')
+
+    results = runConcurrently(call, [tmp_path / 'a', tmp_path / 'b'])
+    assert results == [(True, 'ra1')]*2
+    assert len(calls) == 2
+
+def test_unhashable_arguments():
+    @single_flight('raname')
+    def action(raname):
+        return True, raname
+
+    assert action(['ra1']) == (True, ['ra1'])
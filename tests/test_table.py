@@ -0,0 +1,90 @@
+#! -*- coding: utf-8 -*-
+
+# Description    NAMASTOX tests of the import of tables
+#
+# Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+#
+# Copyright 2022 Manuel Pastor
+#
+# This file is part of NAMASTOX
+#
+# NAMASTOX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation version 3.
+#
+# NAMASTOX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with NAMASTOX. If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from namastox.manage import sniffSeparator, iterTableContents, getTableContents
+
+ROWS = [['substance', 'method', 'parameter', 'value', 'unit', 'uncertainty', 'term', 'comments'],
+        ['ethanol', 'm1', 'LD50', '10.5', 'mg/kg', '0.5', 'SD', 'first'],
+        ['benzene', 'm1', 'LD50', '', 'mg/kg', '', '', 'second']]
+
+def writeTable(path, sep, rows=ROWS):
+    path.write_text('\n'.join(sep.join(irow) for irow in rows)+'\n')
+    return str(path)
+
+@pytest.mark.parametrize('sep', [',', ';', '\t', '|'])
+def test_sniff_separator(tmp_path, sep):
+    assert sniffSeparator(writeTable(tmp_path / 'table.txt', sep)) == sep
+
+def test_sniff_separator_incomplete_sample(tmp_path):
+    ''' the last line of the sample is cut and must not confuse the sniffer '''
+    rows = ROWS[:1] + ROWS[1:2]*200
+    filename = writeTable(tmp_path / 'table.tsv', '\t', rows)
+    assert sniffSeparator(filename, sample_size=1000) == '\t'
+
+def test_sniff_separator_default(tmp_path):
+    path = tmp_path / 'table.txt'
+    path.write_text('single column\nvalue\n')
+    assert sniffSeparator(str(path)) == ','
+
+def test_table_contents(tmp_path):
+    success, values, uncertainties = getTableContents(writeTable(tmp_path / 'table.tsv', '\t'))
+    assert success
+    assert values[0] == {'substance': 'ethanol', 'method': 'm1', 'parameter': 'LD50', 'value': 10.5, 'unit': 'mg/kg'}
+    assert values[1]['value'] is None
+    assert uncertainties == [{'uncertainty': 0.5, 'term': 'SD'}, {'uncertainty': None, 'term': None}]
+
+def test_table_contents_chunks(tmp_path):
+    rows = ROWS[:1] + [['s%d' % i, 'm1', 'p', str(i), 'u', '0', 'SD', ''] for i in range(25)]
+    chunks = list(iterTableContents(writeTable(tmp_path / 'table.csv', ',', rows), chunksize=10))
+    assert [len(ivalues) for ivalues, iuncertainties in chunks] == [10, 10, 5]
+    assert chunks[2][0][-1]['substance'] == 's24'
+
+def test_table_contents_without_uncertainties(tmp_path):
+    rows = [irow[:5] for irow in ROWS]
+    success, values, uncertainties = getTableContents(writeTable(tmp_path / 'table.csv', ';', rows))
+    assert success
+    assert uncertainties == [{}, {}]
+
+def test_table_contents_empty(tmp_path):
+    success, values, uncertainties = getTableContents(writeTable(tmp_path / 'table.csv', ',', ROWS[:1]))
+    assert not success
+
+def test_update_table_input_not_modified(repository, tmp_path):
+    from namastox.benchmark import synthesizeRa
+    from namastox.update import action_update_table
+    from namastox.ra import Ra
+
+    success, ra = synthesizeRa('ra1', 0, 1, 1, 1)
+    assert success
+    result_id = [inode for inode in ra.workflow.nodes.values() if inode.getVal('category') != 'END'][0].getVal('id')
+
+    previous = {'substance': 'water', 'method': 'm0', 'parameter': 'LD50', 'value': 1.0, 'unit': 'mg/kg'}
+    input_result = {'values': [previous], 'uncertainties': [{}], 'summary': 'imported'}
+    success, results = action_update_table('ra1', result_id, writeTable(tmp_path / 'table.tsv', '\t'), input_result)
+    assert success, results
+    assert input_result == {'values': [previous], 'uncertainties': [{}], 'summary': 'imported'}
+
+    ra = Ra('ra1')
+    ra.load()
+    result = [iresult for iresult in ra.results if iresult['id'] == result_id][0]
+    assert [ivalue['substance'] for ivalue in result['values']] == ['water', 'ethanol', 'benzene']